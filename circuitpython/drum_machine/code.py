@@ -9,6 +9,21 @@
 # - Then TEMPO key
 # - The bottom two rows of 4 keys are the drum triggers
 # - Push encoder to switch between pattern changing mode & BPM changing mode
+# - Hold TAP while recording a pad hit to accent that step
+# - Hold TAP & turn encoder to change the pattern's swing
+# - Hold drum pads & turn encoder to nudge their tracks early or late
+# - Follows MIDI clock (and START/STOP/CONTINUE/Song Position) when it's sent one
+# - MIDI notes play pads by General MIDI drum notes (or a kit's own map in its
+#   kit.json, see drum_notes.py), on the channels in midi_channel_mask
+# - Hold encoder & press MUTE to switch to the step grid view of the pattern, and back
+# - Hold encoder & press TAP to turn main loop profiling on/off (or type 'p' on
+#   the serial console, 'r' prints the profile so far), see drum_prof.py.
+#   Profiling also measures pad press & MIDI note-on to voice play() times.
+# - Type 'l' on the serial console to print audio stalls & underruns, see drum_latency.py
+# - Pads share a pool of mixer voices, a couple each so rolls ring out, and
+#   hi-hats (or a kit's choke groups, in its kit.json) cut each other off, see drum_voices.py
+# - Sends the sequence's notes out USB MIDI (and the UART, if not used for audio), with
+#   MIDI clock & soft thru if turned on below, see drum_midiout.py
 #
 #  +-------+------+------+------+------+
 #  | .---. |      |      |      |      |
@@ -35,12 +50,12 @@
 
 print("macropadsynthplug drum machine start!")
 
-import time, os, sys, json
-import board, busio, keypad, rotaryio, digitalio
+import time, sys, json
+import board, busio, keypad, rotaryio, digitalio, supervisor
 import rainbowio
 import neopixel
-import audiocore, audiomixer, audiopwmio
-from adafruit_ticks import ticks_ms, ticks_diff, ticks_add
+import audiomixer, audiopwmio
+from adafruit_ticks import ticks_ms, ticks_diff
 import usb_midi
 #import winterbloom_smolmidi as smolmidi
 import todbot_smolishmidi as smolmidi
@@ -48,8 +63,23 @@ import todbot_smolishmidi as smolmidi
 #from adafruit_midi.note_on import NoteOn
 #from adafruit_midi.note_off import NoteOff
 
-from drum_display import disp_bpm, disp_play, disp_pattern, disp_kit, disp_info, disp_encmode
+from drum_display import disp_bpm, disp_play, disp_pattern, disp_kit, disp_info, disp_encmode, disp_prof
+from drum_display import disp_refresh, disp_grid_show, disp_grid_step, disp_grid_pattern, disp_grid_playhead
 from drum_patterns import patterns_demo
+from drum_sched import StepScheduler, MonotonicClock, Groove
+from drum_engine import StepEngine
+from drum_clock import MidiClockFollower
+from drum_leds import DrumLeds
+from drum_pattstore import Pattern, level_tables
+from drum_bank import PatternBank
+from drum_kitcache import KitCache
+from drum_prof import LoopProfiler, LatencyMeter
+from drum_input import InputRing
+from drum_latency import AudioLatency
+from drum_voices import VoiceAlloc
+from drum_notes import note_table, out_notes, UNMAPPED
+from drum_midiout import MidiOut
+import drum_kitindex
 
 #time.sleep(3) # wait for USB connect a bit to avoid terible audio glitches
 
@@ -60,6 +90,23 @@ patt_index = 0  # which sequence we're playing from our list of avail patterns
 bpm = 120  # default BPM
 steps_per_beat = 4  # divisions per beat: 8 = 32nd notes, 4 = 16th notes
 num_pads = 8  # we use 8 of the 12 macropad keys as drum triggers
+patterns_file = '/saved_patterns.bin'  # binary pattern bank, see drum_bank.py
+patterns_json_file = '/saved_patterns.json'  # older JSON patterns, read if no bank yet
+kit_cache_bytes = 96 * 1024  # RAM for drum samples, kits over this are streamed from flash
+pad_velocity = 127  # pads aren't velocity sensitive, so they play & record at this
+audio_buffer_size = 0  # Mixer buffer_size bytes, 0 = auto: smallest that the stalls measured allow
+audio_buffer_file = '/audio_buffer.txt'  # auto buffer size, tuned when stopped, used from next start
+num_voices = 12  # mixer voices the pads share
+voices_per_pad = 2  # round-robin voices each pad can use, so a roll's hits ring out
+default_choke = (0, 0, 1, 1, 0, 0, 0, 0)  # choke group of each pad for kits without a kit.json: hi-hats
+midi_notes = 'gm'  # MIDI notes that play pads for kits without their own: 'gm', 'wrap' (note % 8), or each pad's notes
+midi_channel_mask = 0xFFFF  # MIDI channels notes are played from, bit N = channel N+1 (0x0200 = just 10)
+midi_velocity = 0  # 0 = notes play & record at their velocity, or 1-127 to play them all at that
+midi_out_usb = True  # send the sequence's notes out USB MIDI
+midi_out_uart = False  # and out the UART's TX on SDA, only if not use_macrosynthplug (audio's on SDA)
+midi_out_channel = 10  # MIDI channel 1-16 the notes are sent on, each pad's note is from the note map
+midi_out_clock = False  # send MIDI clock, START & STOP when playing (not when following a clock)
+midi_thru = False  # echo MIDI that comes in (channels & notes the filters let in) out too
 
 #
 # MacroPad key layout
@@ -76,14 +123,22 @@ keynum_to_padnum = (0, 4, -1, # pad nums go from bottom row of four: 0,1,2,3
                     2, 6, -1, # and top row are invalid pad nums (buttons used for transport)
                     3, 7, -1)
 
+# input sources, for drum_input.InputRing events
+SRC_KEYS, SRC_ENC_SW, SRC_ENC, SRC_MIDI_UART, SRC_MIDI_USB = range(5)
+
 #
 # Set up hardware
 #
 
 # macropadsynthplug!
-midi_uart = busio.UART(rx=board.SCL, tx=None, baudrate=31250, timeout=0.001)
-midi_uart_in = smolmidi.MidiIn(midi_uart) # can't do smolmidi because it wants port.readinto(buf,len)
-midi_usb_in = smolmidi.MidiIn(usb_midi.ports[0]) # can't do smolmidi because it wants port.readinto(buf,len)
+# notes not in the note map & channels not in the mask are dropped as they're parsed
+note_map = note_table(midi_notes, num_pads)  # MIDI note -> pad, UNMAPPED if none, filled in per kit
+midi_uart_tx = board.SDA if midi_out_uart and not use_macrosynthplug else None
+midi_uart = busio.UART(rx=board.SCL, tx=midi_uart_tx, baudrate=31250, timeout=0.001)
+midi_uart_in = smolmidi.MidiIn(midi_uart, enable_running_status=True, max_messages=16,  # per loop, see InputRing
+                               channel_mask=midi_channel_mask, note_filter=note_map)
+midi_usb_in = smolmidi.MidiIn(usb_midi.ports[0], enable_running_status=True, max_messages=16,
+                              channel_mask=midi_channel_mask, note_filter=note_map)
 #midi_uart_in = adafruit_midi.MIDI( midi_in=midi_uart) # , debug=False)
 #midi_usb_in = adafruit_midi.MIDI( midi_in=usb_midi.ports[0])
 
@@ -105,97 +160,128 @@ else:
     audio = audiopwmio.PWMAudioOut(board.SPEAKER) # built-in tiny spkr
     speaker_en = digitalio.DigitalInOut(board.SPEAKER_ENABLE)
     speaker_en.switch_to_output(value=True)
-mixer = audiomixer.Mixer(voice_count=num_pads, sample_rate=22050, channel_count=1,
-                         bits_per_sample=16, samples_signed=True, buffer_size=4096)
+latency = AudioLatency(MonotonicClock(), sample_rate=22050)  # buffer size & underruns, see drum_latency.py
+if audio_buffer_size:
+    latency.set_size(audio_buffer_size)
+else:
+    latency.load(audio_buffer_file)
+mixer = audiomixer.Mixer(voice_count=num_voices, sample_rate=22050, channel_count=1,
+                         bits_per_sample=16, samples_signed=True, buffer_size=latency.buffer_size)
 audio.play(mixer) # attach mixer to audio playback
 
 #
 # Sequence management
 #
 
-# pattern sequence data structure looks like:
+# patterns is a list of drum_pattstore.Pattern, which hold one byte per step:
+#
+#   steps    0         1         2         3     and so on (32)
+#   hits  0b00000101 0b00000000 0b00000100 0b00000000 ...
+#              |   `-- bd (pad 0)
+#              `------ hatc (pad 2)
 #
-# patterns = [
-#   { 'name': 'patt0',
-#     'seq': [
-#             # steps
-#             #                       1 1  1 1 1 1
-#             # 0 1 2 3  4 5 6 7  8 9 0 1  2 3 4 5  and so on (32)
-#             [ 1,0,0,0, 1,0,0,0, 1,0,0,0, 1,0,0,0, ... ] # bd
-#             [ 0,0,0,0, 1,0,0,0, 0,0,0,0, 1,0,0,0, ... ] # sd
-#             ... and so on to num_pads (8)
-#             ]
-#     ]
-#  },
-# ]
+# so "which pads fire at step N" is just patterns[patt_index].hits[N]
 #
 
-# extend a demo pattern that has a 'base' to a full 'seq'
+# extend a demo pattern that has a 'base' to a full 'len' Pattern
 def make_sequence_from_demo_pattern(p):
-    sq = []
-    # first convert '1010' step strings to 1,0,1,0 numeric array
-    for stepline_str in p['base']:
-        stepline = [int(c) for c in stepline_str.replace(' ','')]
-        sq.append(stepline)
-    # then extend 'base' to create 'seq'
-    num_copies = p['len'] // len(sq[0])
-    sq * num_copies
-    return sq
+    return Pattern.from_strs(p['name'], p['base'], num_steps=p['len'])
 
 last_write_time = time.monotonic()
+save_job = None  # pattern_bank.save_steps() generator while a save is in progress
+save_guard_us = 8000  # only write a piece of a save if next step is at least this far away
+display_guard_us = 10000  # only refresh the display if next step is at least this far away
+
+# start saving patterns, the actual writing is done a bit at a time by save_patterns_work()
 def save_patterns():
-    global last_write_time
-    print("saving patterns...", end='')
+    global last_write_time, save_job
+    if save_job:  # already saving
+        return
+    print("saving patterns...")
     #if ticks_ms() - last_write_time < 10: # only allow writes every 10 seconds, to save flash
     #    print("NO WRITE: TOO SOON")
     #    return
     last_write_time = time.monotonic()
-    patts_to_sav = []
-    for p in patterns:
-        seq_to_sav = [''.join(str(c) for c in l) for l in p['seq']]
-        patts_to_sav.append( {'name': p['name'], 'seq': seq_to_sav } )
-    with open('/test_saved_patterns.json', 'w') as fp:
-    #with sys.stdout as fp:
-        json.dump(patts_to_sav, fp)
-    print("\ndone")
+    save_job = pattern_bank.save_steps(patterns)  # only changed patterns, unless patterns were added
+    disp_info("save...")
+
+# write pattern records while there's time before the next sequencer step
+def save_patterns_work():
+    global save_job
+    while save_job and sched.time_to_next() > save_guard_us:
+        latency.begin()  # a record write & flush (or the rename at the end) blocks
+        try:
+            done, total = next(save_job)
+            latency.end()
+            if done % 8 == 0:  # don't redraw display every record
+                disp_info("save %d%%" % (done * 100 // total))
+        except StopIteration:
+            latency.end()
+            save_job = None
+            print("saving patterns done, wrote", pattern_bank.write_count)
+            disp_info("")
 
 def load_patterns():
     patts = []
-    try:
-        with open("/saved_patterns.json",'r') as fp:
-            patts = json.load(fp)
-            for p in patts:
-                # convert str of '1010' to array 1,0,1,0, eliding whitespace, for all seq lines
-                p['seq'] = [int(c) for c in s.replace(' ','') for s in p['seq']]
-    except (OSError, ValueError) as error:  # maybe no file
-        print("load_patterns:",error)
+    if pattern_bank.open():
+        patts = pattern_bank.load_all()
+    else:  # no bank yet, maybe old-style JSON patterns
+        try:
+            with open(patterns_json_file,'r') as fp:
+                # convert strs of '1010', eliding whitespace, to Patterns
+                patts = [Pattern.from_strs(p['name'], p['seq']) for p in json.load(fp)]
+        except (OSError, ValueError) as error:  # maybe no file
+            print("load_patterns:",error)
 
     if len(patts) == 0: # load demo
         print("no saved patterns, loading demo patterns")
         patts = []
         for p in patterns_demo:
-            patts.append( {'name':p['name'], 'seq':  make_sequence_from_demo_pattern(p) } )
+            patts.append( make_sequence_from_demo_pattern(p) )
 
     return patts  # not strictly needed currently, but wait for it...
 
 def copy_current_pattern():
     global patt_index, sequence
-    pname = patterns[patt_index]['name']
-    #seq_new = [l.copy() for l in patterns[patt_index]['seq']]  # copy list of lists
-    seq_new = [l.copy() for l in sequence]  # copy list of lists
-    new_patt = { 'name': 'cptst1',
-                 'seq': seq_new }
+    new_patt = sequence.copy('cptst1')  # just a bytearray copy
     patt_index = patt_index + 1
     patterns.insert(patt_index, new_patt)
-    sequence = patterns[patt_index]['seq']
+    sequence = patterns[patt_index]
+
+def transport_stop():
+    global playing, recording
+    playing = False
+    recording = False # so turn off recording too
+    engine.stop()
+    for i in range(num_pads):
+        play_drum(i,0)
+    if midi_out: midi_out.stop()
+    disp_play(playing,recording)
+    tune_latency()
 
 def update_step_millis():
     global step_millis
     # Beat timing assumes 4/4 time signature, e.g. 4 beats per measure, 1/4 note gets the beat
-    beat_time = 60 / bpm  # time length of a single beat
-    beat_millis = beat_time * 1000  # time length of single beat in milliseconds
-    step_millis = int(beat_millis / steps_per_beat)  # time length of a beat subdivision, e.g. 1/16th note
-    # and keep "step_millis" an int so diff math is fast
+    # step times are kept exact in microseconds by the scheduler,
+    # "step_millis" is just for display & debug
+    sched.set_bpm(bpm)
+    step_millis = sched.step_us() // 1000
+    update_groove()
+
+# rebuild the swing & nudge tables, for a new tempo or groove or pattern
+def update_groove():
+    groove.build(sched.step_us(), sequence.swing, sequence.nudge)
+    sched.set_offsets(groove.step_offsets)
+
+# if audio_buffer_size is auto, save the smallest mixer buffer the stalls so far
+# allow for the next start (a Mixer's buffer can't be changed)
+def tune_latency():
+    size = latency.best_size()
+    if audio_buffer_size or not latency.stalls or size == latency.saved_size:
+        return
+    latency.report()
+    print("latency: mixer buffer_size", size, "from next start")
+    latency.save(audio_buffer_file, size)
 
 #
 # Drum kit management
@@ -204,68 +290,291 @@ def update_step_millis():
 # load up the drum kits' info into "kits" data struct
 # keys = kit names, values = list of WAV samples
 # also special key "kit_names" as order list of kit names
+# Kit info comes from /drumkits/kits_index.json, which is only rebuilt
+# (rescanning /drumkits & checking WAV formats) if a kit dir or sample changed.
 def find_kits():
     kit_root = '/drumkits'
     # Kits should be named/laid out like:
     # 00kick, 01snare, 02hatC, 03hatO, 04clap, 05tomL, 06ride, 07crash,
-    # if there aren't 8 smamples
-    kits = {}
-    for kitname in sorted(os.listdir(kit_root)):
-        kname = kitname.lower()
-        if not kname.startswith("kit"): # ignore non-kit dirs
-            continue
-        kits[kname] = []  # holds all sample names of given kit
-        for samplename in sorted(os.listdir(f"{kit_root}/{kname}")):
-            samplename = samplename.lower()
-            if samplename.endswith(".wav") and not samplename.startswith("."):
-                kits[kname].append(f"{kit_root}/{kname}/{samplename}") # add it to the bag!
-        if len(kits[kname]) < num_pads:
-            print(f"ERROR: kit '{kname}' not enough samples! Removing...")
-            del kits[kname]
-    kits['kit_names'] = sorted(kits.keys())  # add special key of sorted names
-    return kits
-
-# Load wave objects upfront in attempt to reduce play latency
-def load_drumkit():
-    kit_name = kits['kit_names'][kit_index]
-    for i in range(num_pads):
-        fname = kits[kit_name][i]
-        waves[i] = audiocore.WaveFile(open(fname,"rb"))  #
+    # kits without 8 samples, or with samples not 22050 Hz mono 16-bit, are skipped
+    return drum_kitindex.find_kits(kit_root, num_pads, rate=22050, channels=1, bits=16)
+
+# Load kit's samples into RAM (if not already cached) to reduce play latency,
+# then start prefetching the next kit in the direction we're scrolling
+def load_drumkit(direction=1):
+    global waves
+    kit_names = kits['kit_names']
+    voices.stop_all()  # voices may be playing samples that get evicted
+    voices.set_chokes( kits['kit_chokes'][kit_names[kit_index]] or default_choke )
+    notes = kits['kit_notes'][kit_names[kit_index]] or midi_notes
+    note_table( notes, num_pads, note_map )
+    if midi_out: midi_out.set_notes( out_notes(notes, num_pads) )
+    waves = kitcache.get( kit_names[kit_index] )
+    kitcache.prefetch( kit_names[(kit_index + direction) % len(kit_names)] )
 
 # play a drum sample, either by sequencer or pressing pads
-def play_drum(num, pressed):
+# vel is a step velocity byte (see drum_pattstore), level comes from the precomputed table
+def play_drum(num, pressed, vel=pad_velocity):
     pads_lit[num] = pressed
-    voice = mixer.voice[num]   # get mixer voice
     if pressed and not pads_mute[num]:
+        v = voices.play(num)  # pick a mixer voice, choking the pad's group
+        voice = mixer.voice[v]
+        level = vel_levels[vel]
+        if level != voice_levels[v]:  # only touch the mixer if it changed
+            voice.level = level
+            voice_levels[v] = level
         voice.play(waves[num],loop=False)
     else: # released
         pass   # not doing this for samples
 
+# play pads of the last step that are nudged late, once their time comes (or all now, if no time)
+def play_nudged(now_us=None):
+    hits = engine.nudged(now_us)
+    for i in range(num_pads):
+        if (hits >> i) & 1:
+            play_drum(i, 1, engine.nudge_vel)
+            if midi_out and not pads_mute[i]: midi_out.pad_on(i, engine.nudge_vel)  # sent by midi_out.poll()
+
+# record a hit played at t_us into the current pattern at the nearest step, with its velocity
+def record_hit(padnum, vel, t_us):
+    global played_hits
+    # fix up the quantization on record, to nearest (swung) step, allowing for pad's nudge
+    save_pos = sched.nearest_step( t_us - groove.pad_delays[padnum] ) % num_steps
+    if debug: print("*"*30, " save_pos:", save_pos)
+    sequence.set(padnum, save_pos, vel=vel)   # save it
+    disp_grid_step(sequence, save_pos)
+    if tap_held:  # TAP held, accent this step
+        sequence.set_accent(save_pos)
+    if save_pos == seq_pos:  # upcoming step, don't play it twice
+        played_hits |= 1 << padnum
+
 #
 # MIDI
 #
 
-# # Get midi from UART or USB
-def midi_receive_smol():
-    while msg := midi_uart_in.receive() or midi_usb_in.receive():  # walrus!
-        if msg is not None:
-            if msg.type == smolmidi.NOTE_ON:
-                print("noteON:  %02d %02X" % (msg.data[0], msg.data[1]))
-                play_drum( msg.data[0] % num_pads, True)
-            if msg.type == smolmidi.NOTE_OFF:
-                print("noteOFF: %02d %02X" % (msg.data[0], msg.data[1]))
-                play_drum( msg.data[0] % num_pads, False)
-
-# Get midi from UART or USB
-def midi_receive_ada():
-    while msg := midi_uart_in.receive() or midi_usb_in.receive():  # walrus!
-        if msg is not None:
-            #if debug: print(time.monotonic(), msg)
-            if isinstance(msg, NoteOn) and msg.velocity:
-                #if debug: print("noteOn:",msg.note, msg.note % num_pads)
-                play_drum( msg.note % num_pads, True)
-            if isinstance(msg,NoteOff) or (isinstance(msg, NoteOn) and msg.velocity==0):
-                play_drum( msg.note % num_pads, False)
+# handle a MIDI message received at t_us, from an InputRing event
+def midi_message(mtype, d0, d1, t_us):
+    if mtype == smolmidi.CLOCK:  # most common, so first
+        midi_clock_tick(t_us)
+    elif mtype == smolmidi.NOTE_ON and d1:
+        print("noteON:  %02d %02X" % (d0, d1))
+        padnum = note_map[d0]  # the parser dropped unmapped notes...
+        if padnum == UNMAPPED:  # ...but the kit may have changed since
+            return
+        vel = midi_velocity or d1
+        play_drum( padnum, True, vel)
+        if profiling: midi_lat.add(sched.clock.now_us() - t_us)
+        if recording:
+            record_hit(padnum, vel, t_us)
+    elif mtype == smolmidi.NOTE_ON or mtype == smolmidi.NOTE_OFF:  # note on w/ vel 0 is note off
+        print("noteOFF: %02d %02X" % (d0, d1))
+        if note_map[d0] != UNMAPPED:
+            play_drum( note_map[d0], False)
+    elif mtype == smolmidi.START:
+        midi_clock.start()  # transport starts on next clock tick
+    elif mtype == smolmidi.CONTINUE:
+        midi_clock.cont()
+    elif mtype == smolmidi.STOP:
+        midi_clock.stop()
+        transport_stop()
+    elif mtype == smolmidi.SONG_POSITION:
+        midi_clock.song_position(d0 | (d1 << 7))
+
+# follow external MIDI clock: drum_clock smooths the tick times, and the
+# scheduler times steps from that, so steps don't jitter with tick arrival
+def midi_clock_tick(now_us):
+    global playing, seq_pos, bpm
+    if midi_clock.tick(now_us):  # first tick after START/CONTINUE
+        step, due_us, _, _ = midi_clock.timing()
+        sched.start(due_us, step)
+        playing = True
+        seq_pos = step % num_steps
+        disp_play(playing, recording)
+    if midi_clock.locked:
+        if not midi_clock.synced:  # clock came in while playing on our own tempo
+            midi_clock.align(sched.step, sched.step_time(sched.step))
+        sched.follow(*midi_clock.timing())
+        if midi_clock.next_tick % 24 == 0 and midi_clock.bpm(bpm) != bpm:  # once a beat
+            bpm = midi_clock.bpm(bpm)
+            update_groove()
+            disp_bpm(bpm)
+
+#
+# Keys & encoder
+#
+
+# handle MacroPad key keynum pressed (or released) at t_us, from an InputRing event
+def key_event(keynum, pressed, t_us):
+    global playing, recording, seq_pos, patt_index, sequence
+    global rec_held, rec_held_used, mute_held, tap_held, grid_view
+    if keynum == key_PLAY:
+        if pressed:
+            if not enc_sw_held:  # normal play behavior
+                if not playing:
+                    playing = True
+                    if midi_clock.active(sched.clock.now_us()):  # join external clock where it is
+                        step, due_us, _, _ = midi_clock.timing()
+                        sched.start(due_us, step)
+                        midi_clock.synced = True
+                    else:
+                        sched.start()  # start playing! step 0 is due now
+                        midi_clock.synced = False
+                        if midi_out: midi_out.start(0, clock=midi_out_clock)
+                    seq_pos = 0
+                    disp_play(playing,recording)
+                else:  # we are stopped
+                    transport_stop()
+            else:
+                disp_info("copy patt")
+                copy_current_pattern()
+                disp_pattern( patterns[patt_index].name )
+                disp_info("")
+
+    elif keynum == key_RECORD:
+        if pressed:
+            if not enc_sw_held:  # normal record behavior
+                rec_held = True
+                rec_held_used = False
+            else:
+                save_patterns()  # progress shown by save_patterns_work()
+
+        if not pressed and not enc_sw_held:
+            rec_held = False
+            if not rec_held_used:
+                recording = not recording # toggle record state
+                disp_play(playing,recording)
+
+    elif keynum == key_MUTE:
+        mute_held = pressed
+        if pressed and enc_sw_held:
+            grid_view = not grid_view
+            disp_grid_show(grid_view)
+
+    elif keynum == key_TAP_TEMPO:
+        tap_held = pressed
+        if pressed and enc_sw_held:
+            toggle_profiling()
+
+    else: # else its a drumpad, either trigger, erase track, or mute track
+        padnum = keynum_to_padnum[keynum]
+        pads_held[padnum] = pressed
+        if pressed:
+            # if REC button held while pad press, erase track
+            if rec_held:
+                rec_held_used = True
+                sequence.clear_track(padnum)
+                disp_grid_pattern(sequence)
+            # if MUTE button held, mute/unmute track
+            elif mute_held:
+                pads_mute[padnum] = not pads_mute[padnum]
+            # else trigger drum
+            else:
+                play_drum( padnum, 1 )
+                if profiling: pad_lat.add(sched.clock.now_us() - t_us)
+                if recording:
+                    record_hit(padnum, pad_velocity, t_us)
+                # and start recording on the beat if set to record
+                if recording and not playing:
+                    playing = True
+                    sched.start()
+                    midi_clock.synced = False
+                    if midi_out: midi_out.start(0, clock=midi_out_clock)
+                    seq_pos = 0
+
+        else:
+            play_drum( padnum, 0 ) # don't strictly need this
+
+# handle the encoder switch pressed (or released) at t_us
+def encoder_switch_event(pressed, t_us):
+    global enc_sw_press_us, encoder_mode
+    if pressed:
+        enc_sw_press_us = t_us
+    else:
+        if not enc_sw_held:  # press & release not press-hold
+            encoder_mode = (encoder_mode + 1) % 3  # only 3 modes for encoder currently
+            disp_encmode(encoder_mode)
+        disp_info("")
+        enc_sw_press_us = None
+
+# handle the encoder turned encoder_delta detents
+def encoder_event(encoder_delta):
+    global patt_index, sequence, kit_index, bpm
+    if tap_held:  # TAP held, change swing
+        sequence.set_swing(sequence.swing + encoder_delta)
+        update_groove()
+        disp_info("swing %d" % sequence.swing)
+    elif any(pads_held):  # pads held, nudge their tracks
+        for i in range(num_pads):
+            if pads_held[i]:
+                sequence.set_nudge(i, sequence.nudge[i] + encoder_delta)
+                disp_info("nudge %d" % sequence.nudge[i])
+        update_groove()
+    elif encoder_mode == 0:  # mode 1 == change pattern
+        patt_index = (patt_index + encoder_delta) % len(patterns)
+        sequence = patterns[patt_index]
+        update_groove()
+        disp_pattern( patterns[patt_index].name )
+        disp_grid_pattern(sequence)
+    elif encoder_mode == 1:  # mode 1 == change kit
+        kit_index = (kit_index + encoder_delta) % len(kits['kit_names'])
+        load_drumkit(1 if encoder_delta > 0 else -1)
+        disp_kit( kits['kit_names'][kit_index] )
+    elif encoder_mode == 2 and not midi_clock.active(sched.clock.now_us()):  # mode 0 == update BPM, if not following clock
+        bpm += encoder_delta
+        update_step_millis()
+        disp_bpm(bpm)
+
+# handle all queued input events in time order, or until a step is due
+def input_events():
+    while inputs.count and sched.time_to_next() > 0:
+        i = inputs.pop()
+        src = inputs.src[i]
+        if src == SRC_KEYS:
+            key_event(inputs.num[i], inputs.d0[i], inputs.t[i])
+        elif src == SRC_ENC:
+            encoder_event(inputs.d0[i])
+        elif src == SRC_ENC_SW:
+            encoder_switch_event(inputs.d0[i], inputs.t[i])
+        else:
+            midi_message(inputs.num[i], inputs.d0[i], inputs.d1[i], inputs.t[i])
+
+#
+# Profiling
+#
+
+# turn main loop profiling on or off, the profile so far is printed when turned off
+def toggle_profiling():
+    global profiling
+    profiling = not profiling
+    if profiling:
+        prof.reset()
+        pad_lat.reset()
+        midi_lat.reset()
+        disp_prof("prof on")
+    else:
+        profile_report()
+        disp_prof("")
+
+# print the profile & input to sound times so far, and start over
+def profile_report():
+    prof.report()
+    for meter in (pad_lat, midi_lat):
+        meter.report(latency.buffer_us(latency.buffer_size))
+        meter.reset()
+
+# single key commands typed on the serial console
+def serial_command():
+    if not supervisor.runtime.serial_bytes_available:
+        return
+    c = sys.stdin.read(1)
+    if c == 'p':
+        toggle_profiling()
+    elif c == 'r':
+        profile_report()
+    elif c == 'l':
+        latency.report()
+        print("voices: %d, %d per pad, %d stolen" % (num_voices, voices_per_pad, voices.steals))
+        if midi_out: print("midi out: %d writes, %d dropped" % (midi_out.writes, midi_out.dropped))
 
 
 #
@@ -273,6 +582,7 @@ def midi_receive_ada():
 #
 
 # load settings from disk
+pattern_bank = PatternBank(patterns_file, num_pads=num_pads)
 patterns = load_patterns()
 kits = find_kits()
 
@@ -280,206 +590,168 @@ if debug: print("patterns",patterns)
 
 # sequencer state
 step_millis = 0 # derived from bpm, changed by "update_step_millis()" below
-last_step_millis = ticks_ms()
+sched = StepScheduler(MonotonicClock(), bpm=bpm, steps_per_beat=steps_per_beat)
+sched.start()
+midi_clock = MidiClockFollower(steps_per_beat)
 seq_pos = 0  # where in our sequence we are
 playing = False
 recording = False
 
-sequence = patterns[patt_index]['seq']  # sequence is array of [1,0,1,0]
-num_steps = len(sequence[0])  # number of steps, based on length of first stepline
+sequence = patterns[patt_index]  # current Pattern
+num_steps = sequence.num_steps  # number of steps
+groove = Groove(num_steps, num_pads)  # sequence's swing & nudges for current tempo
+engine = StepEngine(sched, groove)  # what plays when, see drum_engine.py
+midi_out = None  # the sequence's notes, clock & thru out, see drum_midiout.py
+if midi_out_usb or midi_uart_tx:
+    midi_out = MidiOut(sched, num_pads, channel=midi_out_channel)
+    if midi_out_usb:
+        midi_out.add_port(usb_midi.ports[1])
+    if midi_uart_tx:
+        midi_out.add_port(midi_uart, fifo=32, byte_us=320)  # RP2040 UART FIFO, 31250 baud
+midi_thru_out = midi_out if midi_thru else None
 
 # drumkit state
 kit_index = 0
 waves = [None] * num_pads
+voices = VoiceAlloc(mixer.voice, num_pads, per_pad=voices_per_pad)  # pads -> mixer voices
+kitcache = KitCache(kits, num_pads, budget=kit_cache_bytes, latency=latency)
 
 # UI state
 pads_lit = [0] * num_pads  # list of drum keys that are being played
 pads_mute = [0] * num_pads # which pads are muted
-pads_played = [0] * num_pads
+played_hits = 0  # bitmask of pads just played & recorded, so the upcoming step doesn't play them again
+pads_held = [0] * num_pads  # which drum pad keys are held down
+vel_levels = level_tables()  # step velocity byte -> mixer voice level
+voice_levels = [1.0] * num_voices  # level each mixer voice is set to
 last_led_millis = ticks_ms()  # last time we updated the LEDs
 rec_held = False  # is REC button held, for deleting tracks
 rec_held_used = False
 mute_held = False  # is MUTE button held, for muting/unmuting tracks
+grid_view = False  # showing the step grid instead of the main screen
 tap_held = False  # is TAP/TEMPO button held
-enc_sw_press_millis = 0
-encoder_val_last = encoder.position
+enc_sw_press_us = None  # when encoder switch was pressed, None if it isn't
 encoder_mode = 0  # 0 = change pattern, 1 = change kit, 2 = change bpm
 led_min = 5  # how much to fade LEDs by
 led_fade = 10 # how much to fade LEDs by
+inputs = InputRing(sched.clock)  # keys, encoder & MIDI events, see drum_input.py
+drum_leds = DrumLeds(leds, keynum_to_padnum, num_pads, fade=led_fade, floor=led_min)
+profiling = False  # main loop profiling, stages are the prof.mark() calls in the loop below
+prof = LoopProfiler(sched.clock, ('input', 'leds', 'seq', 'disk', 'disp'))
+pad_lat = LatencyMeter('pads')  # pad press to voice play(), when profiling
+midi_lat = LatencyMeter('midi')  # note-on read to voice play()
 
 load_drumkit()
 update_step_millis()
 
 disp_bpm(bpm)
 disp_play(playing,recording)
-disp_pattern( patterns[patt_index]['name'] )
+disp_pattern( patterns[patt_index].name )
+disp_grid_pattern(sequence)
 disp_kit( kits['kit_names'][kit_index] )
 disp_encmode( encoder_mode )
 
 print("macropadsynthplug drum machine ready!  bpm:", bpm, "step_millis:", step_millis, "steps:", num_steps)
+latency.reset()  # startup's stalls don't count, nothing's playing yet
 
 while True:
 
-    midi_receive_smol()
-    #midi_receive_ada()
+    if profiling and prof.loop():  # once a second
+        disp_prof(prof.summary())
 
     now = ticks_ms()
 
-    enc_sw_held = enc_sw_press_millis !=0  and (now - enc_sw_press_millis > 500)
+    enc_sw_held = enc_sw_press_us is not None and (sched.clock.now_us() - enc_sw_press_us > 500000)
 
-    # LED handling
-    if ticks_diff(now, last_led_millis) > 10:  # update every 10 msecs
+    # Input: queue up everything since last loop, from every source, then handle it in time order
+    inputs.poll_midi(midi_uart_in, SRC_MIDI_UART, midi_thru_out)
+    inputs.poll_midi(midi_usb_in, SRC_MIDI_USB, midi_thru_out)
+    inputs.poll_keys(keys, SRC_KEYS)
+    inputs.poll_keys(encoder_switch, SRC_ENC_SW, limit=4)
+    inputs.poll_encoder(encoder, SRC_ENC)
+    input_events()
+    if profiling: prof.mark(0)  # input
+
+    # LED handling, but not if a step is about to be due
+    if ticks_diff(now, last_led_millis) > 10 and sched.time_to_next() > sched.lookahead_us:  # update every 10 msecs
         last_led_millis = now
         if enc_sw_held:  # edit mode
-            leds[key_PLAY] = 0x44FF00
-            leds[key_RECORD] = 0xFF4400
-            leds[key_MUTE] = 0x0044FF
+            drum_leds.set_key(key_PLAY, 0x44FF00)
+            drum_leds.set_key(key_RECORD, 0xFF4400)
+            drum_leds.set_key(key_MUTE, 0x0044FF)
         else:
-            leds[key_PLAY]   = 0x00FF00 if playing else 0x114400
-            leds[key_RECORD] = 0xFF0044 if rec_held else 0xFF0000 if recording else 0x440011
-            leds[key_MUTE]   = 0x001144  # mute mode button
+            drum_leds.set_key(key_PLAY, 0x00FF00 if playing else 0x114400)
+            drum_leds.set_key(key_RECORD, 0xFF0044 if rec_held else 0xFF0000 if recording else 0x440011)
+            drum_leds.set_key(key_MUTE, 0x001144)  # mute mode button
 
             for i in range(num_pads):  # light up pressed drumpads
                 if mute_held:  # show mute state instead
-                    leds[ keynum_to_padnum.index(i) ] = 0x000000 if pads_mute[i] else 0x001144
+                    drum_leds.set_pad(i, 0x000000 if pads_mute[i] else 0x001144)
                 elif rec_held:
-                    leds[ keynum_to_padnum.index(i) ] = 0xAA0022
+                    drum_leds.set_pad(i, 0xAA0022)
                 elif tap_held and not playing:  # light up special mode if holding taptemp button
-                    leds[ keynum_to_padnum.index(i) ] = 0x111111
+                    drum_leds.set_pad(i, 0x111111)
                 if pads_lit[i]:   # also show pads being triggered, in nice JP-approved rainbows
-                    leds[ keynum_to_padnum.index(i) ] = rainbowio.colorwheel( int(time.monotonic() * 20) )
+                    drum_leds.set_pad(i, rainbowio.colorwheel( int(time.monotonic() * 20) ))
+
+        drum_leds.fade() # fade released drumpads slowly
+        drum_leds.show() # only if something changed
 
-        leds[:] = [[max(i-led_fade,led_min) for i in l] for l in leds] # fade released drumpads slowly
-        leds.show()
+        serial_command()
+    if profiling: prof.mark(1)  # leds
+
+    # Sequencer: get next step's hits (and MIDI out) ready when it's within the lookahead window
+    step = engine.ahead(sequence)
+    if step >= 0 and playing and midi_out:
+        midi_out.prepare(step, engine.hits & ~groove.delayed, engine.vel, pads_mute)  # nudged late go by play_nudged()
 
     # Sequencer playing
-    diff = ticks_diff( now, last_step_millis )
-    if diff >= step_millis:
-        late_millis = ticks_diff( diff, step_millis )  # how much are we late
-        last_step_millis = ticks_add( now, -(late_millis//2) ) # attempt to make it up on next step
+    step = engine.poll(sequence)
+    if step >= 0:
+        seq_pos = step % num_steps
 
-        # play any sounds recorded for this step
+        # play any sounds recorded for this step, pads nudged late are played by play_nudged()
         if playing:
+            if engine.nudge_hits:  # last step's nudged pads still waiting
+                play_nudged()
+            hits = engine.play(step, played_hits)  # but play only if we didn't just play it
+            played_hits = 0
             for i in range(num_pads):
-                if not pads_played[i]: # but play only if we didn't just play it
-                    play_drum(i, sequence[i][seq_pos] ) # FIXME: what about note-off
-                pads_played[i] = 0
-            if(debug): print("%2d %3d " % (late_millis,seq_pos), [sequence[i][seq_pos] for i in range(num_pads)])
+                play_drum(i, (hits >> i) & 1, engine.vel ) # FIXME: what about note-off
+            if midi_out: midi_out.step(step, hits, engine.vel, pads_mute)  # clock tick, last step's note-offs & these note-ons
+            if(debug): print("%5d %3d " % (sched.late_us,seq_pos), "{:08b}".format(engine.hits), engine.vel)
+            if profiling: prof.late(sched.late_us)
+
+        disp_grid_playhead(seq_pos)
+        disp_grid_step(sequence, seq_pos)  # in case it changed some other way
 
-        # tempo indicator (leds.show() called by LED handler)
-        if seq_pos % steps_per_beat == 0: leds[key_TAP_TEMPO] = 0x333333
-        if seq_pos == 0: leds[key_TAP_TEMPO] = 0x3333FF # first beat indicator
+        # tempo indicator (drum_leds.show() called by LED handler)
+        if seq_pos % steps_per_beat == 0: drum_leds.set_key(key_TAP_TEMPO, 0x333333)
+        if seq_pos == 0: drum_leds.set_key(key_TAP_TEMPO, 0x3333FF) # first beat indicator
 
         seq_pos = (seq_pos + 1) % num_steps # FIXME: let user choose?
 
-    # Key handling
-    key = keys.events.get()
-    if key:
-        keynum = key.key_number
-
-        if keynum == key_PLAY:
-            if key.pressed:
-                if not enc_sw_held:  # normal play behavior
-                    playing = not playing
-                    if playing:
-                        last_playing_millis = ticks_add(now, -step_millis)  # start playing!
-                        seq_pos = 0
-                    else:  # we are stopped
-                        recording = False # so turn off recording too
-                        for i in range(num_pads):
-                            play_drum(i,0)
-                    disp_play(playing,recording)
-                else:
-                    disp_info("copy patt")
-                    copy_current_pattern()
-                    disp_pattern( patterns[patt_index]['name'] )
-                    disp_info("")
-
-        elif keynum == key_RECORD:
-            if key.pressed:
-                if not enc_sw_held:  # normal record behavior
-                    rec_held = True
-                    rec_held_used = False
-                else:
-                    disp_info("save patts")
-                    save_patterns()
-                    disp_info("")
-
-            if key.released and not enc_sw_held:
-                rec_held = False
-                if not rec_held_used:
-                    recording = not recording # toggle record state
-                    disp_play(playing,recording)
+    if engine.nudge_hits:
+        play_nudged(sched.clock.now_us())
+    if midi_out and (midi_out.count or midi_out.clock_tick >= 0):  # clock ticks due, thru,
+        midi_out.poll()  # & anything a port couldn't take yet
+    if profiling: prof.mark(2)  # seq
 
-        elif keynum == key_MUTE:
-            mute_held = key.pressed
-
-        elif keynum == key_TAP_TEMPO:
-            tap_held = key.pressed
-
-        else: # else its a drumpad, either trigger, erase track, or mute track
-            padnum = keynum_to_padnum[keynum]
-            if key.pressed:
-                # if REC button held while pad press, erase track
-                if rec_held:
-                    rec_held_used = True
-                    for i in range(num_steps):
-                        sequence[padnum][i] = 0
-                # if MUTE button held, mute/unmute track
-                elif mute_held:
-                    pads_mute[padnum] = not pads_mute[padnum]
-                # else trigger drum
-                else:
-                    play_drum( padnum, 1 )
-                    if recording:
-                        pads_played[padnum] = 1
-                        # fix up the quantization on record
-                        diff = ticks_diff( ticks_ms(), last_step_millis )
-                        if debug: print("*"*30, " diff:", diff)
-                        save_pos = seq_pos -1
-                        if diff > step_millis//2:  #
-                            save_pos += 1
-                        sequence[padnum][save_pos] = 1   # save it
-                    # and start recording on the beat if set to record
-                    if recording and not playing:
-                        playing = True
-                        last_playing_millis = ticks_add(ticks_ms(), -step_millis)
-                        seq_pos = 0
-
-            if key.released:
-                play_drum( padnum, 0 ) # don't strictly need this
+    # write a bit of any in-progress save, between steps
+    save_patterns_work()
+
+    # load a sample of the next kit, if there's time before the next step (and no input waiting)
+    if not save_job and not inputs.count and sched.time_to_next() > save_guard_us:
+        kitcache.work()
+
+    if profiling: prof.mark(3)  # disk
 
     # Encoder hold handling
-    if enc_sw_held:
+    if enc_sw_held and not save_job:
         disp_info("editmode")
 
-    # Encoder push handling
-    enc_sw = encoder_switch.events.get()
-    if enc_sw:
-        if enc_sw.pressed:
-            enc_sw_press_millis = now
-        if enc_sw.released:
-            if not enc_sw_held:  # press & release not press-hold
-                encoder_mode = (encoder_mode + 1) % 3  # only 3 modes for encoder currently
-                disp_encmode(encoder_mode)
-            disp_info("")
-            enc_sw_press_millis = 0
-
-
-    # Encoder turn handling
-    encoder_val = encoder.position
-    if encoder_val != encoder_val_last:
-        encoder_delta = (encoder_val - encoder_val_last)
-        encoder_val_last = encoder_val
-        if encoder_mode == 0:  # mode 1 == change pattern
-            patt_index = (patt_index + encoder_delta) % len(patterns)
-            sequence = patterns[patt_index]['seq']
-            disp_pattern( patterns[patt_index]['name'] )
-        elif encoder_mode == 1:  # mode 1 == change kit
-            kit_index = (kit_index + encoder_delta) % len(kits['kit_names'])
-            load_drumkit()
-            disp_kit( kits['kit_names'][kit_index] )
-        elif encoder_mode == 2:  # mode 0 == update BPM
-            bpm += encoder_delta
-            update_step_millis()
-            disp_bpm(bpm)
+    # send any display changes, if there's time before the next step & input's all handled
+    if not engine.nudge_hits and not inputs.count and sched.time_to_next() > display_guard_us:
+        latency.begin()
+        if disp_refresh():  # at most drum_display.max_fps
+            latency.end()
+    if profiling: prof.mark(4)  # disp
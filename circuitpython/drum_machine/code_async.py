@@ -1,5 +1,6 @@
 #
-# NOTE: this is just demo code to test asyncio, it's not to be actually used
+# NOTE: this is the drum machine as asyncio tasks, to compare with code.py's
+# main loop.  It has fewer features than code.py, use that one to make music.
 #
 
 #
@@ -9,10 +10,13 @@
 #
 # Rotate macropad so keys are to the right, knob is top left
 # - Key next to macropad is PLAY/STOP,
-# - Then RECORD key
+# - Then RECORD key (hold RECORD & press a pad to erase its track)
 # - Then MUTE key (unimplemented)
 # - Then TEMPO key
 # - The bottom two rows of 4 keys are the drum triggers
+# - Turn encoder to change BPM
+# - Follows MIDI clock (and START/STOP/CONTINUE) when it's sent one
+# - Sends the sequence's notes out USB MIDI, and clock & thru if turned on, as code.py
 #
 #  +-------+------+------+------+------+
 #  |  ---  |      |      |      |      |
@@ -28,63 +32,87 @@
 #  | ----- |      |      |      |      |
 #  |-------+------+------+------+------+
 #
+# The step engine (drum_engine.py & drum_sched.py), patterns, kits and
+# display are the same as code.py's, only how the work is shared out is
+# different.  Instead of everything polling in turn, as fast as it can:
+# - run_sequencer() sleeps until just before the next step is due, spins
+#   out the last bit so the step fires on time, plays it and sleeps again.
+#   retime() wakes it early when the next step moves earlier (PLAY, MIDI).
+# - midi_reader() wakes every millisecond and only decodes MIDI when bytes
+#   have come in, so clock ticks & notes are seen within a millisecond.
+# - the UI tasks (controls, leds, display) each do a bounded bit of work and
+#   sleep, and put off anything that would still be running when a step is
+#   due.  asyncio can't preempt a task, so that's what gives the sequencer
+#   priority: it's the only task with a deadline, the others check
+#   sched.time_to_next() before doing something slow.
 #
 # To install:
 # - Copy this file and this whole directory to your CIRCUITPY drive
-# - Install other libraries with "circup install neopixel adafruit_display_text adafruit_midi"
-#
-# Convert drum sounds to appropriate WAV format (mono, 22050 Hz, 16-bit signed) with command:
-#  sox sound.mp3 -b 16 -c 1 -r 22050 sound.wav
+# - Install other libraries with "circup install asyncio neopixel adafruit_ticks adafruit_display_text"
+# - Rename this file to code.py, or import it from code.py
 #
 
 print("macropadsynthplug drum machine async start!")
 
 import asyncio
 import time
-import supervisor
 import board, busio, keypad, rotaryio, digitalio
-import displayio, terminalio
 import rainbowio
-import audiocore, audiomixer, audiopwmio
 import neopixel
-from adafruit_display_text import bitmap_label as label
+import audiomixer, audiopwmio
 import usb_midi
-import adafruit_midi
-from adafruit_midi.note_on import NoteOn
-from adafruit_midi.note_off import NoteOff
-
-from drum_patterns import *
+import todbot_smolishmidi as smolmidi
+
+from drum_display import disp_bpm, disp_play, disp_pattern, disp_kit, disp_encmode, disp_refresh
+from drum_patterns import patterns_demo
+from drum_sched import StepScheduler, MonotonicClock, Groove
+from drum_engine import StepEngine
+from drum_clock import MidiClockFollower
+from drum_leds import DrumLeds
+from drum_pattstore import Pattern, level_tables
+from drum_kitcache import KitCache
+from drum_latency import AudioLatency
+from drum_voices import VoiceAlloc
+from drum_notes import note_table, out_notes
+from drum_midiout import MidiOut
+import drum_kitindex
 
 use_macrosynthplug = True
+debug = False
 
+patt_index = 0  # which sequence we're playing from our list of avail patterns
 bpm = 120  # default BPM
-steps_per_beat = 8  # divisions per beat: 8 = 32nd notes, 4 = 16th notes
+steps_per_beat = 4  # divisions per beat: 8 = 32nd notes, 4 = 16th notes
 num_pads = 8
-patt_index = 0  # which sequence we're playing from our list of avail patterns
-
-sequence = make_sequence( patterns[patt_index] )
-num_steps = len(sequence)  # number of steps
-
-# map key number to wave file
-# a list of which samples to play on which keys,
-# and if the sample should loop or not
-# if a key has no sample, use (None,None)
-wav_files = (
-    # filename,           loop?
-    ('wav/909kick4.wav', False),        # 0  # |....|x...|
-    ('wav/909clap1.wav', False),        # 1  # |....|.x..|
-    ('wav/909snare2.wav', False),       # 2  # |....|..x.|
-    ('wav/909cym2.wav', False),         # 3
-    ('wav/909hatclosed2a.wav', False),  # 4
-    ('wav/909hatopen5.wav', False),     # 5
-    ('wav/laser2.wav', False),  # 6
-    ('wav/laser2.wav',False),  # 7
-)
+kit_cache_bytes = 96 * 1024  # RAM for drum samples, kits over this are streamed from flash
+pad_velocity = 127  # pads aren't velocity sensitive, so they play & record at this
+audio_buffer_size = 0  # Mixer buffer_size bytes, 0 = auto, as code.py (and sharing its tuning)
+audio_buffer_file = '/audio_buffer.txt'
+num_voices = 12  # mixer voices the pads share, as code.py
+voices_per_pad = 2
+default_choke = (0, 0, 1, 1, 0, 0, 0, 0)  # hi-hats, for kits without a kit.json
+midi_notes = 'gm'  # MIDI note map, channels & velocity, as code.py
+midi_channel_mask = 0xFFFF
+midi_velocity = 0
+midi_out_usb = True  # MIDI out, as code.py
+midi_out_uart = False
+midi_out_channel = 10
+midi_out_clock = False
+midi_thru = False
+
+# task timing
+wake_early_us = 1500  # sequencer wakes this long before a step, asyncio sleeps are whole ms
+ui_guard_us = 3000  # UI tasks only do work if the next step is at least this far away
+display_guard_us = 10000  # only refresh the display if next step is at least this far away
+midi_ms = 1  # how often MIDI ports are checked
+controls_ms = 5  # keys & encoder
+leds_ms = 10
+display_ms = 50
 
 # top row of keys is special
 key_PLAY = 2
 key_RECORD= 5
-key_MODE = 8
+key_MUTE = 8
 key_TAP_TEMPO = 11
 # the rest of keys are drum pads
 keynum_to_padnum = (0, 4, -1, # pad nums go from bottom row of four: 0,1,2,3
@@ -92,13 +120,20 @@ keynum_to_padnum = (0, 4, -1, # pad nums go from bottom row of four: 0,1,2,3
                     2, 6, -1, # and top row are invalid pad nums (buttons used for transport)
                     3, 7, -1)
 
+#
+# Set up hardware
+#
+
 # macropadsynthplug!
-midi_uart = busio.UART(rx=board.SCL, tx=None, baudrate=31250, timeout=0.001)
-#midi_uart_in = smolmidi.MidiIn(midi_uart) # can't do smolmidi because it wants port.readinto(buf,len)
-midi_uart_in = adafruit_midi.MIDI( midi_in=midi_uart) # , debug=False)
-midi_usb_in = adafruit_midi.MIDI( midi_in=usb_midi.ports[0])
+midi_uart_tx = board.SDA if midi_out_uart and not use_macrosynthplug else None  # audio's on SDA
+midi_uart = busio.UART(rx=board.SCL, tx=midi_uart_tx, baudrate=31250, timeout=0.001)
+note_map = note_table(midi_notes, num_pads)  # MIDI note -> pad, the parsers drop unmapped notes
+midi_uart_in = smolmidi.MidiIn(midi_uart, enable_running_status=True,
+                               channel_mask=midi_channel_mask, note_filter=note_map)
+midi_usb_in = smolmidi.MidiIn(usb_midi.ports[0], enable_running_status=True,
+                              channel_mask=midi_channel_mask, note_filter=note_map)
 
-leds = neopixel.NeoPixel(board.NEOPIXEL, 12, brightness=0.3, auto_write=False)
+leds = neopixel.NeoPixel(board.NEOPIXEL, 12, brightness=0.2, auto_write=False)
 
 key_pins = (board.KEY1, board.KEY2, board.KEY3,
             board.KEY4, board.KEY5, board.KEY6,
@@ -107,7 +142,6 @@ key_pins = (board.KEY1, board.KEY2, board.KEY3,
 
 keys = keypad.Keys(key_pins, value_when_pressed=False, pull=True)
 encoder = rotaryio.IncrementalEncoder(board.ENCODER_B, board.ENCODER_A)  # yes, reversed
-encoder_switch = keypad.Keys((board.ENCODER_SWITCH,), value_when_pressed=False, pull=True)
 
 if use_macrosynthplug:
     audio = audiopwmio.PWMAudioOut(board.SDA) # macropadsynthplug!
@@ -115,219 +149,336 @@ else:
     audio = audiopwmio.PWMAudioOut(board.SPEAKER) # built-in tiny spkr
     speaker_en = digitalio.DigitalInOut(board.SPEAKER_ENABLE)
     speaker_en.switch_to_output(value=True)
-mixer = audiomixer.Mixer(voice_count=num_pads, sample_rate=22050, channel_count=1,
-                         bits_per_sample=16, samples_signed=True, buffer_size=2048)
+latency = AudioLatency(MonotonicClock(), sample_rate=22050)  # buffer size & underruns, see drum_latency.py
+if audio_buffer_size:
+    latency.set_size(audio_buffer_size)
+else:
+    latency.load(audio_buffer_file)
+mixer = audiomixer.Mixer(voice_count=num_voices, sample_rate=22050, channel_count=1,
+                         bits_per_sample=16, samples_signed=True, buffer_size=latency.buffer_size)
 audio.play(mixer) # attach mixer to audio playback
 
+#
+# Patterns & kits, as code.py
+#
 
-# display setup begin
-dw,dh = 64,128
-display = board.DISPLAY
-display.rotation = 90
-font = terminalio.FONT
-dispgroup = displayio.Group()
-display.show(dispgroup)
-txt1 = label.Label(font, text="macropad",      x=0,  y=10)
-txt2 = label.Label(font, text="synthplug",     x=0,  y=20)
-txt3 = label.Label(font, text="drumachine",    x=0,  y=30)
-txt_patt = label.Label(font, text="patt",      x=0,  y=45)
-txt_mode = label.Label(font, text="mode:",     x=0,  y=60)
-txt_mode_val = label.Label(font, text="stop",  x=30, y=60)
-txt_bpm = label.Label(font, text="bpm:",       x=0,  y=70)
-txt_bpm_val = label.Label(font, text=str(bpm), x=30, y=70)
-txt_rcv = label.Label(font, text="recv:",      x=0, y=110)
-txt_rcv_val = label.Label(font, text="   ",    x=10, y=120)
-for t in (txt1, txt2, txt3, txt_patt, txt_mode, txt_mode_val, txt_bpm,
-          txt_bpm_val, txt_rcv, txt_rcv_val):
-    dispgroup.append(t)
-# display setup end
-
-def millis(): return supervisor.ticks_ms()  # I like millis
-
-
-# sequence state
-last_step_millis = millis()  # when our last step was triggered
-step_millis = 0 # derived from bpm, changed by "update_bpm()"
-seq_pos = 0  # where in our sequence we are
+patterns = [Pattern.from_strs(p['name'], p['base'], num_steps=p['len']) for p in patterns_demo]
+kits = drum_kitindex.find_kits('/drumkits', num_pads, rate=22050, channels=1, bits=16)
+kitcache = KitCache(kits, num_pads, budget=kit_cache_bytes, latency=latency)
+waves = kitcache.get( kits['kit_names'][0] )
+voices = VoiceAlloc(mixer.voice, num_pads, per_pad=voices_per_pad)  # pads -> mixer voices
+voices.set_chokes( kits['kit_chokes'][kits['kit_names'][0]] or default_choke )
+note_table( kits['kit_notes'][kits['kit_names'][0]] or midi_notes, num_pads, note_map )
+
+# sequencer state
+sched = StepScheduler(MonotonicClock(), bpm=bpm, steps_per_beat=steps_per_beat)
+sched.start()
+midi_clock = MidiClockFollower(steps_per_beat)
+sequence = patterns[patt_index]  # current Pattern
+num_steps = sequence.num_steps
+groove = Groove(num_steps, num_pads)
+engine = StepEngine(sched, groove)  # what plays when, see drum_engine.py
+midi_out = None  # the sequence's notes, clock & thru out, see drum_midiout.py
+if midi_out_usb or midi_uart_tx:
+    midi_out = MidiOut(sched, num_pads, channel=midi_out_channel)
+    if midi_out_usb:
+        midi_out.add_port(usb_midi.ports[1])
+    if midi_uart_tx:
+        midi_out.add_port(midi_uart, fifo=32, byte_us=320)  # RP2040 UART FIFO, 31250 baud
+    midi_out.set_notes( out_notes(kits['kit_notes'][kits['kit_names'][0]] or midi_notes, num_pads) )
+midi_thru_out = midi_out if midi_thru else None
+seq_pos = 0
 playing = False
 recording = False
+seq_task = None  # the run_sequencer() task, see retime()
+seq_sleeping = False  # run_sequencer() is sleeping until its next step...
+seq_wake_us = 0  # ...and wakes at this time
 
 # UI state
-pads_pressed = [0] * num_pads  # list of drum keys currently being pressed down
 pads_lit = [0] * num_pads  # list of drum keys that are being played
-rec_pressed = False  # is REC button currently pressed, for deleting tracks
+pads_mute = [0] * num_pads  # MUTE is unimplemented, so nothing's muted
+played_hits = 0  # bitmask of pads just played & recorded, so the upcoming step doesn't play them again
+vel_levels = level_tables()  # step velocity byte -> mixer voice level
+voice_levels = [1.0] * num_voices  # level each mixer voice is set to
+rec_held = False  # is REC button held, for deleting tracks
+rec_held_used = False
+drum_leds = DrumLeds(leds, keynum_to_padnum, num_pads, fade=10, floor=5)
 
-# Load wave objects upfront in attempt to reduce play latency
-waves = [None] * num_pads
-for i in range(num_pads):
-    waves[i] = audiocore.WaveFile(open(wav_files[i][0],"rb"))  # ignore 'loopit'
+#
+# Sequencer
+#
 
-# Play or stop a sample using the mixer
-def handle_sample(num, pressed):
+# play a drum sample, either by sequencer or pressing pads
+def play_drum(num, pressed, vel=pad_velocity):
     pads_lit[num] = pressed
-    voice = mixer.voice[num]   # get mixer voice
     if pressed:
-        voice.play(waves[num],loop=False)
-    else: # released
-        pass
-        #if loopit:
-        #voice.stop()  # only stop looping samples, others one-shot
-
-# Get midi from UART or USB
-def midi_receive():
-    while msg := midi_uart_in.receive() or midi_usb_in.receive():  # walrus!
-        if msg is not None:
-            print(time.monotonic(), msg)
-            if isinstance(msg, NoteOn) and msg.velocity:
-                print("noteOn:",msg.note, msg.note % 12)
-                handle_sample( msg.note % 12, True)
-            if isinstance(msg,NoteOff) or (isinstance(msg, NoteOn) and msg.velocity==0):
-                handle_sample( msg.note % 12, False)
-
-def update_play():
-    if playing:
-        txt_mode_val.text = "play" if not recording else "odub"
-    else:
-        txt_mode_val.text = "stop" if not recording else "reco"  # FIXME:
-
-def update_bpm():
-    global step_millis
-    # Beat timing assumes 4/4 time signature, e.g. 4 beats per measure, 1/4 note gets the beat
-    beat_time = 60 / bpm  # time length of a single beat
-    beat_millis = beat_time * 1000  # time length of single beat in milliseconds
-    step_millis = int(beat_millis / steps_per_beat)  # time length of a beat subdivision, e.g. 1/16th note
-    txt_bpm_val.text = str(bpm)
-    # and keep "step_millis" an int so diff math is fast
-
-def update_pattern():
-    txt_patt.text = patterns[patt_index]['name']
-
-update_play()
-update_pattern()
-update_bpm()
+        v = voices.play(num)  # pick a mixer voice, choking the pad's group
+        voice = mixer.voice[v]
+        level = vel_levels[vel]
+        if level != voice_levels[v]:  # only touch the mixer if it changed
+            voice.level = level
+            voice_levels[v] = level
+        voice.play(waves[num], loop=False)
+
+# play pads of the last step that are nudged late, once their time comes (or all now, if no time)
+def play_nudged(now_us=None):
+    hits = engine.nudged(now_us)
+    for i in range(num_pads):
+        if (hits >> i) & 1:
+            play_drum(i, 1, engine.nudge_vel)
+            if midi_out: midi_out.pad_on(i, engine.nudge_vel)
+    if hits and midi_out: midi_out.flush()
+
+# step times changed, wake the sequencer if it's sleeping past the new time
+def retime():
+    if seq_sleeping and sched.time_to_next() - wake_early_us < seq_wake_us - sched.clock.now_us():
+        seq_task.cancel()
+
+def update_tempo():
+    sched.set_bpm(bpm)
+    update_groove()
+
+def update_groove():
+    groove.build(sched.step_us(), sequence.swing, sequence.nudge)
+    sched.set_offsets(groove.step_offsets)
+
+def transport_start(due_us=None, step=0):
+    global playing, seq_pos
+    playing = True
+    sched.start(due_us, step)
+    midi_clock.synced = due_us is not None  # started from the clock's timing()
+    seq_pos = step % num_steps
+    if midi_out: midi_out.start(step, clock=midi_out_clock and due_us is None)  # not when following a clock
+    disp_play(playing, recording)
+    retime()
+
+def transport_stop():
+    global playing, recording
+    playing = False
+    recording = False
+    engine.stop()
+    if midi_out: midi_out.stop()
+    disp_play(playing, recording)
+    tune_latency()
+
+# as code.py: save the smallest mixer buffer the stalls so far allow, for next start
+def tune_latency():
+    size = latency.best_size()
+    if audio_buffer_size or not latency.stalls or size == latency.saved_size:
+        return
+    latency.report()
+    latency.save(audio_buffer_file, size)
+
+# record a hit into the current pattern at the nearest step
+def record_hit(padnum, vel):
+    global played_hits
+    save_pos = sched.nearest_step( sched.clock.now_us() - groove.pad_delays[padnum] ) % num_steps
+    sequence.set(padnum, save_pos, vel=vel)
+    if save_pos == seq_pos:  # upcoming step, don't play it twice
+        played_hits |= 1 << padnum
 
+async def run_sequencer():
+    global seq_pos, played_hits, seq_sleeping, seq_wake_us
+    while True:
+        if engine.nudge_hits:
+            play_nudged(sched.clock.now_us())
+        wait_us = sched.time_to_next() - wake_early_us
+        if wait_us >= 1000:
+            wait_ms = 1 if engine.nudge_hits else wait_us // 1000  # back for nudged pads in a ms
+            seq_wake_us = sched.clock.now_us() + wait_ms * 1000
+            seq_sleeping = True
+            try:
+                await asyncio.sleep_ms(wait_ms)
+            except asyncio.CancelledError:  # retime(), the next step moved
+                pass
+            seq_sleeping = False
+            continue
+
+        # the step is due within wake_early_us, nothing else runs until it's played
+        step = engine.ahead(sequence)
+        if step >= 0 and playing and midi_out:  # get its MIDI out ready while there's time
+            midi_out.prepare(step, engine.hits & ~groove.delayed, engine.vel, pads_mute)
+        while sched.time_to_next() > 0:
+            pass
+        step = engine.poll(sequence)
+        if step < 0:
+            continue
+        seq_pos = step % num_steps
+        if playing:
+            if engine.nudge_hits:  # last step's nudged pads still waiting
+                play_nudged()
+            hits = engine.play(step, played_hits)
+            played_hits = 0
+            for i in range(num_pads):
+                play_drum(i, (hits >> i) & 1, engine.vel)
+            if midi_out: midi_out.step(step, hits, engine.vel, pads_mute)
+            if debug: print("%5d %3d " % (sched.late_us, seq_pos), "{:08b}".format(engine.hits))
+
+        # tempo indicator (drum_leds.show() called by update_leds())
+        if seq_pos % steps_per_beat == 0: drum_leds.set_key(key_TAP_TEMPO, 0x333333)
+        if seq_pos == 0: drum_leds.set_key(key_TAP_TEMPO, 0x3333FF) # first beat indicator
+        seq_pos = (seq_pos + 1) % num_steps
 
-async def update_leds():
+#
+# MIDI
+#
+
+# follow external MIDI clock, as code.py
+def midi_clock_tick():
+    global bpm
+    now_us = sched.clock.now_us()
+    if midi_clock.tick(now_us):  # first tick after START/CONTINUE
+        step, due_us, _, _ = midi_clock.timing()
+        transport_start(due_us, step)
+    if midi_clock.locked:
+        if not midi_clock.synced:  # clock came in while playing on our own tempo
+            midi_clock.align(sched.step, sched.step_time(sched.step))
+        sched.follow(*midi_clock.timing())
+        retime()  # e.g. the clock is faster than our tempo was
+        if midi_clock.next_tick % 24 == 0 and midi_clock.bpm(bpm) != bpm:  # once a beat
+            bpm = midi_clock.bpm(bpm)
+            update_groove()
+            disp_bpm(bpm)
+
+def midi_receive(midi_in):
+    n = midi_in.receive_all()  # drain port, decode into preallocated messages
+    for j in range(n):
+        msg = midi_in.messages[j]
+        if midi_thru_out: midi_thru_out.put_message(msg)
+        if msg.type == smolmidi.CLOCK:  # most common, so first
+            midi_clock_tick()
+        elif msg.type == smolmidi.NOTE_ON and msg.data[1]:
+            padnum = note_map[msg.data[0]]
+            vel = midi_velocity or msg.data[1]
+            play_drum(padnum, True, vel)
+            if recording:
+                record_hit(padnum, vel)
+        elif msg.type == smolmidi.NOTE_ON or msg.type == smolmidi.NOTE_OFF:
+            play_drum(note_map[msg.data[0]], False)
+        elif msg.type == smolmidi.START:
+            midi_clock.start()  # transport starts on next clock tick
+        elif msg.type == smolmidi.CONTINUE:
+            midi_clock.cont()
+        elif msg.type == smolmidi.STOP:
+            midi_clock.stop()
+            transport_stop()
+
+# only decode when there are bytes, the UART says so without reading it
+async def midi_reader():
     while True:
-        leds[key_PLAY]   = 0x00FF00 if playing else 0x114400
-        leds[key_RECORD] = 0xFF0000 if recording else 0x440044 if rec_pressed else 0x441100
-        leds[key_MODE]   = 0x001144  # maybe another mode?
-        for i in range(num_pads):  # light up pressed drumpads
-            if pads_lit[i]:
-                leds[ keynum_to_padnum.index(i) ] = rainbowio.colorwheel( int(time.monotonic() * 20) )
-        leds[:] = [[max(i-5,0) for i in l] for l in leds] # fade released drumpads slowly
-        leds.show()
-        await asyncio.sleep(0.01)  # Let another task run.
+        if midi_uart.in_waiting:
+            midi_receive(midi_uart_in)
+        midi_receive(midi_usb_in)
+        if midi_out and (midi_out.count or midi_out.clock_tick >= 0):
+            midi_out.poll()  # clock ticks due (to within midi_ms), thru, what a port couldn't take
+        await asyncio.sleep_ms(midi_ms)
 
-async def monitor_controls():
-    global playing, recording, bpm, rec_pressed, last_playing_millis, seq_pos
+#
+# UI tasks
+#
 
+# keys & encoder, one key event per wakeup
+async def controls():
+    global bpm, recording, rec_held, rec_held_used
     encoder_val_last = encoder.position
-
     while True:
-        await asyncio.sleep(0)  # Let another task run. (at top so we can 'continue')
+        await asyncio.sleep_ms(controls_ms)
+        if sched.time_to_next() < ui_guard_us:
+            continue
 
-        # Encoder handling
-        encoder_val = encoder.position
-        if encoder_val != encoder_val_last:
-            encoder_delta = (encoder_val - encoder_val_last)
-            encoder_val_last = encoder_val
-            bpm += encoder_delta
-            update_bpm()
-
-        # Key handling
         key = keys.events.get()
         if key:
             keynum = key.key_number
-            # print("key:%d %d" % (keynum, key.pressed) )
-
             if keynum == key_PLAY:
                 if key.pressed:
-                    playing = not playing
-                    #if recording and playing:
-                    #    print("maybe erasing sequence?")
-                    if playing:
-                        last_playing_millis = millis() - step_millis
-                        seq_pos = 0
-                    else:  # stopped
-                        recording = False # turn off recording too
-                    update_play()
+                    if not playing:
+                        if midi_clock.active(sched.clock.now_us()):  # join external clock where it is
+                            step, due_us, _, _ = midi_clock.timing()
+                            transport_start(due_us, step)
+                        else:
+                            transport_start()  # step 0 is due now
+                    else:
+                        transport_stop()
 
             elif keynum == key_RECORD:
-                rec_pressed = key.pressed
-                if rec_pressed:
-                    recording = not recording
-                    update_play()
-
-            elif keynum == key_MODE: # dunno what to do wth this key yet
-                pass
-
-            elif keynum == key_TAP_TEMPO:
+                if key.pressed:
+                    rec_held = True
+                    rec_held_used = False
+                else:
+                    rec_held = False
+                    if not rec_held_used:
+                        recording = not recording
+                        disp_play(playing, recording)
+
+            elif keynum == key_MUTE or keynum == key_TAP_TEMPO:
                 pass
 
-            else: # else its a drumpad
+            else:  # drum pad
                 padnum = keynum_to_padnum[keynum]
-                # print("keynum:", keynum, "padnum:",padnum)
                 if key.pressed:
-                    if rec_pressed:  # erase sequence
-                        for i in range(num_steps):
-                            sequence[i][padnum] = 0
-                    else: # play drum
-                        pads_pressed[padnum] = 1
-                        handle_sample( padnum, 1 )
-
-                        # and start recording on the beat if set to record
-                        if recording and not playing:
-                            playing = True
-                            last_playing_millis = millis() - step_millis
-                            seq_pos = 0
-
-                if key.released:
-                    pads_pressed[padnum] = 0
-                    handle_sample( padnum, 0 )
+                    if rec_held:  # erase track
+                        rec_held_used = True
+                        sequence.clear_track(padnum)
+                    else:
+                        play_drum(padnum, 1)
+                        if recording:
+                            record_hit(padnum, pad_velocity)
+                        if recording and not playing:  # start recording on the beat
+                            transport_start()
+                else:
+                    play_drum(padnum, 0)
 
-async def run_sequencer():
-    global seq_pos, last_step_millis
+        encoder_val = encoder.position
+        if encoder_val != encoder_val_last:
+            encoder_delta = encoder_val - encoder_val_last
+            encoder_val_last = encoder_val
+            if not midi_clock.active(sched.clock.now_us()):  # tempo is the clock's when following
+                bpm += encoder_delta
+                update_tempo()
+                disp_bpm(bpm)
 
+async def update_leds():
     while True:
-        await asyncio.sleep(0) # run as fast as possible so we can catch lateness
-
-        now = millis()
-        diff = now - last_step_millis
-        if diff > step_millis:  # sure wish we had a timer facility
-            late_millis = diff - step_millis # how much are we late
-            last_step_millis = now - (late_millis//2)  #- fudge
-
-            # tempo indicator
-            if seq_pos % steps_per_beat == 0: leds[key_TAP_TEMPO] = 0x333333
-            if seq_pos == 0: leds[key_TAP_TEMPO] = 0x3333FF # first beat indicator
-
-            if playing:
-                # play any sounds previously recorded for this step
-                for i in range(num_pads):
-                    handle_sample(i, sequence[seq_pos][i] )
-
-                # if recording & pads were pressed,  add it to the _last_ step (the one just finished)
-                if recording:
-                    for i in range(num_pads):
-                        sequence[ seq_pos-1 ][i] |= pads_pressed[i]
-                        pads_pressed[i] = 0  # and say we've used it up
+        await asyncio.sleep_ms(leds_ms)
+        if sched.time_to_next() < ui_guard_us:
+            continue
+        drum_leds.set_key(key_PLAY, 0x00FF00 if playing else 0x114400)
+        drum_leds.set_key(key_RECORD, 0xFF0044 if rec_held else 0xFF0000 if recording else 0x440011)
+        drum_leds.set_key(key_MUTE, 0x001144)
+        for i in range(num_pads):  # light up pressed drumpads
+            if pads_lit[i]:
+                drum_leds.set_pad(i, rainbowio.colorwheel( int(time.monotonic() * 20) ))
+        drum_leds.fade()  # fade released drumpads slowly
+        drum_leds.show()  # only if something changed
 
-                print("%2d %3d" % (late_millis, seq_pos), sequence[seq_pos])
+async def update_display():
+    while True:
+        await asyncio.sleep_ms(display_ms)
+        if not engine.nudge_hits and sched.time_to_next() > display_guard_us:
+            latency.begin()
+            if disp_refresh():  # only if something changed
+                latency.end()
 
-            seq_pos = (seq_pos + 1) % num_steps # go to next step (FIXME: let user choose num_steps?)
+#
+# startup
+#
 
+update_tempo()
+disp_bpm(bpm)
+disp_play(playing, recording)
+disp_pattern(sequence.name)
+disp_kit(kits['kit_names'][0])
+disp_encmode(2)  # encoder only changes BPM
 
-# create the tasks that hold our functions
 async def main():
-    #state = SequencerState()
-
-    leds_task = asyncio.create_task( update_leds() )
-    controls_task = asyncio.create_task( monitor_controls() )
-    sequencer_task = asyncio.create_task( run_sequencer() )
-
-    await asyncio.gather( leds_task, controls_task, sequencer_task )
-
-# finally start everything running
-print("macropadsynthplug drum machine ready!  bpm:", bpm, "step_millis:", step_millis, "steps:", num_steps)
+    global seq_task
+    seq_task = asyncio.create_task(run_sequencer())
+    await asyncio.gather(seq_task,
+                         asyncio.create_task(midi_reader()),
+                         asyncio.create_task(controls()),
+                         asyncio.create_task(update_leds()),
+                         asyncio.create_task(update_display()))
+
+latency.reset()  # startup's stalls don't count
+print("macropadsynthplug drum machine async ready!  bpm:", bpm, "step_us:", sched.step_us(), "steps:", num_steps)
 asyncio.run(main())
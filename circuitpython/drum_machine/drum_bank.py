@@ -0,0 +1,291 @@
+# drum_bank.py --
+# binary pattern bank file for the drum machine
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# File layout (little-endian):
+#
+#   header, 16 bytes:
+#     0  magic 'MPSB'
+#     4  version (u8), num_pads (u8), record_size (u16)
+#     8  num_records (u16), reserved (6 bytes)
+#   index, num_records * 4 bytes:
+#     offset (u32) of each record
+#   records, each record_size bytes, starting at a multiple of 512:
+#     0  name (16 bytes, zero padded)
+#     16 num_steps (u8), flags (u8), checksum (u16) of rest of record
+#     20 hits (num_steps bytes, see drum_pattstore)
+#     20+num_steps  vels (num_steps bytes), if flags has _FLAG_VELS
+#     20+2*num_steps  swing (u8), nudge (num_pads * s8), if flags has _FLAG_GROOVE
+#
+# Banks saved before velocities existed have no vels, their patterns
+# load with the default velocity.  Likewise banks saved before grooves
+# existed load straight, with no swing or nudge.
+#
+# record_size is a power of two <= 512 so records never straddle a
+# 512-byte flash sector. That lets save() rewrite just the changed
+# records in place, one sector each. Each is first written to a shadow
+# file, path + ".rec" (slot (u16), checksum (u16) of the record, the
+# record), so if a power loss tears the write in place, open() puts the
+# shadow copy back instead of the pattern being lost.  The shadow is
+# removed once the save's done.  When patterns were added or removed,
+# save() removes any shadow, then writes a whole new bank to a temp file
+# and renames it over the old one, so a power loss never leaves a
+# half-written bank, or a shadow of the old one's records.
+#
+
+import os, struct
+from drum_pattstore import Pattern
+
+_MAGIC = b'MPSB'
+_VERSION = 1
+_HEADER_FMT = '<4sBBHH6x'
+_HEADER_SIZE = 16
+_REC_HEADER_FMT = '<16sBBH'
+_REC_HEADER_SIZE = 20
+_SHADOW_FMT = '<HH'
+_SHADOW_HEADER_SIZE = 4
+_SECTOR = 512
+_FLAG_VELS = 0x01
+_FLAG_GROOVE = 0x02
+
+def _checksum(buf, start):
+    # Fletcher-16
+    a = b = 0
+    for i in range(start, len(buf)):
+        a = (a + buf[i]) % 255
+        b = (b + a) % 255
+    return (b << 8) | a
+
+def _exists(path):
+    try:
+        os.stat(path)
+        return True
+    except OSError:
+        return False
+
+def _record_len(num_steps, num_pads):
+    return _REC_HEADER_SIZE + num_steps * 2 + 1 + num_pads  # hits, vels, groove
+
+def _record_size(num_steps, num_pads=8):
+    size = 64
+    while size < _record_len(num_steps, num_pads):
+        size *= 2
+    return size
+
+class PatternBank:
+    def __init__(self, path, num_pads=8, num_steps=32):
+        self.path = path
+        self.tmp_path = path + ".tmp"
+        self.shadow_path = path + ".rec"  # copy of the record being written in place
+        self.num_pads = num_pads
+        self.record_size = _record_size(num_steps, num_pads)
+        self.num_records = 0
+        self._offsets = []
+        self._rec = bytearray(self.record_size)  # reused record buffer
+        self.write_count = 0  # records written by last save()
+
+    def open(self):
+        """Read header & index. Returns number of patterns in bank, 0 if no usable bank."""
+        if not _exists(self.path) and _exists(self.tmp_path):
+            os.rename(self.tmp_path, self.path)  # finish an interrupted save
+        self.num_records = 0
+        self._offsets = []
+        try:
+            with open(self.path, 'rb') as fp:
+                magic, version, num_pads, rec_size, num_records = struct.unpack(
+                    _HEADER_FMT, fp.read(_HEADER_SIZE))
+                if magic != _MAGIC or version != _VERSION:
+                    print("pattern bank: bad header", self.path)
+                    return 0
+                index = fp.read(num_records * 4)
+        except (OSError, ValueError) as error:  # maybe no file, or short
+            print("pattern bank:", error)
+            return 0
+        self.num_pads = num_pads
+        self.record_size = rec_size
+        self._rec = bytearray(rec_size)
+        self._offsets = list(struct.unpack('<%dI' % num_records, index))
+        self.num_records = num_records
+        self._restore_shadow()
+        return num_records
+
+    def _restore_shadow(self):
+        # put back the last record written in place, if its write was torn
+        try:
+            with open(self.shadow_path, 'rb') as fp:
+                shadow = fp.read()
+        except OSError:  # none
+            return
+        if len(shadow) != _SHADOW_HEADER_SIZE + self.record_size:
+            return  # torn itself, so the bank wasn't touched yet
+        slot, csum = struct.unpack_from(_SHADOW_FMT, shadow)
+        rec = shadow[_SHADOW_HEADER_SIZE:]
+        if slot >= self.num_records or csum != _checksum(rec, 0):
+            return
+        with open(self.path, 'r+b') as fp:
+            fp.seek(self._offsets[slot])
+            fp.readinto(self._rec)
+            if self._rec != rec:
+                print("pattern bank: restoring record", slot)
+                fp.seek(self._offsets[slot])
+                fp.write(rec)
+
+    def load(self, i, fp=None):
+        """Load one Pattern by record number, without reading the rest of the bank.
+        Returns None if the record is corrupt."""
+        rec = self._rec
+        if fp is None:
+            with open(self.path, 'rb') as fp:
+                fp.seek(self._offsets[i])
+                fp.readinto(rec)
+        else:
+            fp.seek(self._offsets[i])
+            fp.readinto(rec)
+        name, num_steps, flags, csum = struct.unpack_from(_REC_HEADER_FMT, rec)
+        if csum != _checksum(rec, _REC_HEADER_SIZE):
+            print("pattern bank: bad record", i)
+            return None
+        name = name.rstrip(b'\0').decode()
+        hits = rec[_REC_HEADER_SIZE:_REC_HEADER_SIZE+num_steps]
+        vels = None
+        if flags & _FLAG_VELS:
+            vels = rec[_REC_HEADER_SIZE+num_steps:_REC_HEADER_SIZE+num_steps*2]
+        patt = Pattern(name, num_pads=self.num_pads, hits=hits, vels=vels)
+        if flags & _FLAG_GROOVE:
+            g = _REC_HEADER_SIZE + num_steps * 2
+            patt.swing = rec[g]
+            for p in range(self.num_pads):
+                n = rec[g + 1 + p]
+                patt.nudge[p] = n - 256 if n > 127 else n
+        patt.dirty = False
+        patt.bank_slot = i
+        return patt
+
+    def load_all(self):
+        """Load every Pattern in bank, skipping corrupt records."""
+        patts = []
+        with open(self.path, 'rb') as fp:
+            for i in range(self.num_records):
+                p = self.load(i, fp)
+                if p:
+                    patts.append(p)
+        return patts
+
+    def _pack(self, patt):
+        rec = self._rec
+        for i in range(len(rec)):
+            rec[i] = 0
+        n = patt.num_steps
+        rec[_REC_HEADER_SIZE:_REC_HEADER_SIZE+n] = patt.hits
+        rec[_REC_HEADER_SIZE+n:_REC_HEADER_SIZE+n*2] = patt.vels
+        g = _REC_HEADER_SIZE + n * 2
+        rec[g] = patt.swing
+        for p in range(self.num_pads):
+            rec[g + 1 + p] = patt.nudge[p] & 0xff
+        csum = _checksum(rec, _REC_HEADER_SIZE)
+        struct.pack_into(_REC_HEADER_FMT, rec, 0, patt.name.encode()[:16], n,
+                         _FLAG_VELS | _FLAG_GROOVE, csum)
+        return rec
+
+    def _unchanged(self, patt, rec):
+        # patt is still what _pack() put in rec, it wasn't edited since
+        n = patt.num_steps
+        g = _REC_HEADER_SIZE + n * 2
+        if rec[16] != n or rec[_REC_HEADER_SIZE:g] != patt.hits + patt.vels or rec[g] != patt.swing:
+            return False
+        for p in range(self.num_pads):
+            if rec[g + 1 + p] != patt.nudge[p] & 0xff:
+                return False
+        return rec[0:16].rstrip(b'\0') == patt.name.encode()[:16]
+
+    def _remove_shadow(self):
+        if _exists(self.shadow_path):
+            os.remove(self.shadow_path)
+
+    def _layout_matches(self, patterns):
+        if len(patterns) != self.num_records:
+            return False
+        for i, p in enumerate(patterns):
+            if p.bank_slot != i or _record_len(p.num_steps, self.num_pads) > self.record_size:
+                return False
+        return True
+
+    def save(self, patterns):
+        """Save patterns. Only changed ones are rewritten if the bank layout
+        still matches, otherwise the whole bank is rewritten atomically.
+        Returns number of records written."""
+        for _ in self.save_steps(patterns):
+            pass
+        return self.write_count
+
+    def save_all(self, patterns):
+        """Write whole bank to temp file, then rename it over the old bank."""
+        for _ in self.save_steps(patterns, rewrite=True):
+            pass
+        return self.write_count
+
+    def save_steps(self, patterns, rewrite=False):
+        """Generator version of save(), writes one record (or, saving in place,
+        its shadow copy) each time it's advanced and yields (records done,
+        records total), so a save can be spread across many main loop
+        iterations. A pattern is only left clean once its record is
+        flushed (rewriting, once the new bank's renamed into place), so if a
+        write fails or the save is abandoned it's still dirty, as is a
+        pattern edited after its record was packed."""
+        patterns = list(patterns)  # patterns added/removed during save wait for next save
+        self.write_count = 0
+        if (not rewrite and self.num_records and _exists(self.path)
+                and self._layout_matches(patterns)):
+            todo = [i for i, p in enumerate(patterns) if p.dirty]
+            if not todo:
+                return
+            with open(self.path, 'r+b') as fp, open(self.shadow_path, 'wb') as shadow:
+                for n, i in enumerate(todo):
+                    p = patterns[i]
+                    rec = self._pack(p)
+                    shadow.seek(0)
+                    shadow.write(struct.pack(_SHADOW_FMT, i, _checksum(rec, 0)))
+                    shadow.write(rec)
+                    shadow.flush()  # the copy's complete before the record's touched
+                    yield n, len(todo)
+                    fp.seek(self._offsets[i])
+                    fp.write(rec)
+                    fp.flush()
+                    if self._unchanged(p, rec):  # not edited while the shadow was written
+                        p.dirty = False
+                    self.write_count += 1
+                    yield n + 1, len(todo)
+            self._remove_shadow()  # every record's whole
+            return
+
+        max_steps = max([p.num_steps for p in patterns] + [0])
+        self.record_size = max(self.record_size, _record_size(max_steps, self.num_pads))
+        self._rec = bytearray(self.record_size)
+        num = len(patterns)
+        # records start at first sector boundary after header & index
+        rec_start = (_HEADER_SIZE + num * 4 + _SECTOR - 1) // _SECTOR * _SECTOR
+        offsets = [rec_start + i * self.record_size for i in range(num)]
+        self._remove_shadow()  # its slot & record size are the old bank's
+        try:
+            with open(self.tmp_path, 'wb') as fp:
+                fp.write(struct.pack(_HEADER_FMT, _MAGIC, _VERSION, self.num_pads,
+                                     self.record_size, num))
+                fp.write(struct.pack('<%dI' % num, *offsets))
+                fp.write(bytes(rec_start - _HEADER_SIZE - num * 4))
+                for i, p in enumerate(patterns):
+                    fp.write(self._pack(p))
+                    fp.flush()
+                    p.dirty = False
+                    self.write_count += 1
+                    yield i + 1, num
+            if _exists(self.path):
+                os.remove(self.path)  # FAT can't rename over an existing file
+            os.rename(self.tmp_path, self.path)
+        except BaseException:  # write failed or save abandoned, the old bank's still there
+            for p in patterns:
+                p.dirty = True
+            raise
+        for i, p in enumerate(patterns):
+            p.bank_slot = i
+        self._offsets = offsets
+        self.num_records = num
@@ -0,0 +1,154 @@
+# drum_clock.py --
+# MIDI clock follower for the drum machine sequencer
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# MIDI clock is 24 ticks (0xF8) per quarter note.  Tick arrival times
+# are jittery (UART & USB buffering, and we only see them once per main
+# loop), so instead of timing steps from raw tick intervals, a small
+# phase-locked loop keeps a smoothed tick time and period: each tick's
+# error from the predicted time nudges the phase by 1/2^a and the
+# period by 1/2^b of it (an alpha-beta filter).  It starts with fast
+# gains to lock quickly, then switches to slow ones to filter jitter.
+# Lone outliers (e.g. a tick read late after a display refresh) are
+# clamped, a run of them means the tempo jumped, so it re-locks.
+#
+# Everything is integer math, periods are kept in 1/16 microseconds.
+#
+# Tick (and so step) numbers count from START or Song Position.  If the
+# sequencer is playing on its own tempo when a clock turns up without a
+# START (a DAW sends clock while it's stopped), they mean nothing to it:
+# 'synced' is False, and align() renumbers the ticks so the clock's next
+# step is the sequencer's, before it follows.
+#
+# Usage:
+#   midi_clock = MidiClockFollower(steps_per_beat=4)
+#   on 0xF8:  if midi_clock.tick(now_us): ...transport starts now...
+#             if midi_clock.locked:
+#                 if not midi_clock.synced: midi_clock.align(sched.step, sched.step_time(sched.step))
+#                 sched.follow(*midi_clock.timing())
+#   sequencer started on its own tempo: midi_clock.synced = False
+#   on START / CONTINUE / STOP / SONG_POSITION: midi_clock.start() etc
+#
+
+TICKS_PER_BEAT = 24
+
+class MidiClockFollower:
+    def __init__(self, steps_per_beat=4, timeout_us=500000):
+        self.ticks_per_step = TICKS_PER_BEAT // steps_per_beat
+        self.timeout_us = timeout_us  # no ticks for this long, clock's gone
+        self.next_tick = 0  # song position of next tick, in ticks
+        self.period16 = 0  # smoothed tick period, in 1/16 us
+        self.tick_us = 0  # smoothed time of last tick, whole us...
+        self.tick_frac = 0  # ...and 1/16 us
+        self.phase_err = 0  # last tick's arrival minus its predicted time, us
+        self.count = 0  # ticks since (re)locking
+        self.locked = False
+        self.running = False  # transport running per START/CONTINUE/STOP
+        self.synced = False  # tick numbers are the sequencer's steps, see align()
+        self._start_pending = False
+        self._outliers = 0
+        self._last_us = None  # raw time of last tick
+
+    def active(self, now_us):
+        """True if clock ticks are coming in."""
+        return self._last_us is not None and now_us - self._last_us < self.timeout_us
+
+    def bpm(self, shown=0):
+        """Tempo to the nearest BPM, or shown if it's within 3/4 BPM of that,
+        so a displayed tempo doesn't flicker between two with clock jitter."""
+        if not self.period16:
+            return 0
+        div = self.period16 * TICKS_PER_BEAT
+        if shown and abs(60000000 * 16 * 4 - shown * 4 * div) <= 3 * div:
+            return shown
+        return (60000000 * 16 + div // 2) // div  # nearest, a period a hair long isn't 1 bpm less
+
+    def start(self):
+        """MIDI START: transport starts from the top on the next tick."""
+        self.next_tick = 0
+        self._start_pending = True
+
+    def cont(self):
+        """MIDI CONTINUE: transport starts from song position on the next tick."""
+        self._start_pending = True
+
+    def stop(self):
+        self.running = False
+        self._start_pending = False
+
+    def song_position(self, sixteenths):
+        """MIDI Song Position Pointer, in 16th notes (6 ticks each)."""
+        self.next_tick = sixteenths * 6
+
+    def tick(self, now_us):
+        """Handle a clock tick that arrived at now_us. Returns True if transport
+        starts with this tick (the first one after START or CONTINUE)."""
+        last = self._last_us
+        self._last_us = now_us
+        self.next_tick += 1
+        if last is None or now_us - last > self.timeout_us:  # sequencer's carried on without us
+            self.synced = False
+        starting = self._start_pending
+        if starting:
+            self._start_pending = False
+            self.running = True
+            self.synced = True  # transport starts from timing()
+        if self.count == 0 or last is None or now_us - last > self.timeout_us:
+            self._lock_start(now_us)
+            return starting
+        if self.count == 1:  # first interval is all we have
+            self.period16 = (now_us - last) * 16
+            self._set_tick(now_us, 0)
+            self.count = 2
+            return starting
+        p16 = self.tick_frac + self.period16  # predicted time, from last smoothed tick
+        err16 = (now_us - self.tick_us) * 16 - p16
+        limit = self.period16 // 2
+        if err16 > limit or err16 < -limit:
+            self._outliers += 1
+            if self._outliers >= 4:  # not jitter, tempo changed
+                self._lock_start(now_us)
+                return starting
+            err16 = limit // 2 if err16 > 0 else -limit // 2
+        else:
+            self._outliers = 0
+        a, b = (1, 3) if self.count < TICKS_PER_BEAT else (3, 7)
+        self.period16 += err16 >> b
+        p16 += err16 >> a
+        self.tick_us += p16 >> 4
+        self.tick_frac = p16 & 15
+        self.phase_err = err16 >> 4
+        self.count += 1
+        self.locked = self.count >= 4
+        return starting
+
+    def _lock_start(self, now_us):
+        self._set_tick(now_us, 0)
+        self.count = 1
+        self.locked = False
+        self._outliers = 0
+        self.phase_err = 0
+
+    def _set_tick(self, t_us, frac):
+        self.tick_us = t_us
+        self.tick_frac = frac
+
+    def align(self, step, due_us):
+        """Renumber ticks so the sequencer's 'step', due at due_us, is the
+        clock's next step, starting on the tick nearest due_us (at least the
+        next tick, at most a step on), so following doesn't move the pattern."""
+        tps = self.ticks_per_step
+        period = max(self.period16 >> 4, 1)
+        ticks = (due_us - self.tick_us + period // 2) // period
+        ticks = min(max(ticks, 1), max(tps - 1, 1))  # a whole step on would be the step before, now
+        self.next_tick = step * tps - ticks + 1
+        self.synced = True
+
+    def timing(self):
+        """(step, due_us, period_num, period_den) of the next step starting at or
+        after the last tick, for StepScheduler.follow()."""
+        tps = self.ticks_per_step
+        last = self.next_tick - 1  # song position of last tick
+        boundary = -(-last // tps) * tps
+        d16 = self.tick_frac + (boundary - last) * self.period16
+        return boundary // tps, self.tick_us + (d16 >> 4), self.period16 * tps, 16
@@ -13,19 +13,46 @@
 # |>kit      |  |>del pat  |
 # | tr808    |  |          |
 # |>bpm: 120 |  |>midi:rcv |  # 'rcv' or 'off'
-# |          |  |          |
+# |1234/s 7ms|  |          |  # when profiling, loops/sec & longest loop
 # |hold2save |  |>aud:plug |  # 'plug' or 'spk'  maybe
 # +----------+  +----------+
 #
+# or the step grid view, of the pattern being played, a row per step and
+# a column per pad, with the playhead at the right:
+#
+# +----------+
+# |patt0     |
+# |     play |
+# | # . # .  |
+# | . . . .  |
+# | . . # . <|  # playhead
+# | . . . .  |
+# |   ...    |
+# +----------+
+#
+# The grid is a 1-bit displayio.Bitmap, one pixel per step of each pad
+# (scaled up 3x), and grid_shown mirrors what's drawn, so updating a step
+# only writes the cells that changed and moving the playhead is two
+# pixels.  displayio then only sends the changed area to the display.
+#
+# Labels are only set when their text changes (setting a bitmap_label's
+# text redraws its bitmap), and auto_refresh is off: code.py calls
+# disp_refresh() when there's time before the next sequencer step, and
+# that sends a frame only if something changed, at most max_fps a second.
+# So display traffic never lands on top of a step.
+#
 
 import board
 import displayio, terminalio
 from adafruit_display_text.bitmap_label import Label
+from adafruit_ticks import ticks_ms, ticks_diff
 
 # display setup begin
 dw,dh = 64,128
 display = board.DISPLAY
 display.rotation = 90
+display.auto_refresh = False  # refreshed by disp_refresh()
+max_fps = 20
 font = terminalio.FONT
 
 mainscreen = displayio.Group()
@@ -44,14 +71,36 @@ txt_kit     = Label(font, text="kit:",    x=6, y=70)
 txt_bpm     = Label(font, text="bpm:",    x=6, y=85)
 txt_bpm_val = Label(font, text='120',    x=35, y=85)
 
+txt_prof    = Label(font, text="",        x=0, y=100)
 txt_midi    = Label(font, text="midi:",   x=0, y=110)
 txt_info    = Label(font, text="   ",     x=0, y=120)
 
 for t in (txt1, txt2, txt3, txt_emode0, txt_emode1, txt_emode2,
           txt_play, txt_patt, txt_kit, txt_bpm, txt_bpm_val,
-          txt_midi, txt_info):
+          txt_prof, txt_midi, txt_info):
     mainscreen.append(t)
 
+# step grid view
+grid_pads, grid_steps = 8, 32
+grid_playhead_x = grid_pads * 2  # pads are every other column, playhead column after them
+gridscreen = displayio.Group()
+txt_gpatt = Label(font, text="patt", x=0, y=6)
+txt_gplay = Label(font, text="stop", x=40, y=18)
+grid_bitmap = displayio.Bitmap(grid_playhead_x + 1, grid_steps, 2)
+grid_palette = displayio.Palette(2)
+grid_palette[0] = 0x000000
+grid_palette[1] = 0xFFFFFF
+grid_group = displayio.Group(scale=3, x=(dw - (grid_playhead_x + 1) * 3) // 2, y=dh - grid_steps * 3)
+grid_group.append(displayio.TileGrid(grid_bitmap, pixel_shader=grid_palette))
+for t in (txt_gpatt, txt_gplay, grid_group):
+    gridscreen.append(t)
+grid_shown = bytearray(grid_steps)  # hits of each step as drawn
+grid_playhead = 0  # step the playhead is drawn at
+grid_bitmap[grid_playhead_x, grid_playhead] = 1
+grid_view = False  # showing gridscreen instead of mainscreen
+
+disp_dirty = False  # labels or grid changed since last refresh
+last_refresh_millis = ticks_ms()
 
 # display setup end
 
@@ -59,29 +108,101 @@ for t in (txt1, txt2, txt3, txt_emode0, txt_emode1, txt_emode2,
 # Display updates
 #
 
+# set a label's text, only if it changed
+def set_text(label, astr):
+    global disp_dirty
+    if label.text != astr:
+        label.text = astr
+        disp_dirty = True
+
+# send changes to the display, if any and if the last frame wasn't too recent.
+# Returns True if it refreshed
+def disp_refresh():
+    global disp_dirty, last_refresh_millis
+    if not disp_dirty:
+        return False
+    now = ticks_ms()
+    if ticks_diff(now, last_refresh_millis) < 1000 // max_fps:
+        return False
+    # no target frame rate: with one, a manual refresh() skips the frame if
+    # it's been over a frame since the last call, which is always at max_fps
+    if not display.refresh(target_frames_per_second=None):
+        return False
+    last_refresh_millis = now
+    disp_dirty = False
+    return True
+
 # update step_millis and display
 def disp_bpm(bpm):
-    txt_bpm_val.text = str(bpm)
+    set_text(txt_bpm_val, str(bpm))
 
 # update display
 def disp_play(playing,recording):
     if playing:
-        txt_play.text = "play" if not recording else "odub"
+        state = "play" if not recording else "odub"
     else:
-        txt_play.text = "stop" if not recording else "reco"  # FIXME:
+        state = "stop" if not recording else "reco"  # FIXME:
+    set_text(txt_play, state)
+    set_text(txt_gplay, state)
 
 # update display
 def disp_pattern(name):
-    txt_patt.text = name
+    set_text(txt_patt, name)
+    set_text(txt_gpatt, name)
 
 def disp_kit(name):
-    txt_kit.text = name
+    set_text(txt_kit, name)
 
 # update display
 def disp_encmode(encoder_mode):
-    txt_emode0.text = '>' if encoder_mode==0 else ' '
-    txt_emode1.text = '>' if encoder_mode==1 else ' '
-    txt_emode2.text = '>' if encoder_mode==2 else ' '
+    set_text(txt_emode0, '>' if encoder_mode==0 else ' ')
+    set_text(txt_emode1, '>' if encoder_mode==1 else ' ')
+    set_text(txt_emode2, '>' if encoder_mode==2 else ' ')
 
 def disp_info(astr):
-    txt_info.text = astr
+    set_text(txt_info, astr)
+
+# main loop profiler summary, "" when not profiling
+def disp_prof(astr):
+    set_text(txt_prof, astr)
+
+#
+# Step grid view
+#
+
+# switch between the main screen and the step grid
+def disp_grid_show(show):
+    global grid_view, disp_dirty
+    grid_view = show
+    display.root_group = gridscreen if show else mainscreen
+    disp_dirty = True
+
+# redraw the cells of one step that differ from the pattern
+def disp_grid_step(patt, step):
+    global disp_dirty
+    if step >= grid_steps:
+        return
+    hits = patt.hits[step] if step < patt.num_steps else 0
+    changed = hits ^ grid_shown[step]
+    if not changed:
+        return
+    grid_shown[step] = hits
+    for p in range(grid_pads):
+        if (changed >> p) & 1:
+            grid_bitmap[p * 2, step] = (hits >> p) & 1
+    disp_dirty = disp_dirty or grid_view
+
+# redraw every step that differs from the pattern, e.g. for a new pattern
+def disp_grid_pattern(patt):
+    for step in range(grid_steps):
+        disp_grid_step(patt, step)
+
+# move the playhead to step
+def disp_grid_playhead(step):
+    global grid_playhead, disp_dirty
+    if step == grid_playhead or step >= grid_steps:
+        return
+    grid_bitmap[grid_playhead_x, grid_playhead] = 0
+    grid_bitmap[grid_playhead_x, step] = 1
+    grid_playhead = step
+    disp_dirty = disp_dirty or grid_view
@@ -0,0 +1,85 @@
+# drum_engine.py --
+# step engine for the drum machine sequencer, shared by code.py & code_async.py
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Decides which pads play when: the hits & velocity of each step are read
+# from the Pattern once the step comes into the scheduler's lookahead
+# window, and when the step is due, pads nudged late by the Groove are held
+# back and handed out by nudged() once their delay is up.  Everything is
+# bitmasks (bit N = pad N), the app does the actual playing, so the main
+# loop of code.py and the sequencer task of code_async.py fire steps the
+# same way.
+#
+# Usage:
+#   engine = StepEngine(sched, groove)
+#   while True:
+#       engine.ahead(patt)          # often, before the step is due
+#       step = engine.poll(patt)
+#       if step >= 0:
+#           if engine.nudge_hits: ...play engine.nudged() now, at engine.nudge_vel...
+#           hits = engine.play(step, skip)  # skip: pads not to play, e.g. just recorded
+#           ...play pads in hits at engine.vel...
+#       if engine.nudge_hits:
+#           hits = engine.nudged(now_us)  ...play them at engine.nudge_vel...
+#
+
+class StepEngine:
+    def __init__(self, sched, groove):
+        self.sched = sched  # drum_sched.StepScheduler
+        self.groove = groove  # drum_sched.Groove, rebuilt in place by the app
+        self.hits = 0  # bitmask of what the upcoming step will play, prepared ahead of time
+        self.vel = 0  # and its velocity byte
+        self.nudge_hits = 0  # pads of the last step still to play, nudged late
+        self.nudge_vel = 0
+        self.nudge_step_us = 0  # when the last step played
+        self._ahead_step = -1  # which step hits was prepared for
+
+    def ahead(self, patt, now_us=None):
+        """Get the next step's hits ready when it's within the lookahead window.
+        Returns the step number if it did, otherwise -1."""
+        step = self.sched.ahead(now_us)
+        if step >= 0:
+            self._load(patt, step)
+        return step
+
+    def poll(self, patt, now_us=None):
+        """Returns the step number if a step is due, with hits & vel ready,
+        otherwise -1."""
+        step = self.sched.poll(now_us)
+        if step >= 0 and step != self._ahead_step:  # skipped ahead or started, so not prepared
+            self._load(patt, step)
+        return step
+
+    def _load(self, patt, step):
+        n = step % patt.num_steps
+        self.hits = patt.hits[n]
+        self.vel = patt.vels[n]
+        self._ahead_step = step
+
+    def play(self, step, skip=0):
+        """Step 'step' from poll() is playing: returns the pads to play now,
+        pads nudged late are kept in nudge_hits for nudged().  Play any
+        nudge_hits left from the last step first."""
+        hits = self.hits & ~skip
+        delayed = self.groove.delayed
+        self.nudge_hits = hits & delayed
+        self.nudge_vel = self.vel
+        self.nudge_step_us = self.sched.step_time(step)
+        return hits & ~delayed
+
+    def nudged(self, now_us=None):
+        """Returns the nudged pads whose delay is up at now_us (all of them if
+        now_us is None), and takes them out of nudge_hits."""
+        hits = self.nudge_hits
+        if now_us is not None:
+            delays = self.groove.pad_delays
+            since = now_us - self.nudge_step_us
+            for i in range(len(delays)):
+                if (hits >> i) & 1 and since < delays[i]:
+                    hits &= ~(1 << i)
+        self.nudge_hits &= ~hits
+        return hits
+
+    def stop(self):
+        """Transport stopped, forget pads waiting to play."""
+        self.nudge_hits = 0
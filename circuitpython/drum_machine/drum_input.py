@@ -0,0 +1,125 @@
+# drum_input.py --
+# timestamped input events for the drum machine: keys, encoder & MIDI in one queue
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Every main loop, poll() each input source: all of them are drained (up
+# to a quota each, so a flood on one can't crowd out the others) into a
+# preallocated ring of events, each with the time it happened on the
+# sequencer's microsecond clock.  Key presses keep the time keypad saw
+# them, not when they were read, so a press during a slow loop is still
+# recorded on the step it was played on.  MIDI messages get the time their
+# port was read.  Events are kept in time order, so pop() hands them out
+# oldest first whichever source they came from, and ones not handled this
+# loop (e.g. a step came due) stay queued for the next.
+#
+# An event is a slot in parallel arrays: t (us), src (source number given
+# to poll_*()), num (key number, or MIDI message type), d0 & d1 (key:
+# pressed & 0, encoder: delta & 0, MIDI: data bytes).  t is a list, not an
+# array('l'): times count from startup, and pass 2^31 us after 36 minutes,
+# more than the RP2040's 32 bit 'l' holds.
+#
+# Usage:
+#   inputs = InputRing(sched.clock)
+#   inputs.poll_keys(keys, SRC_KEYS)
+#   inputs.poll_encoder(encoder, SRC_ENC)
+#   inputs.poll_midi(midi_uart_in, SRC_UART)   # a todbot_smolishmidi.MidiIn
+#   inputs.poll_midi(midi_usb_in, SRC_USB, thru=midi_out)  # and soft thru, see drum_midiout.py
+#   while (i := inputs.pop()) >= 0:
+#       if inputs.src[i] == SRC_KEYS: ...key inputs.num[i] pressed if inputs.d0[i]...
+#
+
+from array import array
+import keypad
+from adafruit_ticks import ticks_ms, ticks_diff
+
+class InputRing:
+    def __init__(self, clock, size=64):
+        self.clock = clock  # drum_sched clock, event times are its microseconds
+        self.size = size  # must be a power of 2
+        self.t = [0] * size  # a list, times outgrow 32 bits
+        self.src = bytearray(size)
+        self.num = bytearray(size)
+        self.d0 = array('b', [0] * size)
+        self.d1 = array('b', [0] * size)
+        self.count = 0  # events queued
+        self.overflows = 0  # events dropped because the ring was full
+        self._head = 0  # slot of oldest event
+        self._mask = size - 1
+        self._event = keypad.Event()  # for get_into(), no allocation per key
+        self._enc_last = None
+
+    def _put(self, t, src, num, d0, d1):
+        if self.count == self.size:
+            self.overflows += 1
+            return
+        mask = self._mask
+        tt = self.t
+        i = (self._head + self.count) & mask
+        n = self.count
+        while n:  # keep time order, move any later events up a slot (rare)
+            j = (i - 1) & mask
+            if tt[j] <= t:
+                break
+            tt[i] = tt[j]
+            self.src[i] = self.src[j]
+            self.num[i] = self.num[j]
+            self.d0[i] = self.d0[j]
+            self.d1[i] = self.d1[j]
+            i = j
+            n -= 1
+        tt[i] = t
+        self.src[i] = src
+        self.num[i] = num
+        self.d0[i] = d0
+        self.d1[i] = d1
+        self.count += 1
+
+    def pop(self):
+        """Slot of the oldest event, taken off the queue, or -1 if none.
+        Its fields stay valid until the next poll_*()."""
+        if not self.count:
+            return -1
+        i = self._head
+        self._head = (i + 1) & self._mask
+        self.count -= 1
+        return i
+
+    def poll_keys(self, keys, src, limit=16):
+        """Take up to limit events of a keypad.Keys, timed by their timestamps.
+        Any more stay in its queue until next time."""
+        ev = self._event
+        events = keys.events
+        now_us = self.clock.now_us()
+        now_ms = ticks_ms()
+        while limit and self.count < self.size and events.get_into(ev):
+            self._put(now_us - ticks_diff(now_ms, ev.timestamp) * 1000, src,
+                      ev.key_number, 1 if ev.pressed else 0, 0)
+            limit -= 1
+
+    def poll_encoder(self, encoder, src):
+        """An event with the change in a rotaryio.IncrementalEncoder's position, if it moved."""
+        pos = encoder.position
+        if self._enc_last is None:
+            self._enc_last = pos
+        delta = pos - self._enc_last
+        if delta:
+            delta = max(-127, min(127, delta))
+            self._enc_last += delta
+            self._put(self.clock.now_us(), src, 0, delta, 0)
+
+    def poll_midi(self, midi_in, src, thru=None):
+        """Decode a todbot_smolishmidi.MidiIn's waiting messages, if they all fit.
+        At most len(midi_in.messages) a time, the rest wait in the port.
+        Each is also queued to thru (a drum_midiout.MidiOut) if given."""
+        if self.size - self.count < len(midi_in.messages):
+            return
+        n = midi_in.receive_all()
+        if not n:
+            return
+        now_us = self.clock.now_us()
+        msgs = midi_in.messages
+        for j in range(n):
+            msg = msgs[j]
+            self._put(now_us, src, msg.type, msg.data[0], msg.data[1])
+            if thru is not None:
+                thru.put_message(msg)
@@ -0,0 +1,207 @@
+# drum_kitcache.py --
+# drum kit sample cache for the drum machine
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Keeps the samples of recently used kits in RAM as audiocore.RawSamples,
+# evicting least-recently-used kits when over a byte budget. Samples too
+# big for the budget are streamed from flash with audiocore.WaveFile as
+# before, and their files are closed when their kit is evicted.
+# Kits can be prefetched a sample at a time with work(), so scrolling
+# through kits doesn't stall the sequencer.  Samples are read read_chunk
+# bytes at a time, so the audio gets mixed in between (see drum_latency.py),
+# and if given a drum_latency.AudioLatency each read is timed as a stall.
+# If the heap can't give a sample's buffer (it's fragmented), the sample
+# is streamed instead.
+#
+# Usage:
+#   kitcache = KitCache(kits, num_pads, budget=96*1024)
+#   waves = kitcache.get(kit_name)   # list of num_pads playable samples
+#   kitcache.prefetch(next_kit_name)
+#   kitcache.work()  # in main loop, loads one prefetch sample per call
+#
+
+import array
+
+# RIFF/WAVE parsing, just enough for the PCM files find_kits() finds
+def read_wav_header(fp):
+    """Returns (sample_rate, channels, bits, data_offset, data_len), fp left at data start.
+    Raises ValueError if not a PCM WAV."""
+    hdr = fp.read(12)
+    if len(hdr) < 12 or hdr[0:4] != b'RIFF' or hdr[8:12] != b'WAVE':
+        raise ValueError("not a WAV")
+    fmt = None
+    while True:
+        chunk = fp.read(8)
+        if len(chunk) < 8:
+            raise ValueError("no data chunk")
+        cid = chunk[0:4]
+        clen = chunk[4] | (chunk[5] << 8) | (chunk[6] << 16) | (chunk[7] << 24)
+        if cid == b'fmt ':
+            f = fp.read(clen + (clen & 1))
+            if (f[0] | (f[1] << 8)) != 1:
+                raise ValueError("not PCM")
+            channels = f[2] | (f[3] << 8)
+            rate = f[4] | (f[5] << 8) | (f[6] << 16) | (f[7] << 24)
+            bits = f[14] | (f[15] << 8)
+            fmt = (rate, channels, bits)
+        elif cid == b'data':
+            if fmt is None:
+                raise ValueError("data before fmt")
+            return fmt + (fp.tell(), clen)
+        else:
+            fp.seek(clen + (clen & 1), 1)
+
+def _alloc_samples(num):
+    # array of num signed 16-bit samples, allocated once at full size: a range
+    # has a length, so it's filled in place, no list or bytes copied from.
+    # Values are overwritten by the read, num is at most 32768 (64 kB)
+    return array.array('h', range(num))
+
+class _Kit:
+    def __init__(self, num_pads):
+        self.samples = [None] * num_pads
+        self.files = [None] * num_pads  # open files of streamed samples
+        self.nbytes = 0  # RAM used by RawSamples
+        self.loaded = 0  # how many pads are loaded
+
+class KitCache:
+    def __init__(self, kits, num_pads, budget=96*1024, max_sample_bytes=48*1024, audio_lib=None,
+                 latency=None, read_chunk=4096):
+        if audio_lib is None:
+            import audiocore as audio_lib
+        self.audio_lib = audio_lib  # audiocore, or a stand-in when testing on host
+        self.kits = kits  # from find_kits(): kit name -> list of WAV paths
+        self.num_pads = num_pads
+        self.budget = budget  # bytes of RAM for samples, across all cached kits
+        self.max_sample_bytes = max_sample_bytes  # bigger samples are streamed
+        self.latency = latency  # drum_latency.AudioLatency to time reads with, or None
+        self.read_chunk = read_chunk  # bytes per readinto(), audio is mixed between them
+        self.cached = {}  # kit name -> _Kit
+        self.lru = []  # kit names, least recently used first
+        self.current = None  # name of kit last returned by get()
+        self._prefetch = None  # name of kit being prefetched
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def nbytes(self):
+        return sum(k.nbytes for k in self.cached.values())
+
+    def _touch(self, name):
+        if name in self.lru:
+            self.lru.remove(name)
+        self.lru.append(name)
+
+    def _evict(self, need, keep):
+        # drop least recently used kits until "need" more bytes fit
+        i = 0
+        while self.nbytes + need > self.budget and i < len(self.lru):
+            name = self.lru[i]
+            if name in keep:
+                i += 1
+                continue
+            self._close(name)
+
+    def _close(self, name):
+        kit = self.cached.pop(name)
+        self.lru.remove(name)
+        for i in range(self.num_pads):
+            s = kit.samples[i]
+            if kit.files[i]:  # streamed WaveFile, close it for real
+                s.deinit()
+                kit.files[i].close()
+            kit.samples[i] = kit.files[i] = None
+
+    def _read(self, fp, buf):
+        # in read_chunk pieces, each a blocking flash read
+        mv = memoryview(buf)
+        step = self.read_chunk // 2  # samples
+        latency = self.latency
+        for i in range(0, len(buf), step):
+            if latency: latency.begin()
+            fp.readinto(mv[i:i + step])
+            if latency: latency.end()
+
+    def _load_sample(self, name, kit, i):
+        fname = self.kits[name][i]
+        latency = self.latency
+        if latency: latency.begin()
+        fp = open(fname, "rb")
+        try:
+            try:
+                rate, channels, bits, _, data_len = read_wav_header(fp)
+            except ValueError as error:
+                print("kitcache:", fname, error)
+                rate, channels, bits, data_len = 0, 0, 0, 0
+            if latency: latency.end()
+            if bits == 16 and data_len <= self.max_sample_bytes:
+                self._evict(data_len, (name, self.current))
+                if self.nbytes + data_len <= self.budget:
+                    try:
+                        buf = _alloc_samples(data_len // 2)
+                        self._read(fp, buf)
+                        sample = self.audio_lib.RawSample(buf, channel_count=channels,
+                                                          sample_rate=rate)
+                    except MemoryError:  # heap too fragmented for it
+                        print("kitcache:", fname, "no RAM for it, streaming")
+                    else:
+                        kit.samples[i] = sample
+                        kit.nbytes += data_len
+                        return
+            # too big or no room, stream it from flash
+            fp.seek(0)
+            kit.samples[i] = self.audio_lib.WaveFile(fp)
+            kit.files[i] = fp
+            fp = None  # kit's now, closed by _close()
+        finally:
+            if fp:
+                fp.close()
+
+    def _kit(self, name):
+        kit = self.cached.get(name)
+        if kit is None:
+            kit = _Kit(self.num_pads)
+            self.cached[name] = kit
+        self._touch(name)
+        return kit
+
+    def get(self, name):
+        """Returns list of playable samples for kit, loading whatever isn't cached."""
+        kit = self.cached.get(name)
+        if kit and kit.loaded == self.num_pads:
+            self.hits += 1
+        else:
+            self.misses += 1
+        self.current = name
+        kit = self._kit(name)
+        while kit.loaded < self.num_pads:
+            self._load_sample(name, kit, kit.loaded)
+            kit.loaded += 1
+        if self._prefetch == name:
+            self._prefetch = None
+        return kit.samples
+
+    def prefetch(self, name):
+        """Load kit in the background, one sample per work() call."""
+        if name != self.current:
+            self._prefetch = name
+
+    def work(self):
+        """Load one sample of the kit being prefetched. Returns True if there's more to do."""
+        name = self._prefetch
+        if name is None:
+            return False
+        kit = self._kit(name)
+        if self.current:
+            self._touch(self.current)  # current kit is never least recently used
+        if kit.loaded < self.num_pads:
+            self._load_sample(name, kit, kit.loaded)
+            kit.loaded += 1
+        if kit.loaded == self.num_pads:
+            self._prefetch = None
+            return False
+        return True
+
+    def deinit(self):
+        for name in list(self.cached):
+            self._close(name)
@@ -0,0 +1,201 @@
+# drum_kitindex.py --
+# cached index of drum kits, so booting doesn't rescan /drumkits
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# The index is a small JSON file in the kit directory, holding every kit's
+# samples with their sizes, durations and WAV formats (checked from the
+# WAV headers when the index was built).  At boot, find_kits() only lists
+# the kit directories, without opening any samples, and rebuilds the index
+# if a kit or sample was added, removed or renamed, or a sample's or
+# kit.json's size or mtime changed.  (FAT doesn't update a directory's
+# mtime when files are added to it, so the listings are what's compared.)
+# Kits with samples that aren't the format the mixer wants are left out,
+# so they can't cause glitches later.
+#
+# A kit can have a kit.json with its choke groups, a group number per pad
+# (0 = none), pads in a group cut each other off (see drum_voices.py), and
+# the MIDI notes that play its pads (a preset or each pad's notes, see
+# drum_notes.py):
+#  { "choke": [0, 0, 1, 1, 0, 0, 0, 0],    # closed & open hi-hat
+#    "notes": "gm" }
+# Kits without them get the app's defaults.
+#
+# The index can also be built on a computer with host/make_kit_index.py
+#
+# Index looks like:
+#  { "version": 4, "root_mtime": 1234,
+#    "format": [22050, 1, 16],   # sample rate, channels, bits
+#    "kits": [ { "name": "kit0_909", "dir": "kit0_909", "mtime": 1234,
+#                "samples": [ ["00_909kick4.wav", 23198, 525], ...],  # file, size, millisecs
+#                "choke": [0, 0, 1, 1, 0, 0, 0, 0], "notes": "gm",  # from kit.json, or null
+#                "files": [ ["00_909kick4.wav", 23198, 1234], ..., ["kit.json", 45, 1234] ] },
+#              ... ],                               # WAVs & kit.json: file, size, mtime
+#    "rejected": [ ["kit3_bad", "05tom.wav: 44100 Hz", "kit3_bad", 1234, [...]], ...] }
+#                                                   # name, why, dir, mtime, files
+#
+
+import os, json
+from drum_kitcache import read_wav_header
+from drum_notes import check_notes
+
+INDEX_NAME = "kits_index.json"
+KIT_CONF_NAME = "kit.json"
+_VERSION = 4
+
+def _mtime(path):
+    return os.stat(path)[8]
+
+def _is_dir(path):
+    return os.stat(path)[0] & 0x4000
+
+def _is_sample(fname):
+    fname = fname.lower()
+    return fname.endswith(".wav") and not fname.startswith(".")
+
+def _kit_dirs(kit_root):
+    # names in kit_root that could be kits, build_index() skips any that aren't dirs
+    return [d for d in sorted(os.listdir(kit_root)) if d.lower().startswith("kit")]
+
+def _kit_files(kpath):
+    # [file, size, mtime] of every file in a kit dir build_index() reads
+    files = []
+    for fname in sorted(os.listdir(kpath)):
+        if _is_sample(fname) or fname == KIT_CONF_NAME:
+            st = os.stat(kpath + "/" + fname)
+            files.append([fname, st[6], st[8]])
+    return files
+
+def read_kit_conf(kpath, num_pads):
+    """(choke groups, notes) from a kit's kit.json, each None if it has none.
+    Raises ValueError if it's not right."""
+    try:
+        with open(kpath + "/" + KIT_CONF_NAME, 'r') as fp:
+            conf = json.load(fp)
+    except OSError:  # no kit.json
+        return None, None
+    choke = conf.get('choke')
+    if choke is not None:
+        if len(choke) < num_pads or not all(isinstance(g, int) and 0 <= g < 256 for g in choke):
+            raise ValueError("choke needs %d group numbers 0-255" % num_pads)
+        choke = choke[:num_pads]
+    notes = conf.get('notes')
+    if notes is not None:
+        check_notes(notes, num_pads)
+    return choke, notes
+
+def build_index(kit_root, num_pads, rate=22050, channels=1, bits=16):
+    """Scan kit_root, check every sample's WAV header, return index dict."""
+    index = {'version': _VERSION, 'root_mtime': _mtime(kit_root),
+             'format': [rate, channels, bits], 'kits': [], 'rejected': []}
+    for kitdir in _kit_dirs(kit_root):
+        kname = kitdir.lower()
+        kpath = kit_root + "/" + kitdir
+        if not _is_dir(kpath):  # ignore files
+            continue
+        files = _kit_files(kpath)
+        samples = []
+        problem = None
+        for samplename, size, _ in files:
+            if not _is_sample(samplename):
+                continue
+            spath = kpath + "/" + samplename
+            try:
+                with open(spath, "rb") as fp:
+                    srate, schans, sbits, _, data_len = read_wav_header(fp)
+            except (OSError, ValueError) as error:
+                problem = "%s: %s" % (samplename, error)
+                break
+            if (srate, schans, sbits) != (rate, channels, bits):
+                problem = "%s: %d Hz %d ch %d bit" % (samplename, srate, schans, sbits)
+                break
+            frames = data_len // (schans * sbits // 8)
+            samples.append([samplename, size, frames * 1000 // srate])
+        if problem is None and len(samples) < num_pads:
+            problem = "only %d samples" % len(samples)
+        choke = notes = None
+        if problem is None:
+            try:
+                choke, notes = read_kit_conf(kpath, num_pads)
+            except (ValueError, AttributeError, TypeError) as error:  # bad JSON, or not a dict or list
+                problem = "%s: %s" % (KIT_CONF_NAME, error)
+        if problem:
+            index['rejected'].append([kname, problem, kitdir, _mtime(kpath), files])
+            continue
+        index['kits'].append({'name': kname, 'dir': kitdir, 'mtime': _mtime(kpath),
+                              'samples': samples, 'choke': choke, 'notes': notes,
+                              'files': files})
+    return index
+
+def index_is_current(index, kit_root, num_pads, rate=22050, channels=1, bits=16):
+    """True if no kit or sample was added, removed or renamed since the index
+    was built, and no sample or kit.json changed size or mtime."""
+    try:
+        if (index.get('version') != _VERSION or index['format'] != [rate, channels, bits]
+                or index['root_mtime'] != _mtime(kit_root)):
+            return False
+        known = [kit['dir'] for kit in index['kits']] + [r[2] for r in index['rejected']]
+        for kdir in _kit_dirs(kit_root):
+            if kdir not in known and _is_dir(kit_root + "/" + kdir):  # kit copied in
+                return False
+        for kit in index['kits']:
+            kpath = kit_root + "/" + kit['dir']
+            if _mtime(kpath) != kit['mtime'] or len(kit['samples']) < num_pads:
+                return False
+            files = _kit_files(kpath)
+            if [f[0] for f in files if _is_sample(f[0])] != [s[0] for s in kit['samples']]:
+                return False  # sample added, removed or renamed
+            if files != kit['files']:  # sample or kit.json rewritten
+                return False
+        for _, _, kdir, mtime, files in index['rejected']:  # maybe a rejected kit got fixed
+            kpath = kit_root + "/" + kdir
+            if _mtime(kpath) != mtime or _kit_files(kpath) != files:
+                return False
+    except (OSError, KeyError, TypeError, ValueError):  # kit gone, or odd index
+        return False
+    return True
+
+def load_index(path):
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+def save_index(index, path):
+    try:
+        with open(path, 'w') as fp:
+            json.dump(index, fp)
+    except OSError as error:  # read-only filesystem
+        print("kit index: can't save:", error)
+
+def kits_from_index(index, kit_root):
+    """Make the 'kits' dict that find_kits() in code.py returns:
+    kit name -> list of sample paths, plus 'kit_names' of sorted names,
+    'kit_chokes' of kit name -> choke groups and 'kit_notes' of kit name ->
+    MIDI notes (None for the defaults)."""
+    kits = {}
+    chokes = {}
+    notes = {}
+    for kit in index['kits']:
+        kpath = kit_root + "/" + kit['dir']
+        kits[kit['name']] = [kpath + "/" + s[0] for s in kit['samples']]
+        chokes[kit['name']] = kit['choke']
+        notes[kit['name']] = kit['notes']
+    kits['kit_names'] = sorted(kits.keys())
+    kits['kit_chokes'] = chokes
+    kits['kit_notes'] = notes
+    return kits
+
+def find_kits(kit_root, num_pads, rate=22050, channels=1, bits=16):
+    """Returns kits dict from the index, rebuilding the index if it's out of date."""
+    path = kit_root + "/" + INDEX_NAME
+    index = load_index(path)
+    if index is None or not index_is_current(index, kit_root, num_pads, rate, channels, bits):
+        print("kit index: rebuilding", path)
+        index = build_index(kit_root, num_pads, rate, channels, bits)
+        save_index(index, path)
+        index['root_mtime'] = _mtime(kit_root)  # saving index may have changed it
+        save_index(index, path)
+    for kname, problem, _, _, _ in index['rejected']:
+        print("ERROR: kit '%s' rejected: %s" % (kname, problem))
+    return kits_from_index(index, kit_root)
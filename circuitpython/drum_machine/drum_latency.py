@@ -0,0 +1,107 @@
+# drum_latency.py --
+# audio latency mode for the drum machine: mixer buffer size from measured stalls
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# audiomixer.Mixer double-buffers: while one buffer plays, the other is
+# mixed by a background task, so a voice.play() is heard from the start of
+# the buffer after the one playing, one to two buffers later (a 4096 byte
+# buffer of 16-bit mono at 22050 Hz is 93 ms).  Background tasks run
+# between Python bytecodes, but not during a blocking call like a flash
+# read or write or a display refresh.  If one of those takes longer than a
+# buffer the next one isn't mixed in time, and the audio underruns (a
+# click or a gap).
+#
+# So code.py times each blocking call with begin() & end() (KitCache its
+# sample reads), and this keeps the longest one (stall_max) and counts
+# the ones longer than the buffer in use (underruns, each a likely audible
+# underrun).  best_size() is the smallest of BUFFER_SIZES whose buffer is
+# at least margin_pct of the longest stall.  The size chosen is saved to a
+# file for the next start, as a Mixer can't change its buffer once made.
+#
+# Usage:
+#   latency = AudioLatency(clock, sample_rate=22050)
+#   mixer = audiomixer.Mixer(..., buffer_size=latency.load('/audio_buffer.txt'))
+#   latency.begin(); display.refresh(); latency.end()
+#   if latency.best_size() != latency.saved_size:  # e.g. when stopped
+#       latency.save('/audio_buffer.txt', latency.best_size())
+#
+
+BUFFER_SIZES = (512, 1024, 2048, 4096, 8192)  # Mixer buffer_size bytes to choose from
+
+class AudioLatency:
+    def __init__(self, clock, sample_rate=22050, bytes_per_frame=2, buffer_size=2048, margin_pct=150):
+        self.clock = clock  # drum_sched clock
+        self.sample_rate = sample_rate
+        self.bytes_per_frame = bytes_per_frame  # bits_per_sample // 8 * channel_count
+        self.margin_pct = margin_pct  # buffer must be this % of the longest stall
+        self.set_size(buffer_size)
+        self.saved_size = buffer_size  # size load() found or save() saved, for next start
+        self.reset()
+
+    def reset(self):
+        """Forget the stalls measured so far, e.g. the ones at startup."""
+        self.stalls = 0  # blocking calls timed
+        self.stall_max = 0  # longest, us
+        self.underruns = 0  # longer than the buffer in use
+        self._begin_us = 0
+
+    def set_size(self, buffer_size):
+        """The Mixer buffer_size in use."""
+        self.buffer_size = buffer_size
+        self._buffer_us = self.buffer_us(buffer_size)
+
+    def buffer_us(self, buffer_size):
+        """Play time of one Mixer buffer of buffer_size bytes."""
+        return buffer_size // self.bytes_per_frame * 1000000 // self.sample_rate
+
+    def begin(self):
+        """Start of a blocking call."""
+        self._begin_us = self.clock.now_us()
+
+    def end(self):
+        """End of the blocking call begin() was called before."""
+        self.stall(self.clock.now_us() - self._begin_us)
+
+    def stall(self, us):
+        """Background tasks (so audio mixing) didn't run for us."""
+        self.stalls += 1
+        if us > self.stall_max:
+            self.stall_max = us
+        if us > self._buffer_us:
+            self.underruns += 1
+
+    def best_size(self):
+        """Smallest buffer size that covers the longest stall, with margin."""
+        need_us = self.stall_max * self.margin_pct // 100
+        for size in BUFFER_SIZES:
+            if self.buffer_us(size) >= need_us:
+                return size
+        return BUFFER_SIZES[-1]
+
+    def load(self, path):
+        """Set & return the buffer size saved by save(), or keep the one set if none."""
+        try:
+            with open(path, 'r') as fp:
+                size = int(fp.read())
+            if size in BUFFER_SIZES:
+                self.set_size(size)
+        except (OSError, ValueError) as error:  # maybe no file
+            print("latency load:", error)
+        self.saved_size = self.buffer_size
+        return self.buffer_size
+
+    def save(self, path, buffer_size):
+        """Save buffer_size for load() to find next start."""
+        self.saved_size = buffer_size
+        try:
+            with open(path, 'w') as fp:
+                fp.write(str(buffer_size))
+        except OSError as error:  # CIRCUITPY not writable
+            print("latency save:", error)
+
+    def report(self):
+        """Print stall stats & what they mean for the buffer size to the serial console."""
+        us = self._buffer_us
+        print("latency: buffer %d bytes (%d ms, pad to sound %d-%d ms), %d stalls, longest %d us,"
+              " %d underruns, best %d bytes" % (self.buffer_size, us // 1000, us // 1000, 2 * us // 1000,
+                                               self.stalls, self.stall_max, self.underruns, self.best_size()))
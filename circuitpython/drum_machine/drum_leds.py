@@ -0,0 +1,61 @@
+# drum_leds.py --
+# LED renderer for the drum machine
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Colors live in a preallocated bytearray framebuffer (3 bytes/key),
+# fading is done in place with a lookup table, and the NeoPixels are only
+# written & shown when the frame differs from what was last shown.
+#
+
+class DrumLeds:
+    def __init__(self, pixels, keynum_to_padnum, num_pads, fade=10, floor=5):
+        self.pixels = pixels  # neopixel.NeoPixel w/ auto_write=False
+        self.num_keys = len(pixels)
+        self.fb = bytearray(self.num_keys * 3)  # frame being drawn
+        self.shown = bytearray(self.num_keys * 3)  # frame last sent to pixels
+        self.shown[0] = 1  # force first show()
+        # pad number -> key number, instead of keynum_to_padnum.index(padnum)
+        self.pad_to_key = bytearray(num_pads)
+        for k, p in enumerate(keynum_to_padnum):
+            if 0 <= p < num_pads:
+                self.pad_to_key[p] = k
+        self.set_fade(fade, floor)
+
+    def set_fade(self, fade, floor):
+        """Fade step and minimum brightness per color channel."""
+        # fade lookup table: new value for every old value
+        self.fade_lut = bytes(max(v - fade, floor) for v in range(256))
+
+    def set_key(self, keynum, color):
+        """Set a key to 0xRRGGBB color."""
+        i = keynum * 3
+        fb = self.fb
+        fb[i] = (color >> 16) & 0xff
+        fb[i+1] = (color >> 8) & 0xff
+        fb[i+2] = color & 0xff
+
+    def set_pad(self, padnum, color):
+        self.set_key(self.pad_to_key[padnum], color)
+
+    def fade(self):
+        """Fade all keys towards floor brightness, in place."""
+        fb = self.fb
+        lut = self.fade_lut
+        for i in range(len(fb)):
+            fb[i] = lut[fb[i]]
+
+    def show(self):
+        """Send changed keys to the pixels and show them, if anything changed.
+        Returns True if pixels were updated."""
+        fb = self.fb
+        shown = self.shown
+        if fb == shown:
+            return False
+        pixels = self.pixels
+        for k in range(self.num_keys):
+            i = k * 3
+            if fb[i] != shown[i] or fb[i+1] != shown[i+1] or fb[i+2] != shown[i+2]:
+                pixels[k] = (fb[i] << 16) | (fb[i+1] << 8) | fb[i+2]
+        shown[:] = fb
+        pixels.show()
+        return True
@@ -0,0 +1,254 @@
+# drum_midiout.py --
+# MIDI out for the drum machine: the sequence's notes, clock & soft thru, queued & batched
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Everything sent goes into one preallocated ring of bytes, and flush()
+# writes what's queued to each port in one write.  A port is never given
+# more than it can take without blocking: a UART's transmit FIFO drains at
+# the baud rate, so a port with byte_us set gets only what its FIFO has
+# room for, as estimated from the last write, and the rest waits for the
+# next flush.  Each port has its own place in the ring, so a slow UART
+# doesn't hold up USB.  If the ring fills, messages are dropped (counted
+# in 'dropped') rather than waiting.
+#
+# A sequencer step's note-offs (for the notes of the step before) &
+# note-ons are got ready by prepare() when the step comes into the
+# scheduler's lookahead window, so when it's due step() just copies them
+# into the ring & flushes: external gear hears the step as soon after it's
+# due as the mixer does, at little cost to that loop.  MIDI clock (24 per
+# beat) is timed from the StepScheduler's straight grid, so it follows
+# the tempo the steps play at, not swing or nudges: poll() every loop
+# sends the clocks that are due, and flushes anything left queued.
+#
+# Usage:
+#   midi_out = MidiOut(sched, num_pads, channel=10)
+#   midi_out.add_port(usb_midi.ports[1])
+#   midi_out.add_port(uart, fifo=32, byte_us=320)  # 31250 baud
+#   midi_out.set_notes(out_notes(notes, num_pads))  # pad -> note sent, see drum_notes.py
+#   midi_out.start(step, clock=True)  # START, then clock from step
+#   midi_out.prepare(step, hits, vel, pads_mute)  # step's in lookahead window
+#   midi_out.step(step, hits, vel, pads_mute)  # and fired
+#   midi_out.poll()  # every loop
+#   midi_out.stop()
+#
+
+NOTE_ON = 0x90
+CLOCK = 0xF8
+START = 0xFA
+STOP = 0xFC
+ACCENT = 0x80  # accented step velocity, see drum_pattstore.py
+
+class MidiOut:
+    def __init__(self, sched, num_pads=8, channel=10, size=256):
+        self.sched = sched  # drum_sched.StepScheduler, clock times come from its grid
+        self.num_pads = num_pads
+        self.status = NOTE_ON | (channel - 1)  # channel 1-16
+        self.notes = bytearray(num_pads)  # note sent for each pad, see set_notes()
+        self._offs = bytearray(3 * num_pads)  # and its note-off
+        self._offs_mv = memoryview(self._offs)
+        self.size = size  # must be a power of 2
+        self.buf = bytearray(size)
+        self._mv = memoryview(self.buf)
+        self._head = 0
+        self.count = 0  # bytes queued, for the port furthest behind
+        self.dropped = 0  # messages that didn't fit
+        self.writes = 0
+        self.clocks_per_step = 24 // sched.steps_per_beat
+        self.clock_tick = -1  # next clock to send, in clocks from step 0, -1 = not sending
+        self.held = 0  # pads with a note on
+        self._batch = bytearray(6 * num_pads)  # next step's note-offs & note-ons, see prepare()
+        self._batch_mv = memoryview(self._batch)
+        self._batch_len = 0
+        self._batch_off = 0  # pads it ends the notes of
+        self._batch_on = 0  # and starts
+        self._batch_step = -1  # step it's for
+        self.ports = []
+        self._fifo = []  # most each port takes in a write
+        self._byte_us = []  # how fast its FIFO drains, 0 = doesn't matter
+        self._tail = []  # where each port is in the ring
+        self._in_fifo = []  # bytes left in its FIFO after the last write
+        self._sent_us = []  # and when that was
+        self.set_notes(bytes(36 + p for p in range(num_pads)))
+
+    def set_notes(self, notes):
+        """Note to send for each pad, e.g. from drum_notes.out_notes().  Ends any notes on."""
+        self.pads_off()
+        for i in range(self.num_pads):
+            self.notes[i] = notes[i]
+            self._offs[3 * i:3 * i + 3] = bytes((self.status, notes[i], 0))  # note-on, velocity 0
+
+    def add_port(self, port, fifo=64, byte_us=0):
+        """Send to port (anything with write()), at most fifo bytes a write,
+        that drain at byte_us each (0 for USB)."""
+        self.ports.append(port)
+        self._fifo.append(fifo)
+        self._byte_us.append(byte_us)
+        self._tail.append(self._head)
+        self._in_fifo.append(0)
+        self._sent_us.append(0)
+
+    def put(self, n, b0, b1=0, b2=0):
+        """Queue a message of n (1-3) bytes, False if dropped."""
+        if self.count + 3 >= self.size:  # 3 bytes are written, and head mustn't reach a tail
+            self.dropped += 1
+            return False
+        mask = self.size - 1
+        h = self._head
+        self.buf[h] = b0
+        self.buf[(h + 1) & mask] = b1
+        self.buf[(h + 2) & mask] = b2
+        self._head = (h + n) & mask
+        self.count += n
+        return True
+
+    def put_message(self, msg):
+        """Queue a todbot_smolishmidi Message as it came in (soft thru), not sysex."""
+        status = msg.type | (msg.channel or 0)
+        if status < 0xF0:
+            n = 2 if status & 0xF0 in (0xC0, 0xD0) else 3
+        elif status == 0xF2:
+            n = 3
+        elif status in (0xF1, 0xF3):
+            n = 2
+        elif status >= 0xF8 or status == 0xF6:
+            n = 1
+        else:  # sysex, undefined
+            return False
+        return self.put(n, status, msg.data[0], msg.data[1])
+
+    def pad_on(self, pad, vel):
+        """Queue a note-on for pad at step velocity vel (a retrigger ends its note first)."""
+        note = self.notes[pad]
+        if (self.held >> pad) & 1:
+            self.put(3, self.status, note, 0)
+        self.put(3, self.status, note, 127 if vel & ACCENT else (vel or 1))
+        self.held |= 1 << pad
+
+    def pads_off(self):
+        """Queue note-offs (note-on, velocity 0) for all pads' notes still on."""
+        held = self.held
+        for i in range(self.num_pads):
+            if not held:
+                break
+            if held & 1:
+                self.put(3, self.status, self.notes[i], 0)
+            held >>= 1
+        self.held = 0
+
+    def prepare(self, step, hits, vel, mute):
+        """Step 'step' will fire hits (pad bits) at vel: get its messages ready,
+        note-offs for the notes on now & note-ons for hits not muted in mute (a list)."""
+        batch = self._batch
+        offs = self._offs_mv
+        n = 0
+        held = self.held
+        for i in range(self.num_pads):
+            if not held >> i:
+                break
+            if (held >> i) & 1:
+                batch[n:n + 3] = offs[3 * i:3 * i + 3]
+                n += 3
+        vel = 127 if vel & ACCENT else (vel or 1)
+        on = 0
+        for i in range(self.num_pads):
+            if not hits >> i:
+                break
+            if (hits >> i) & 1 and not mute[i]:
+                batch[n:n + 3] = offs[3 * i:3 * i + 3]
+                batch[n + 2] = vel
+                n += 3
+                on |= 1 << i
+        self._batch_len = n
+        self._batch_off = held
+        self._batch_on = on
+        self._batch_step = step
+
+    def step(self, step, hits, vel, mute):
+        """Step 'step' fired: send what prepare() got ready for it (or prepare it
+        now, if it wasn't) in one flush."""
+        if self._batch_step != step:
+            self.prepare(step, hits, vel, mute)
+        self._batch_step = -1
+        if self.clock_tick >= 0:  # the step's clock tick goes first, in the same write
+            self._clocks(self.sched.clock.now_us())
+        n = self._batch_len
+        if self.count + n + 3 >= self.size:
+            self.dropped += 1
+        else:
+            h = self._head
+            end = h + n
+            if end <= self.size:
+                self.buf[h:end] = self._batch_mv[:n]
+            else:  # wraps
+                k = self.size - h
+                self.buf[h:] = self._batch_mv[:k]
+                self.buf[:n - k] = self._batch_mv[k:n]
+            self._head = end & (self.size - 1)
+            self.count += n
+            self.held = (self.held & ~self._batch_off) | self._batch_on
+        self.flush()
+
+    def start(self, step=0, clock=False):
+        """Transport started at step, send START & clock from there if clock."""
+        if clock:
+            self.put(1, START)
+            self.clock_tick = step * self.clocks_per_step
+        self.flush()
+
+    def stop(self):
+        """Transport stopped: end notes, STOP if sending clock."""
+        self.pads_off()
+        if self.clock_tick >= 0:
+            self.put(1, STOP)
+            self.clock_tick = -1
+        self.flush()
+
+    def _clocks(self, now_us):
+        """Queue the clocks that are due (catching up at most a beat)."""
+        per_step = self.clocks_per_step
+        tick = self.clock_tick
+        n = 0
+        while self.sched.tick_time(tick, per_step) <= now_us:
+            if n < 24:
+                self.put(1, CLOCK)
+                n += 1
+            tick += 1
+        self.clock_tick = tick
+
+    def poll(self, now_us=None):
+        """Send clocks that are due, then flush anything queued."""
+        if self.clock_tick >= 0:
+            if now_us is None:
+                now_us = self.sched.clock.now_us()
+            self._clocks(now_us)
+        if self.count:
+            self.flush(now_us)
+
+    def flush(self, now_us=None):
+        """Write what's queued, one write per port, as much as each takes without blocking."""
+        if not self.count:
+            return
+        mask = self.size - 1
+        tails = self._tail
+        count = 0
+        for p in range(len(self.ports)):
+            tail = tails[p]
+            n = (self._head - tail) & mask
+            if n:
+                sent = min(n, self._fifo[p], self.size - tail)
+                if self._byte_us[p]:  # only what fits in the FIFO, after what's drained since the last write
+                    if now_us is None:
+                        now_us = self.sched.clock.now_us()
+                    left = self._in_fifo[p] - (now_us - self._sent_us[p]) // self._byte_us[p]
+                    if left > 0:
+                        sent = min(sent, self._fifo[p] - left)
+                        if not sent:
+                            count = max(count, n)
+                            continue
+                    self._in_fifo[p] = max(left, 0) + sent
+                    self._sent_us[p] = now_us
+                self.ports[p].write(self._mv[tail:tail + sent])
+                self.writes += 1
+                tails[p] = (tail + sent) & mask
+                count = max(count, n - sent)
+        self.count = count
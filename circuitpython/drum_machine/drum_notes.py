@@ -0,0 +1,85 @@
+# drum_notes.py --
+# MIDI note to pad maps for the drum machine, e.g. General MIDI drums
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# A note map is a 128 byte table, note number -> pad number, UNMAPPED for
+# notes that don't play anything.  The same table is the MIDI parsers'
+# note_filter (see todbot_smolishmidi.py), so unmapped notes are dropped
+# as their bytes come in and never get to the app.  It's filled in place,
+# so changing kits doesn't make a new one the parsers would need telling of.
+#
+# A map is given as a preset name, or a list of each pad's notes (a note
+# number, or a list of them), as in a kit's kit.json:
+#   { "notes": "gm" }
+#   { "notes": [36, 38, [42, 44], 46, 39, [45, 47], 51, 49] }
+#
+# Usage:
+#   note_map = bytearray(128)
+#   note_table('gm', num_pads, note_map)
+#   pad = note_map[note]  # UNMAPPED if none
+#   midi_out.set_notes(out_notes('gm', num_pads))  # note each pad sends, see drum_midiout.py
+#
+
+UNMAPPED = 0xFF
+
+# General MIDI percussion (channel 10) notes of the 8 pads, laid out as the drumkits are,
+# each pad's first note is the one MIDI out sends
+GM_NOTES = (
+    (36, 35),  # kick: bass drum 1, acoustic bass drum
+    (38, 37, 40),  # snare: acoustic snare, side stick, electric snare
+    (42, 44),  # closed hi-hat, pedal hi-hat
+    (46,),  # open hi-hat
+    (39,),  # hand clap
+    (45, 41, 43, 47, 48, 50),  # toms: low-mid, then low floor to high
+    (51, 53, 59),  # ride 1, ride bell, ride 2
+    (49, 52, 55, 57),  # crash 1, chinese, splash, crash 2
+)
+
+PRESETS = ('gm', 'wrap')  # 'wrap': every note, note % num_pads
+
+def check_notes(notes, num_pads):
+    """Raises ValueError if notes isn't a preset or a list of num_pads pads' notes."""
+    if isinstance(notes, str):
+        if notes not in PRESETS:
+            raise ValueError("notes preset '%s' isn't one of %s" % (notes, ", ".join(PRESETS)))
+        return
+    if len(notes) != num_pads:
+        raise ValueError("notes needs %d pads' notes" % num_pads)
+    for pad_notes in notes:
+        for n in (pad_notes if isinstance(pad_notes, list) else (pad_notes,)):
+            if not isinstance(n, int) or not 0 <= n < 128:
+                raise ValueError("note %r not 0-127" % (n,))
+
+def note_table(notes, num_pads, table=None):
+    """Fill table (or a new one) from a preset name or list of pads' notes, returns it."""
+    if table is None:
+        table = bytearray(128)
+    if notes == 'wrap':
+        for n in range(128):
+            table[n] = n % num_pads
+        return table
+    for n in range(128):
+        table[n] = UNMAPPED
+    if notes == 'gm':
+        notes = GM_NOTES[:num_pads]
+    for pad, pad_notes in enumerate(notes):
+        for n in (pad_notes if isinstance(pad_notes, (list, tuple)) else (pad_notes,)):
+            table[n] = pad
+    return table
+
+def out_notes(notes, num_pads, out=None):
+    """Fill out (or a new bytearray) with the note MIDI out sends for each pad:
+    its first note, or for 'wrap' the first from 36 up that plays it.  Returns it."""
+    if out is None:
+        out = bytearray(num_pads)
+    if notes == 'gm':
+        notes = GM_NOTES[:num_pads]
+    for pad in range(num_pads):
+        if notes == 'wrap':
+            out[pad] = 36 + (pad - 36) % num_pads
+        else:
+            pad_notes = notes[pad]
+            if isinstance(pad_notes, (list, tuple)):
+                pad_notes = pad_notes[0] if pad_notes else 36 + pad  # no notes play it, send something
+            out[pad] = pad_notes
+    return out
@@ -0,0 +1,147 @@
+# drum_pattstore.py --
+# compact pattern storage for the drum machine
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# A Pattern stores one byte per step, with bit N set if pad N fires on
+# that step (so up to 8 pads).  A 32-step pattern is 32 bytes instead of
+# 8 lists of 32 ints, and "which pads fire at step N" is one lookup.
+#
+#   step:   0        1        2        3   ...
+#   hits: 00000101 00000000 00000100 00000000  (kick+hatc, -, hatc, -)
+#
+# Alongside it is one velocity byte per step, for all the pads that fire
+# on it: bits 0-6 are the velocity (1-127) and bit 7 is the accent lane,
+# like a TR-909's accent.  Steps default to velocity 127 without accent,
+# which plays at full level as before velocities existed.  Since the pads
+# on a step share its velocity, a hit recorded onto a step that already
+# has other pads on it keeps the step's velocity, rather than re-leveling
+# the hits recorded before it.
+#
+#   vels: 11111111 01100100 01100100 01100100  (accent 127, 100, 100, 100)
+#
+# level_tables() makes the velocity -> mixer voice level table, indexed
+# by the velocity byte, so playing a step needs no float math.
+#
+# Each pattern also has a groove: swing (50-75, the percent of a pair of
+# steps the second step starts at, 50 is straight, 66 is triplet feel)
+# and a nudge per pad (-50 to 50 percent of a step, early or late), which
+# drum_sched.Groove turns into microsecond tables for the scheduler.
+#
+
+from array import array
+
+VEL_MASK = 0x7f
+ACCENT = 0x80
+DEFAULT_VEL = 127
+SWING_MIN, SWING_MAX = 50, 75
+NUDGE_MAX = 50
+
+def level_tables(curve=2.0, accent_amount=32):
+    """256 mixer levels (0.0-1.0) indexed by step velocity byte: the 128 entry
+    velocity curve, then the same with velocity raised by accent_amount."""
+    levels = [0.0] * 256
+    for v in range(128):
+        levels[v] = (v / 127) ** curve
+        levels[ACCENT | v] = (min(v + accent_amount, 127) / 127) ** curve
+    return levels
+
+class Pattern:
+    def __init__(self, name, num_steps=32, num_pads=8, hits=None, vels=None,
+                 swing=SWING_MIN, nudge=None):
+        self.name = name
+        self.num_pads = num_pads
+        self.hits = bytearray(num_steps) if hits is None else bytearray(hits)
+        if vels is None:
+            vels = bytes([DEFAULT_VEL]) * len(self.hits)
+        self.vels = bytearray(vels)
+        self.swing = swing
+        self.nudge = array('b', nudge if nudge is not None else [0] * num_pads)
+        self.dirty = True  # changed since last saved
+        self.bank_slot = None  # record number in pattern bank file, if saved there
+
+    @property
+    def num_steps(self):
+        return len(self.hits)
+
+    def step_hits(self, step):
+        """Bitmask of pads that fire at step."""
+        return self.hits[step]
+
+    def step_vel(self, step):
+        """Velocity byte of step, accent in bit 7."""
+        return self.vels[step]
+
+    def get(self, pad, step):
+        return (self.hits[step] >> pad) & 1
+
+    def set(self, pad, step, on=True, vel=None):
+        """Turn pad on or off at step. A vel (1-127) sets the step's velocity,
+        keeping its accent, but only if no other pad is on at step: the
+        velocity is shared by all the step's pads, and theirs came first."""
+        if on:
+            if vel and not self.hits[step] & ~(1 << pad):
+                self.vels[step] = (self.vels[step] & ACCENT) | (vel & VEL_MASK)
+            self.hits[step] |= (1 << pad)
+        else:
+            self.hits[step] &= ~(1 << pad) & 0xff
+        self.dirty = True
+
+    def accent(self, step):
+        return self.vels[step] >> 7
+
+    def set_accent(self, step, on=True):
+        if on:
+            self.vels[step] |= ACCENT
+        else:
+            self.vels[step] &= VEL_MASK
+        self.dirty = True
+
+    def set_swing(self, swing):
+        self.swing = min(max(swing, SWING_MIN), SWING_MAX)
+        self.dirty = True
+
+    def set_nudge(self, pad, nudge):
+        """Play pad nudge percent of a step late (or early, if negative)."""
+        self.nudge[pad] = min(max(nudge, -NUDGE_MAX), NUDGE_MAX)
+        self.dirty = True
+
+    def clear_track(self, pad):
+        """Turn off all steps of one pad."""
+        mask = ~(1 << pad) & 0xff
+        hits = self.hits
+        for i in range(len(hits)):
+            hits[i] &= mask
+        self.dirty = True
+
+    def track(self, pad):
+        """One pad's steps as an int bitmask, bit N = step N."""
+        t = 0
+        for i in range(len(self.hits)):
+            t |= ((self.hits[i] >> pad) & 1) << i
+        return t
+
+    def copy(self, name=None):
+        return Pattern(name or self.name, num_pads=self.num_pads, hits=self.hits, vels=self.vels,
+                       swing=self.swing, nudge=self.nudge)
+
+    def to_strs(self):
+        """Pattern as list of '1010' strings, one per pad."""
+        return [''.join('1' if (h >> p) & 1 else '0' for h in self.hits)
+                for p in range(self.num_pads)]
+
+    @classmethod
+    def from_strs(cls, name, strs, num_steps=None):
+        """Make a Pattern from a list of '1000 1000' strings, one per pad, eliding
+        whitespace. If num_steps is longer than the strings, they're repeated."""
+        strs = [s.replace(' ', '') for s in strs]
+        slen = len(strs[0])
+        num_steps = num_steps or slen
+        patt = cls(name, num_steps=num_steps, num_pads=len(strs))
+        for p, s in enumerate(strs):
+            for i in range(num_steps):
+                if s[i % slen] == '1':
+                    patt.hits[i] |= (1 << p)
+        return patt
+
+    def __repr__(self):
+        return "Pattern(%r, %d steps)" % (self.name, len(self.hits))
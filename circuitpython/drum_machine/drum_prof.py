@@ -0,0 +1,189 @@
+# drum_prof.py --
+# main loop profiler for the drum machine
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Times each stage of the main loop (the time since the previous mark()),
+# counts loops, tracks the longest loop (the worst stall) and keeps
+# histograms of stage times and of step lateness.  All counters live in
+# arrays allocated up front and updated in place, so profiling doesn't
+# grow the heap.  code.py only calls in here when profiling is on
+# ("if profiling: prof.mark(0)"), so when it's off it costs a global
+# lookup per stage.
+#
+# Histogram bins are powers of two: bin 0 is under 256 us, bin 1 under
+# 512 us, and so on, the last bin is everything longer.  The bin comes
+# from a lookup table of time / 256 us, and mark() is kept to a handful
+# of lines, so profiling doesn't slow the loop much when it's on either.
+#
+# Usage:
+#   prof = LoopProfiler(sched.clock, ('midi', 'leds', 'seq'))
+#   prof.reset()
+#   while True:
+#       if prof.loop(): ...once a second, show prof.summary()...
+#       midi_receive()
+#       prof.mark(0)  # time since loop start was 'midi'
+#       ...
+#       prof.late(sched.late_us)  # when a step plays
+#   prof.report()  # print it all, and start over
+#
+# LatencyMeter does the same for input to sound times: call add() with
+# how long ago the event that just played a voice happened.
+#
+#   pad_lat = LatencyMeter('pads')
+#   voice.play(sample); pad_lat.add(clock.now_us() - key_event_us)
+#   pad_lat.report(); pad_lat.reset()
+#
+
+from array import array
+
+BIN_NAMES = ('<256', '<512', '<1m', '<2m', '<4m', '<8m', '<16m', 'more')
+NUM_BINS = 8
+# time >> 8 -> bin (number of bits), for times under 64 ms
+_BIN_LUT = bytes(min(len(bin(v)) - 2 if v else 0, NUM_BINS - 1) for v in range(256))
+
+class LoopProfiler:
+    def __init__(self, clock, stage_names, window_us=1000000):
+        self.clock = clock
+        self.stage_names = stage_names
+        self.window_us = window_us  # loop rate & worst stall for summary() are over this
+        n = len(stage_names) + 1  # last row is the whole loop
+        self.num_bins = NUM_BINS
+        self.stage_us = array('L', [0] * n)  # total time in each stage
+        self.stage_max = array('L', [0] * n)  # longest time in each stage
+        self.stage_hist = array('L', [0] * (n * NUM_BINS))  # row per stage
+        self.late_hist = array('L', [0] * NUM_BINS)  # step lateness
+        self.reset()
+
+    def reset(self):
+        """Zero everything, the next loop() starts timing."""
+        for a in (self.stage_us, self.stage_max, self.stage_hist, self.late_hist):
+            for i in range(len(a)):
+                a[i] = 0
+        self.loops = 0
+        self.steps = 0
+        self.late_max = 0
+        self.loop_rate = 0  # loops per second, over the last window
+        self.window_max = 0  # longest loop in the last window, us
+        self._window_loops = 0
+        self._window_max = 0
+        self._start_us = self._window_start = self._mark_us = self.clock.now_us()
+        self._loop_us = 0  # start of this loop, 0 until the first loop()
+
+    def _add(self, row, us):
+        self.stage_us[row] += us
+        if us > self.stage_max[row]:
+            self.stage_max[row] = us
+        us >>= 8
+        self.stage_hist[row * NUM_BINS + (_BIN_LUT[us] if us < 256 else NUM_BINS - 1)] += 1
+
+    def loop(self):
+        """Call at the top of the main loop. Returns True when a window of
+        window_us has passed, and loop_rate & window_max are updated."""
+        now = self.clock.now_us()
+        if self._loop_us:
+            us = now - self._loop_us
+            self._add(len(self.stage_names), us)
+            if us > self._window_max:
+                self._window_max = us
+        self._loop_us = self._mark_us = now
+        self.loops += 1
+        self._window_loops += 1
+        elapsed = now - self._window_start
+        if elapsed < self.window_us:
+            return False
+        self.loop_rate = self._window_loops * 1000000 // elapsed
+        self.window_max = self._window_max
+        self._window_loops = 0
+        self._window_max = 0
+        self._window_start = now
+        if now - self._start_us > 3600 * 1000000:  # totals would overflow in ~70 minutes
+            self.report()
+        return True
+
+    def mark(self, stage):
+        """End of stage number 'stage' (index into stage_names)."""
+        now = self.clock.now_us()
+        self._add(stage, now - self._mark_us)
+        self._mark_us = now
+
+    def late(self, late_us):
+        """A step played late_us after it was due."""
+        self.steps += 1
+        if late_us > self.late_max:
+            self.late_max = late_us
+        late_us >>= 8
+        self.late_hist[_BIN_LUT[late_us] if late_us < 256 else NUM_BINS - 1] += 1
+
+    def summary(self):
+        """Short text for the display: loop rate & longest loop in the last window."""
+        return "%d/s %dms" % (self.loop_rate, self.window_max // 1000)
+
+    def report(self):
+        """Print everything to the serial console, then start over."""
+        total = max(self.clock.now_us() - self._start_us, 1)
+        longest = self.stage_max[len(self.stage_names)]
+        print("prof: %d ms, %d loops (%d/s), longest loop %d us" % (
+            total // 1000, self.loops, self.loops * 1000000 // total, longest))
+        print("%-6s %8s %4s %7s " % ("stage", "ms", "%", "max us") +
+              " ".join("%6s" % b for b in BIN_NAMES))
+        for row, name in enumerate(self.stage_names + ('loop',)):
+            hist = self.stage_hist[row * NUM_BINS:(row + 1) * NUM_BINS]
+            print("%-6s %8d %4d %7d " % (name, self.stage_us[row] // 1000,
+                                        self.stage_us[row] * 100 // total, self.stage_max[row]) +
+                  " ".join("%6d" % h for h in hist))
+        print("%-6s %8s %4s %7d " % ("late", self.steps, "", self.late_max) +
+              " ".join("%6d" % h for h in self.late_hist))
+        self.reset()
+
+class LatencyMeter:
+    """Times from input events to the voice.play() they cause, e.g. pad press
+    to sound: count, min, mean, max and p99 (to bin_us, from a histogram),
+    all in counters allocated up front like LoopProfiler's."""
+    def __init__(self, name, bin_us=250, num_bins=64):
+        self.name = name
+        self.bin_us = bin_us
+        self.hist = array('L', [0] * num_bins)  # last bin is everything longer
+        self.reset()
+
+    def reset(self):
+        hist = self.hist
+        for i in range(len(hist)):
+            hist[i] = 0
+        self.count = 0
+        self.total_us = 0
+        self.min_us = 0
+        self.max_us = 0
+
+    def add(self, us):
+        """An event took us from happening to its voice playing."""
+        if us < 0:  # keypad timestamps are whole ms
+            us = 0
+        if not self.count or us < self.min_us:
+            self.min_us = us
+        if us > self.max_us:
+            self.max_us = us
+        self.count += 1
+        self.total_us += us
+        i = us // self.bin_us
+        n = len(self.hist)
+        self.hist[i if i < n else n - 1] += 1
+
+    def percentile(self, pct):
+        """Time pct % of events took at most, to the top of its histogram bin."""
+        need = (self.count * pct + 99) // 100
+        n = 0
+        for i in range(len(self.hist)):
+            n += self.hist[i]
+            if n >= need:
+                return min((i + 1) * self.bin_us, self.max_us)
+        return self.max_us
+
+    def mean(self):
+        return self.total_us // self.count if self.count else 0
+
+    def report(self, buffer_us=0):
+        """Print to the serial console, with when the sound starts if given the
+        mixer's buffer time (1 to 2 buffers after play(), see drum_latency.py)."""
+        print("%-6s %5d events, to play() min %d mean %d p99 %d max %d us" % (
+            self.name, self.count, self.min_us, self.mean(), self.percentile(99), self.max_us) +
+              (", to sound mean ~%d us" % (self.mean() + buffer_us * 3 // 2) if buffer_us and self.count else ""))
@@ -0,0 +1,202 @@
+# drum_sched.py --
+# step scheduler for the drum machine sequencer
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Step times are computed from the tempo with integer microsecond math
+# relative to a base time, so there is no cumulative drift: being late on
+# one step doesn't move any later step.
+#
+# Swing & micro-timing: set_offsets() gives the scheduler a table of
+# microsecond offsets added to each step's due time (cycled by step
+# number).  Groove builds that table, and per-pad delays, from a
+# pattern's swing & nudges, only when tempo or groove changes, so timing
+# a step is still one table lookup and integer adds.
+#
+# Usage:
+#   sched = StepScheduler(MonotonicClock(), bpm=120, steps_per_beat=4)
+#   sched.start()
+#   while True:
+#       step = sched.ahead()  # next step just came into lookahead window
+#       if step >= 0: ...prepare what step will play...
+#       step = sched.poll()   # a step is due now
+#       if step >= 0: ...play it...
+#
+
+import time
+from array import array
+
+class MonotonicClock:
+    """Microseconds since creation, from time.monotonic_ns()."""
+    def __init__(self):
+        self._t0 = time.monotonic_ns()
+
+    def now_us(self):
+        return (time.monotonic_ns() - self._t0) // 1000
+
+class VirtualClock:
+    """Clock for host-side testing, only moves when told to."""
+    def __init__(self, now_us=0):
+        self.t = now_us
+
+    def now_us(self):
+        return self.t
+
+    def advance(self, us):
+        self.t += us
+
+class StepScheduler:
+    def __init__(self, clock, bpm=120, steps_per_beat=4, lookahead_us=4000):
+        self.clock = clock
+        self.bpm = bpm
+        self.steps_per_beat = steps_per_beat
+        self.lookahead_us = lookahead_us
+        self.step = 0  # absolute number of next step to be played
+        self.late_us = 0  # how late the last step from poll() was
+        self.missed = 0  # steps skipped because we were more than a step late
+        self._base_us = 0  # due time of _base_step
+        self._base_step = 0
+        self._ahead_step = -1  # last step returned by ahead()
+        self._next_due = 0
+        self._offsets = None  # per-step offsets in us, see set_offsets()
+        self._update_period()
+
+    def _update_period(self):
+        # step period is 60e6 / (bpm * steps_per_beat) microseconds, kept as a
+        # fraction so step times are exact
+        self._period_num = 60000000
+        self._period_den = self.bpm * self.steps_per_beat
+
+    def step_time(self, step):
+        """Due time in microseconds of absolute step number 'step'."""
+        t = self._base_us + ((step - self._base_step) * self._period_num) // self._period_den
+        if self._offsets is not None:
+            t += self._offsets[step % len(self._offsets)]
+        return t
+
+    def tick_time(self, tick, per_step):
+        """Due time in microseconds of 'tick', counting per_step ticks a step
+        from step 0, on the straight grid (no offsets), e.g. MIDI clock out."""
+        return self._base_us + ((tick - self._base_step * per_step) * self._period_num) // (self._period_den * per_step)
+
+    def set_offsets(self, offsets):
+        """Add offsets[step % len(offsets)] microseconds to each step's due time
+        (e.g. Groove.step_offsets), or None for straight time.  The table is
+        used as is, not copied, call again after rebuilding it."""
+        self._offsets = offsets
+        self._next_due = self.step_time(self.step)
+
+    def step_us(self):
+        """Length of one step in microseconds (rounded down)."""
+        return self._period_num // self._period_den
+
+    def start(self, now_us=None, step=0):
+        """Start with step 0 (or 'step') due now (or at now_us)."""
+        self._base_us = self.clock.now_us() if now_us is None else now_us
+        self._base_step = step
+        self.step = step
+        self._ahead_step = -1
+        self._next_due = self.step_time(step)
+
+    def set_bpm(self, bpm):
+        """Change tempo, starting from the next step (which keeps its due time)."""
+        self._base_us = self.step_time(self.step)
+        if self._offsets is not None:  # base is on the straight grid
+            self._base_us -= self._offsets[self.step % len(self._offsets)]
+        self._base_step = self.step
+        self.bpm = bpm
+        self._update_period()
+
+    def follow(self, step, due_us, period_num, period_den):
+        """Re-time steps so absolute step 'step' is due at due_us, and steps
+        are period_num/period_den microseconds apart, e.g. from MIDI clock.
+        Steps already played aren't played again."""
+        self._base_us = due_us
+        self._base_step = step
+        self._period_num = period_num
+        self._period_den = period_den
+        self._next_due = self.step_time(self.step)
+
+    def time_to_next(self, now_us=None):
+        """Microseconds until next step is due (negative if late)."""
+        if now_us is None:
+            now_us = self.clock.now_us()
+        return self._next_due - now_us
+
+    def ahead(self, now_us=None):
+        """Returns the next step's number once, when it comes within lookahead_us
+        of being due, so its triggers can be prepared. Otherwise returns -1."""
+        if self._ahead_step == self.step:
+            return -1
+        if self.time_to_next(now_us) > self.lookahead_us:
+            return -1
+        self._ahead_step = self.step
+        return self.step
+
+    def poll(self, now_us=None):
+        """Returns the step number if a step is due, otherwise -1."""
+        if now_us is None:
+            now_us = self.clock.now_us()
+        late = now_us - self._next_due
+        if late < 0:
+            return -1
+        # more than a whole step late (e.g. blocked by flash write), skip ahead
+        # to the latest step that is due
+        if late >= self.step_us():
+            cur = self._base_step + ((now_us - self._base_us) * self._period_den) // self._period_num
+            while cur > self.step and self.step_time(cur) > now_us:  # swung later than now
+                cur -= 1
+            if cur > self.step:
+                self.missed += cur - self.step
+                self.step = cur
+                self._next_due = self.step_time(cur)
+                late = now_us - self._next_due
+        self.late_us = late
+        step = self.step
+        self.step += 1
+        self._next_due = self.step_time(self.step)
+        return step
+
+    def nearest_step(self, t_us):
+        """Absolute step number whose due time (with offsets) is closest to t_us,
+        for quantizing."""
+        rel = (t_us - self._base_us) * self._period_den
+        step = self._base_step + (rel + self._period_num // 2) // self._period_num
+        if self._offsets is not None:  # swung steps move, so a neighbor may be closer
+            best = abs(self.step_time(step) - t_us)
+            for s in (step - 1, step + 1):
+                d = abs(self.step_time(s) - t_us)
+                if d < best:
+                    step, best = s, d
+        return step
+
+
+class Groove:
+    """Swing & per-pad nudge as microsecond tables for the current tempo:
+    step_offsets for StepScheduler.set_offsets(), and pad_delays, how long
+    after its step fires each pad plays.  Early (negative) nudges are done
+    by firing every step lead_us early and delaying the other pads.
+    The tables are allocated once and rebuilt in place by build()."""
+    def __init__(self, num_steps=32, num_pads=8):
+        self.step_offsets = array('l', [0] * num_steps)
+        self.pad_delays = array('l', [0] * num_pads)
+        self.delayed = 0  # bitmask of pads with a delay
+        self.lead_us = 0
+
+    def build(self, step_us, swing=50, nudge=None):
+        """Rebuild tables for step_us long steps, swing percent (50 = straight) and
+        nudge, percent of a step per pad (see drum_pattstore.Pattern)."""
+        pad_delays = self.pad_delays
+        lead = 0
+        for p in range(len(pad_delays)):
+            pad_delays[p] = nudge[p] * step_us // 100 if nudge else 0
+            lead = max(lead, -pad_delays[p])
+        self.delayed = 0
+        for p in range(len(pad_delays)):
+            pad_delays[p] += lead
+            if pad_delays[p]:
+                self.delayed |= 1 << p
+        # second step of each pair starts swing% of the way through the pair
+        swing_us = (2 * swing - 100) * step_us // 100
+        for s in range(len(self.step_offsets)):
+            self.step_offsets[s] = (swing_us if s & 1 else 0) - lead
+        self.lead_us = lead
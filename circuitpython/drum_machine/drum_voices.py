@@ -0,0 +1,117 @@
+# drum_voices.py --
+# voice allocator for the drum machine: pads share a pool of mixer voices
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Each pad gets per_pad round-robin voices from the Mixer's pool, so a
+# fast roll lets the last few hits ring out instead of each one cutting
+# off the one before: a hit retriggers the pad's oldest voice if it still
+# has it, otherwise takes the least recently played voice in the pool.
+# Pads can be in choke groups (per kit, e.g. closed hi-hat cuts off open
+# hi-hat): playing a pad stops the voices of the other pads in its group.
+#
+# The pool is kept in a list from least to most recently played, as
+# bytearray links, and choked voices go to the front.  So the voice taken
+# is a free one if there is one, otherwise the oldest playing one is
+# stolen, all without searching: play() is a few table lookups.
+#
+# Usage:
+#   voices = VoiceAlloc(mixer.voice, num_pads, per_pad=2)
+#   voices.set_chokes((0, 0, 1, 1, 0, 0, 0, 0))  # group number per pad, 0 = none
+#   v = voices.play(pad)  # choke, pick a voice
+#   mixer.voice[v].play(waves[pad])
+#   voices.stop_all()  # e.g. before changing kits
+#
+
+FREE = 0xff  # voice not playing a pad
+
+class VoiceAlloc:
+    def __init__(self, voices, num_pads, per_pad=2):
+        self.voices = voices  # mixer.voice, at most 255
+        self.num_voices = len(voices)
+        self.num_pads = num_pads
+        self.per_pad = per_pad  # round-robin voices each pad can use
+        self.owner = bytearray(self.num_voices)  # pad each voice is playing, or FREE
+        self.pad_voice = bytearray(num_pads * per_pad)  # each pad's round-robin voices, or FREE
+        self.pad_next = bytearray(num_pads)  # which of them the pad plays next
+        self.chokes = [()] * num_pads  # other pads each pad chokes
+        self.steals = 0  # voices taken from another pad (maybe done playing)
+        self._prev = bytearray(self.num_voices + 1)  # links, end of list is num_voices
+        self._next = bytearray(self.num_voices + 1)
+        self.stop_all()
+
+    def set_chokes(self, groups=None):
+        """Choke group number of each pad, 0 (or no groups) for none."""
+        n = self.num_pads
+        groups = groups or bytes(n)
+        self.chokes = [tuple(q for q in range(n) if q != p and groups[q] == g) if g else ()
+                       for p, g in enumerate(groups[:n])]
+
+    def stop_all(self):
+        """Stop every voice, all free."""
+        end = self.num_voices
+        for v in range(end):
+            self.voices[v].stop()
+            self.owner[v] = FREE
+            self._next[v] = v + 1
+            self._prev[v + 1] = v
+        self._next[end] = 0
+        self._prev[0] = end
+        for k in range(len(self.pad_voice)):
+            self.pad_voice[k] = FREE
+
+    def _unlink(self, v):
+        p = self._prev[v]
+        n = self._next[v]
+        self._next[p] = n
+        self._prev[n] = p
+
+    def play(self, pad):
+        """Number of the mixer voice to play pad on, after choking its group."""
+        for q in self.chokes[pad]:
+            self.release(q)
+        owner = self.owner
+        k = pad * self.per_pad + self.pad_next[pad]
+        self.pad_next[pad] = (self.pad_next[pad] + 1) % self.per_pad
+        v = self.pad_voice[k]
+        if v == FREE or owner[v] != pad:  # not still the pad's, take the least recently played
+            end = self.num_voices
+            v = self._next[end]
+            q = owner[v]
+            if q != FREE:  # steal it, q forgets it
+                self.steals += 1
+                base = q * self.per_pad
+                for j in range(base, base + self.per_pad):
+                    if self.pad_voice[j] == v:
+                        self.pad_voice[j] = FREE
+            owner[v] = pad
+            self.pad_voice[k] = v
+        self._unlink(v)  # now the most recently played
+        end = self.num_voices
+        p = self._prev[end]
+        self._next[p] = v
+        self._prev[v] = p
+        self._next[v] = end
+        self._prev[end] = v
+        return v
+
+    def release(self, pad):
+        """Stop pad's voices, they're the first to be reused."""
+        owner = self.owner
+        base = pad * self.per_pad
+        for j in range(base, base + self.per_pad):
+            v = self.pad_voice[j]
+            if v != FREE and owner[v] == pad:
+                self.voices[v].stop()
+                owner[v] = FREE
+                self._unlink(v)
+                end = self.num_voices
+                n = self._next[end]
+                self._next[end] = v
+                self._prev[v] = end
+                self._next[v] = n
+                self._prev[n] = v
+            self.pad_voice[j] = FREE
+
+    def pad_of(self, voice):
+        """Pad voice was last played for, or FREE."""
+        return self.owner[voice]
@@ -63,6 +63,19 @@ _LEN_0_MESSAGES = set(
 _LEN_1_MESSAGES = set([PROGRAM_CHANGE, CHANNEL_PRESSURE, SONG_SELECT, BUS_SELECT])
 _LEN_2_MESSAGES = set([NOTE_OFF, NOTE_ON, AFTERTOUCH, CC, PITCH_BEND, SONG_POSITION])
 
+# number of data bytes for every status byte, 0xFF = not a status byte,
+# 0xFE = undefined status byte
+# (lookup table so the bulk parser doesn't need set lookups per byte)
+_DATA_LEN = bytearray(b'\xff' * 128 + b'\x00' * 128)
+for _s in range(0x80, 0x100):
+    _t = _s & 0xF0 if _s < 0xF0 else _s
+    if _t in _LEN_2_MESSAGES:
+        _DATA_LEN[_s] = 2
+    elif _t in _LEN_1_MESSAGES or _t == 0xF1:  # 0xF1 = MTC quarter frame
+        _DATA_LEN[_s] = 1
+    elif _t not in _LEN_0_MESSAGES:
+        _DATA_LEN[_s] = 0xFE  # 0xF4, 0xFD
+
 
 def _is_channel_message(status_byte):
     return status_byte >= NOTE_OFF and status_byte <= PITCH_BEND + 0x0F
@@ -82,87 +95,218 @@ class Message:
 
 
 class MidiIn:
-    def __init__(self, port, enable_running_status=False):
+    """MIDI parser on a UART or USB MIDI port.
+
+    Decoding is incremental: partial messages are carried across calls, so
+    messages split across port reads are reassembled. Realtime bytes
+    (clock, start, stop, ...) are delivered as soon as they arrive, even
+    in the middle of another message. Running status is handled when
+    ``enable_running_status`` is True.
+
+    ``receive_all()`` drains the port into a ring buffer and decodes every
+    complete message into the preallocated ``messages`` list, returning how
+    many are valid. Those Messages are reused on the next call, and their
+    ``data`` is always a 2-byte bytearray (unused bytes are zero).
+    ``buffer_size`` must be a power of two.
+
+    SysEx bytes are collected into ``sysex`` (up to ``sysex_size`` bytes,
+    the rest are dropped and counted as errors). A SYSEX Message is
+    delivered when the SysEx ends and is always the last message of that
+    ``receive_all()``, so ``sysex[:sysex_len]`` is valid until the next call.
+
+    Channel messages on channels not set in ``channel_mask`` (bit N =
+    channel N, 0-based) are dropped as they're parsed, and so are note-ons
+    & note-offs whose note is 0xFF in ``note_filter`` (a 128 byte table,
+    e.g. a note to pad map, None = all notes), so they cost no Message.
+    They're counted in ``filtered``. Both can be changed any time.
+
+    ``receive()`` returns one newly allocated Message per call, for
+    compatibility. Don't mix it with ``receive_all()`` on the same MidiIn.
+    """
+    def __init__(self, port, enable_running_status=False, buffer_size=256, max_messages=64,
+                 sysex_size=0, channel_mask=0xFFFF, note_filter=None):
         self._port = port
-        self._read_buf = bytearray(1)
         self._running_status_enabled = enable_running_status
-        self._running_status = None
-        self._outstanding_sysex = False
         self._error_count = 0
+        self.channel_mask = channel_mask
+        self.note_filter = note_filter
+        self.filtered = 0  # messages dropped by channel_mask or note_filter
+        # decoder state, carried across calls
+        self._status = 0  # status of message being assembled (or running status), 0 = none
+        self._need = 0  # data bytes needed by _status
+        self._got = 0  # data bytes received so far
+        self._skip = False  # _status is on a channel not in channel_mask
+        self._data = bytearray(2)  # data bytes received so far
+        self._in_sysex = False
+        self.sysex = bytearray(sysex_size)
+        self.sysex_len = 0
+        # ring buffer of bytes read from port but not yet decoded
+        self._ring = bytearray(buffer_size)
+        self._ring_mv = memoryview(self._ring)
+        self._ring_mask = buffer_size - 1
+        self._ring_head = 0  # index of next unparsed byte
+        self._ring_count = 0  # number of unparsed bytes in ring
+        self._has_in_waiting = hasattr(port, 'in_waiting')  # UARTs have it, usb_midi doesn't
+        self.messages = []
+        for _ in range(max_messages):
+            m = Message()
+            m.data = bytearray(2)
+            self.messages.append(m)
+        # for receive()
+        self._pending_pos = 0
+        self._pending_num = 0
 
     @property
     def error_count(self):
         return self._error_count
 
-    def receive(self):
-        # Before we do anything, check and see if there's an unprocessed
-        # sysex message pending. If so, throw it away. The caller has
-        # to call receive_sysex if they care about the bytes.
-        #if self._outstanding_sysex:
-        #    self.receive_sysex(0)
+    def _fill(self):
+        # read as much as is available into the free part of the ring, in at most two reads
+        size = len(self._ring)
+        for _ in range(2):
+            free = size - self._ring_count
+            if not free:
+                return
+            tail = (self._ring_head + self._ring_count) & self._ring_mask
+            want = min(free, size - tail)  # contiguous free space after tail
+            if self._has_in_waiting:
+                want = min(want, self._port.in_waiting)
+                if not want:
+                    return
+            n = self._port.readinto(self._ring_mv[tail:tail+want])
+            if not n:
+                return
+            self._ring_count += n
+            if n < want:
+                return
 
-        # Read the status byte for the next message, and perhaps whole message
-        #result = self._port.readinto(self._read_buf, 1)
-        result = self._port.readinto(self._read_buf)
+    def receive_all(self):
+        """Read everything available and decode all complete messages.
+        Returns number of valid Messages at the start of ``self.messages``."""
+        self._fill()
+        if not self._ring_count:  # nothing came in, the usual case
+            return 0
+        ring = self._ring
+        mask = self._ring_mask
+        head = self._ring_head
+        count = self._ring_count
+        msgs = self.messages
+        max_msgs = len(msgs)
+        status = self._status
+        need = self._need
+        got = self._got
+        skip = self._skip
+        d = self._data
+        chan_mask = self.channel_mask
+        note_filter = self.note_filter
+        n = 0
+        while count and n < max_msgs:
+            b = ring[head]
+            head = (head + 1) & mask
+            count -= 1
 
-        # No message ready.
-        if not result:
-            return None
+            if b >= 0xF8:  # realtime, can show up anywhere, doesn't disturb other messages
+                if _DATA_LEN[b] == 0xFE:
+                    continue  # undefined realtime byte
+                msg = msgs[n]
+                msg.type = b
+                msg.channel = None
+                msg.data[0] = msg.data[1] = 0
+                n += 1
+                continue
 
-        print("smol result:",result)
-        message = Message()
-        data_bytes = bytearray(2)
-
-        # Is this a status byte?
-        status_byte = self._read_buf[0]
-        is_status = status_byte & 0x80
-
-        # If not, see if we have a running status byte.
-        if not is_status:
-            if self._running_status_enabled and self._running_status:
-                #data_bytes = [status_byte]
-                status_byte = self._running_status
-            # If not a status byte and no running status, this is
-            # invalid data.
-            else:
-                self._error_count += 1
-                return None
+            if b & 0x80:  # status byte
+                if self._in_sysex:
+                    self._in_sysex = False
+                    msg = msgs[n]
+                    msg.type = SYSEX
+                    msg.channel = None
+                    msg.data[0] = msg.data[1] = 0
+                    n += 1
+                    if b != SYSEX_END:  # sysex ended by a new status, decode it next time
+                        head = (head - 1) & mask
+                        count += 1
+                    status = 0
+                    break  # so sysex[] stays valid for the caller
+                if got:  # new status before last message was complete
+                    self._error_count += 1
+                got = 0
+                if b == SYSEX:
+                    self._in_sysex = True
+                    self.sysex_len = 0
+                    status = 0
+                    continue
+                need = _DATA_LEN[b]
+                if need == 0xFE or b == SYSEX_END:  # undefined or stray end-of-sysex
+                    status = 0
+                    continue
+                status = b  # system common messages also cancel running status
+                skip = b < 0xF0 and not (chan_mask >> (b & 0x0F)) & 1
+                if need == 0:  # e.g. tune request
+                    msg = msgs[n]
+                    msg.type = b
+                    msg.channel = None
+                    msg.data[0] = msg.data[1] = 0
+                    n += 1
+                    status = 0
+                continue
 
-        # Is this a channel message, if so, let's figure out the right
-        # message type and set the message's channel property.
-        if _is_channel_message(status_byte):
-            # Only set the running status byte for channel messages.
-            self._running_status = status_byte
-            # Mask off the channel nibble.
-            message.type = status_byte & 0xF0
-            message.channel = status_byte & 0x0F
-        else:
-            message.type = status_byte
-
-        # Read the appropriate number of bytes for each message type.
-        if message.type in _LEN_2_MESSAGES:
-            #_read_n_bytes(self._port, self._read_buf, data_bytes, 2 - len(data_bytes))
-            data_bytes = bytearray(2)
-            self._port.readinto(data_bytes)
-            message.data = data_bytes
-        elif message.type in _LEN_1_MESSAGES:
-            #_read_n_bytes(self._port, self._read_buf, data_bytes, 1 - len(data_bytes))
-            data_bytes = bytearray(1)
-            self._port.readinto(data_bytes)
-            message.data = data_bytes
-
-        # If this is a sysex message, set the pending sysex flag so we
-        # can throw the message away if the user doesn't process it.
-        if message.type == SYSEX:
-            self._outstanding_sysex = True
-
-        # Check the data bytes for corruption. If the data bytes have any status bytes
-        # embedded, it probably means the buffer overflowed. Either way, discard the
-        # message.
-        # TODO: Figure out a better way to detect and deal with this upstream.
-        for b in data_bytes:
-            if b & 0x80:
+            # data byte
+            if self._in_sysex:
+                if self.sysex_len < len(self.sysex):
+                    self.sysex[self.sysex_len] = b
+                    self.sysex_len += 1
+                else:
+                    self._error_count += 1
+                continue
+            if not status:  # data byte with nothing to attach it to
                 self._error_count += 1
-                return None
+                continue
+            d[got] = b
+            got += 1
+            if got < need:
+                continue
+            if skip or (note_filter is not None and status & 0xE0 == 0x80 and note_filter[d[0]] == 0xFF):
+                self.filtered += 1  # note-off or note-on not wanted
+                got = 0
+                if not self._running_status_enabled:
+                    status = 0
+                continue
+            msg = msgs[n]
+            if status < 0xF0:  # channel message
+                msg.type = status & 0xF0
+                msg.channel = status & 0x0F
+            else:
+                msg.type = status
+                msg.channel = None
+            msg.data[0] = d[0]
+            msg.data[1] = d[1] if need > 1 else 0
+            n += 1
+            got = 0
+            if status >= 0xF0 or not self._running_status_enabled:
+                status = 0
 
+        self._ring_head = head
+        self._ring_count = count
+        self._status = status
+        self._need = need
+        self._got = got
+        self._skip = skip
+        return n
+
+    def receive(self):
+        """Return next Message (newly allocated), or None if none are ready."""
+        if self._pending_pos >= self._pending_num:
+            self._pending_num = self.receive_all()
+            self._pending_pos = 0
+            if not self._pending_num:
+                return None
+        m = self.messages[self._pending_pos]
+        self._pending_pos += 1
+        message = Message()
+        message.type = m.type
+        message.channel = m.channel
+        dlen = _DATA_LEN[m.type | (m.channel or 0)]
+        if 0 < dlen < 3:
+            message.data = bytearray(m.data[0:dlen])
         return message
@@ -0,0 +1,42 @@
+# audio_shim.py -- host stand-ins for CircuitPython's audiocore
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Just enough of audiocore.RawSample and audiocore.WaveFile to exercise
+# drum machine code on a computer. Pass this module where code takes an
+# "audio_lib", e.g. KitCache(..., audio_lib=audio_shim).
+#
+
+import array
+
+class RawSample:
+    def __init__(self, buffer, *, channel_count=1, sample_rate=8000, single_buffer=True):
+        self.buffer = buffer
+        self.channel_count = channel_count
+        self.sample_rate = sample_rate
+        self.deinited = False
+
+    def deinit(self):
+        self.deinited = True
+
+
+class WaveFile:
+    """Reads the whole WAV into .samples up front, but keeps the file open like the real one."""
+    def __init__(self, file, buffer=None):
+        import wave
+        self.file = file
+        self.deinited = False
+        pos = file.tell()
+        with wave.open(file, 'rb') as w:
+            self.sample_rate = w.getframerate()
+            self.channel_count = w.getnchannels()
+            self.bits_per_sample = w.getsampwidth() * 8
+            frames = w.readframes(w.getnframes())
+        file.seek(pos)
+        if self.bits_per_sample == 16:
+            self.samples = array.array('h')
+            self.samples.frombytes(frames)
+        else:  # 8-bit WAVs are unsigned
+            self.samples = array.array('h', ((b - 128) << 8 for b in frames))
+
+    def deinit(self):
+        self.deinited = True
@@ -0,0 +1,234 @@
+# bench_async.py -- step jitter of asyncio task architectures, and code.py vs code_async.py
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# First a model, on a virtual clock, of a cooperative scheduler like
+# CircuitPython's asyncio running the drum machine's tasks two ways:
+#  - "spin": the old code_async.py, the sequencer & controls tasks loop on
+#    sleep(0) and the sequencer fires when ticks_ms() says a step is past,
+#    so it has to wait its turn behind every other runnable task
+#  - "deadline": the sequencer sleeps until just before its next step and
+#    spins out the rest, UI tasks sleep between bounded bits of work and
+#    skip work that would run into a step
+# with the same task costs, and 0, 2 and 4 extra busy UI tasks, and
+# reports the error of the time between steps (the old scheduler drifts
+# too, see bench_sched.py, this is just jitter) and how much of the time
+# the CPU was idle.
+#
+# Then runs code.py (main loop) and code_async.py (deadline tasks) on the
+# emu/ host emulator, on their own tempo and following a 300 BPM MIDI
+# clock, and compares step jitter and MIDI note-on to sound time.
+#
+# Exits non-zero if the deadline scheduler isn't steadier than spinning,
+# or code_async.py is late or misses steps.
+#
+# Usage:
+#   python3 bench_async.py [seconds]
+#
+
+import os, sys, heapq, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_sched import StepScheduler, VirtualClock
+
+import emu
+from check_emu import watch_pads, pad_plays
+from check_midi_clock import stats
+
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine')
+bpm = 120
+steps_per_beat = 4
+switch_us = 150  # asyncio running a task once, as emu.COSTS_US['asyncio.switch']
+wake_early_us = 1500  # as code_async.py
+ui_guard_us = 3000
+display_guard_us = 10000
+late_us = 2000  # a step later than this is "late", as check_emu.py
+
+
+class TaskModel:
+    """Tasks are generators that charge their work to the clock and yield
+    how many ms to sleep, run in order of wake time on whole ms like
+    CircuitPython's asyncio."""
+    def __init__(self, seed):
+        self.clock = VirtualClock()
+        self.rand = random.Random(seed)
+        self.queue = []
+        self.seq = 0
+        self.idle_us = 0
+
+    def work(self, us):
+        """Advance the clock by about us, +-25%."""
+        self.clock.advance(self.rand.randint(us * 3 // 4, us * 5 // 4))
+
+    def add(self, task):
+        self.push(task, 0)
+
+    def push(self, task, ms):
+        now = self.clock.now_us()
+        wake = (now // 1000 + ms) * 1000 if ms else now
+        heapq.heappush(self.queue, (wake, self.seq, task))
+        self.seq += 1
+
+    def run(self, until_us):
+        clock = self.clock
+        while clock.now_us() < until_us:
+            wake, _, task = heapq.heappop(self.queue)
+            if wake > clock.now_us():
+                self.idle_us += wake - clock.now_us()
+                clock.t = wake
+            clock.advance(switch_us)
+            self.push(task, next(task))
+
+
+def ui_task(m, period_ms, cost_us, sched=None, guard_us=0):
+    """Does cost_us of work every period_ms (0 = spin on sleep(0)),
+    but only when the next step is at least guard_us away, if given a sched."""
+    while True:
+        if sched is None or sched.time_to_next() >= guard_us:
+            m.work(cost_us)
+        yield period_ms
+
+
+def spin_sequencer(m, fired):
+    # the old code_async.py run_sequencer(): millisecond ticks, makes up half the lateness
+    step_millis = 60000 // (bpm * steps_per_beat)
+    last_step_millis = m.clock.now_us() // 1000
+    while True:
+        m.work(60)
+        now = m.clock.now_us() // 1000
+        diff = now - last_step_millis
+        if diff > step_millis:
+            late_millis = diff - step_millis
+            last_step_millis = now - late_millis // 2
+            fired.append(m.clock.now_us())
+            m.work(300)  # play the step's pads
+        yield 0
+
+
+def deadline_sequencer(m, sched, fired):
+    # code_async.py run_sequencer()
+    while True:
+        wait_us = sched.time_to_next() - wake_early_us
+        if wait_us >= 1000:
+            yield wait_us // 1000
+            continue
+        while sched.time_to_next() > 0:
+            m.work(20)
+        if sched.poll() >= 0:
+            fired.append(m.clock.now_us())
+            m.work(300)
+        yield 0
+
+
+def run_model(deadline, extra_tasks, seconds, seed=1):
+    """Returns (step interval errors in us, idle fraction)."""
+    m = TaskModel(seed)
+    sched = StepScheduler(m.clock, bpm=bpm, steps_per_beat=steps_per_beat)
+    sched.start(10000)
+    fired = []
+    if deadline:
+        m.add(deadline_sequencer(m, sched, fired))
+        m.add(ui_task(m, 1, 80))  # midi_reader()
+        m.add(ui_task(m, 5, 150, sched, ui_guard_us))  # controls()
+        m.add(ui_task(m, 10, 1000, sched, ui_guard_us))  # update_leds()
+        m.add(ui_task(m, 50, 6000, sched, display_guard_us))  # update_display()
+        for _ in range(extra_tasks):
+            m.add(ui_task(m, 5, 300, sched, ui_guard_us))
+    else:
+        m.add(spin_sequencer(m, fired))
+        m.add(ui_task(m, 0, 150))  # monitor_controls(), MIDI read in there
+        m.add(ui_task(m, 10, 1000))  # update_leds()
+        m.add(ui_task(m, 50, 6000))  # display
+        for _ in range(extra_tasks):
+            m.add(ui_task(m, 0, 300))
+    m.run(seconds * 1000000)
+    step_us = sched.step_us()
+    errs = [fired[i] - fired[i - 1] - step_us for i in range(1, len(fired))]
+    return errs, m.idle_us / m.clock.now_us()
+
+
+def bench_model(seconds):
+    failed = 0
+    print("task model, %d bpm: step interval error, us" % bpm)
+    print("%-9s %5s %7s %7s %7s %7s %7s %6s" % (
+        "sched", "extra", "mean", "jitter", "min", "max", "p99", "idle"))
+    for extra in (0, 2, 4):
+        jitter = {}
+        for deadline in (False, True):
+            errs, idle = run_model(deadline, extra, seconds)
+            mean, sd, lo, hi, p99 = stats(errs)
+            jitter[deadline] = sd
+            print("%-9s %5d %7d %7d %7d %7d %7d %5d%%" % (
+                "deadline" if deadline else "spin", extra, mean, sd, lo, hi, p99, idle * 100))
+        if jitter[True] * 2 >= jitter[False]:
+            print("FAIL: deadline scheduler not much steadier with %d extra tasks" % extra)
+            failed += 1
+    return failed
+
+
+def emu_run(main, seconds, clock_bpm=0):
+    """Run an app on the emulator, PLAY pressed (or a MIDI clock started) at 0.5 s,
+    a MIDI note-on between steps.  Returns (sim, step times, note-on to sound us)."""
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    if clock_bpm:
+        tick_us = 60000000 / (clock_bpm * 24)
+        sim.midi(499, b'\xfa')  # START
+        t = 500000
+        while t < seconds * 1000000:
+            sim.midi(t / 1000, b'\xf8')
+            t += tick_us
+    else:
+        sim.tap(500, 2)  # PLAY
+    note_ms = 3333
+    sim.midi(note_ms, b'\x90\x2d\x7f')  # note 45 (GM low tom) -> pad 5
+    watch_pads(sim)
+    emu.run(app_dir, sim, main=main)
+    if sim.error:
+        return sim, [], 0
+    note_end_us = note_ms * 1000 + 3 * 320
+    note_us = min((t for t, pad in pad_plays(sim) if pad == 5 and t >= note_end_us),
+                  default=note_end_us) - note_end_us
+    plays = sorted(set(t for t, pad in pad_plays(sim)
+                       if not (pad == 5 and note_end_us <= t < note_end_us + 5000)))
+    return sim, plays, note_us
+
+
+def bench_emu(seconds):
+    failed = 0
+    print("emu, step error from ideal grid (first beat left out), us")
+    print("%-14s %-9s %5s %7s %7s %7s %7s %6s %6s" % (
+        "app", "tempo", "hits", "jitter", "min", "max", "spread", "missed", "note"))
+    for clock_bpm in (0, 300):
+        for main in ('code.py', 'code_async.py'):
+            sim, plays, note_us = emu_run(main, seconds, clock_bpm)
+            if sim.error:
+                print("FAIL: %s raised an error" % main)
+                failed += 1
+                continue
+            sched = sim.globals['sched']
+            step_us = 60000000 // ((clock_bpm or bpm) * steps_per_beat)
+            first = plays[0]
+            # a hit's error from the grid of the first hit, after a beat (to lock to a clock)
+            errs = [(t - first + step_us // 2) % step_us - step_us // 2
+                    for t in plays if t - first >= steps_per_beat * step_us]
+            mean, sd, lo, hi, p99 = stats(errs)
+            print("%-14s %-9s %5d %7d %7d %7d %7d %6d %6d" % (
+                main, "clock %d" % clock_bpm if clock_bpm else "own %d" % bpm,
+                len(errs), sd, lo - mean, hi - mean, hi - lo, sched.missed, note_us))
+            if main == 'code_async.py' and (hi - lo > late_us or sched.missed):
+                print("FAIL: code_async.py steps late or missed")
+                failed += 1
+    return failed
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    failed = bench_model(int(seconds * 5))
+    print()
+    failed += bench_emu(seconds)
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+# bench_bank.py -- host-side benchmark of pattern saving & loading
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Compares the old JSON pattern file against the drum_bank binary pattern
+# bank: full save, load of everything, lazy load of one pattern, and
+# saving after editing a single pattern. Also checks the bank round-trips,
+# corrupt records are detected, a record torn while being saved in place
+# is restored from its shadow copy (and a shadow never outlives its save),
+# and a pattern's only marked saved once its record is.
+#
+# Usage:
+#   python3 bench_bank.py [num_patterns]
+#
+
+import os, sys, json, time, random, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_pattstore import Pattern
+from drum_bank import PatternBank
+
+
+def make_patterns(num, seed=1):
+    rand = random.Random(seed)
+    return [Pattern("patt%d" % i, hits=bytes(rand.randrange(256) for _ in range(32)),
+                    vels=bytes(rand.randrange(1, 256) for _ in range(32)),
+                    swing=rand.randrange(50, 76), nudge=[rand.randrange(-50, 51) for _ in range(8)])
+            for i in range(num)]
+
+
+# as code.py used to do it
+def json_save(path, patterns):
+    with open(path, 'w') as fp:
+        json.dump([{'name': p.name, 'seq': p.to_strs()} for p in patterns], fp)
+
+def json_load(path):
+    with open(path) as fp:
+        return [Pattern.from_strs(p['name'], p['seq']) for p in json.load(fp)]
+
+
+def timeit(func, reps=5):
+    best = None
+    for _ in range(reps):
+        t = time.perf_counter()
+        ret = func()
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best * 1000, ret
+
+
+def main():
+    num = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    patterns = make_patterns(num)
+    tmpdir = tempfile.mkdtemp()
+    json_path = os.path.join(tmpdir, "saved_patterns.json")
+    bank_path = os.path.join(tmpdir, "saved_patterns.bin")
+
+    print("%d patterns" % num)
+    t, _ = timeit(lambda: json_save(json_path, patterns))
+    print("json  save all:    %8.2f ms  %7d bytes" % (t, os.path.getsize(json_path)))
+    t, _ = timeit(lambda: json_load(json_path))
+    print("json  load all:    %8.2f ms" % t)
+    t, _ = timeit(lambda: json_load(json_path)[num // 2])
+    print("json  load one:    %8.2f ms" % t)
+
+    bank = PatternBank(bank_path)
+    t, _ = timeit(lambda: bank.save_all(patterns))
+    print("bank  save all:    %8.2f ms  %7d bytes" % (t, os.path.getsize(bank_path)))
+    bank = PatternBank(bank_path)
+    t, loaded = timeit(lambda: bank.open() and bank.load_all())
+    print("bank  load all:    %8.2f ms" % t)
+    t, one = timeit(lambda: bank.open() and bank.load(num // 2))
+    print("bank  load one:    %8.2f ms" % t)
+
+    def edit_and_save():
+        loaded[num // 2].set(3, 5, not loaded[num // 2].get(3, 5))
+        return bank.save(loaded)
+    t, written = timeit(edit_and_save)
+    print("bank  save 1 edit: %8.2f ms  (%d record written)" % (t, written))
+
+    # round-trip checks
+    ok = True
+    bank2 = PatternBank(bank_path)
+    bank2.open()
+    for a, b in zip(loaded, bank2.load_all()):
+        if (a.name != b.name or a.hits != b.hits or a.vels != b.vels
+                or a.swing != b.swing or a.nudge != b.nudge):
+            print("MISMATCH", a, b)
+            ok = False
+    edited = loaded[num // 2]
+    edited.set(4, 6, not edited.get(4, 6))
+    job = bank.save_steps(loaded)
+    next(job)  # shadow copy written, then power lost halfway through writing the record
+    with open(bank_path, 'r+b') as fp:
+        fp.seek(bank._offsets[num // 2])
+        fp.write(bank._rec[:bank.record_size // 2])
+        fp.write(bytes(bank.record_size // 2))
+    job.close()
+    if not edited.dirty:
+        print("pattern marked saved before its record was written")
+        ok = False
+    bank2.open()
+    b = bank2.load(num // 2)
+    if b is None or b.hits != edited.hits or b.vels != edited.vels or b.nudge != edited.nudge:
+        print("torn record not restored from its shadow copy")
+        ok = False
+    job = bank.save_steps(loaded)
+    next(job)
+    edited.set(4, 7, not edited.get(4, 7))  # edited while its record's being saved
+    for _ in job:
+        pass
+    if not edited.dirty:
+        print("pattern edited during save marked saved")
+        ok = False
+    bank.save(loaded)
+    if edited.dirty or os.path.exists(bank.shadow_path):
+        print("shadow copy left after save")
+        ok = False
+    edited.set(4, 8, not edited.get(4, 8))
+    job = bank.save_steps(loaded)
+    next(job)  # shadow of a slot in this bank, save abandoned
+    job.close()
+    job = bank.save_steps(loaded, rewrite=True)
+    next(job)  # a new bank's first record written, power lost any time from here on
+    if os.path.exists(bank.shadow_path):
+        print("old bank's shadow copy left to be restored into the new bank")
+        ok = False
+    for _ in job:
+        pass
+    with open(bank_path, 'r+b') as fp:  # corrupt a record
+        fp.seek(bank2._offsets[1] + 24)
+        byte = fp.read(1)[0]
+        fp.seek(bank2._offsets[1] + 24)
+        fp.write(bytes([byte ^ 0x55]))  # Fletcher-16 can't tell 0x00 from 0xff
+    if bank2.load(1) is not None:
+        print("corrupt record not detected")
+        ok = False
+    os.rename(bank_path, bank_path + ".tmp")  # as if power lost mid-save
+    if PatternBank(bank_path).open() != num:
+        print("interrupted save not recovered")
+        ok = False
+    print("round-trip checks:", "ok" if ok else "FAILED")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
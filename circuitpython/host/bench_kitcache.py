@@ -0,0 +1,140 @@
+# bench_kitcache.py -- host-side benchmark & checks of drum_kitcache
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Scrolls back and forth through the drum kits in ../drum_machine/drumkits
+# the way turning the encoder in kit mode does, comparing the old "open 8
+# WaveFiles every time" loading with KitCache (with prefetch between
+# turns). Also checks that every file KitCache opens is closed again, and
+# that a sample whose buffer the heap can't give (every other one, here) is
+# streamed instead.
+#
+# Usage:
+#   python3 bench_kitcache.py [budget_kbytes]
+#
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+import drum_kitcache
+from drum_kitcache import KitCache
+import audio_shim
+
+num_pads = 8
+kit_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine', 'drumkits')
+
+open_files = set()
+
+def tracking_open(path, mode='r'):
+    fp = open(path, mode)
+    open_files.add(fp)
+    return fp
+
+drum_kitcache.open = tracking_open  # module global shadows builtin open()
+
+
+def find_kits():
+    # as find_kits() in code.py
+    kits = {}
+    for kname in sorted(os.listdir(kit_root)):
+        if not kname.lower().startswith("kit"):
+            continue
+        kits[kname] = [os.path.join(kit_root, kname, s) for s in sorted(os.listdir(os.path.join(kit_root, kname)))
+                       if s.lower().endswith(".wav") and not s.startswith(".")]
+    kits['kit_names'] = sorted(kits.keys())
+    return kits
+
+
+def scroll_sequence(num_kits, turns=30):
+    # mostly forward, sometimes back, like a person looking for a kit
+    idx, seq = 0, []
+    for t in range(turns):
+        d = -1 if t % 5 == 4 else 1
+        idx = (idx + d) % num_kits
+        seq.append((idx, d))
+    return seq
+
+
+def run_old(kits, seq):
+    times = []
+    waves = [None] * num_pads
+    for idx, _ in seq:
+        t = time.perf_counter()
+        name = kits['kit_names'][idx]
+        for i in range(num_pads):
+            waves[i] = audio_shim.WaveFile(tracking_open(kits[name][i], "rb"))  # never closed
+        times.append(time.perf_counter() - t)
+    return times
+
+
+def run_cache(kits, seq, budget):
+    cache = KitCache(kits, num_pads, budget=budget, audio_lib=audio_shim)
+    names = kits['kit_names']
+    times = []
+    for idx, d in seq:
+        t = time.perf_counter()
+        cache.get(names[idx])
+        cache.prefetch(names[(idx + d) % len(names)])
+        times.append(time.perf_counter() - t)
+        while cache.work():  # main loop does this between steps
+            pass
+        assert cache.nbytes <= cache.budget, "over budget"
+    return times, cache
+
+
+def main():
+    budget = int(sys.argv[1]) * 1024 if len(sys.argv) > 1 else 96 * 1024
+    kits = find_kits()
+    seq = scroll_sequence(len(kits['kit_names']))
+    print("%d kits, %d encoder turns, budget %d kB" % (len(kits['kit_names']), len(seq), budget // 1024))
+
+    open_files.clear()
+    times = run_old(kits, seq)
+    leaked = sum(1 for f in open_files if not f.closed)
+    print("old:      mean %6.2f ms  max %6.2f ms per turn, %d files left open" %
+          (sum(times) / len(times) * 1000, max(times) * 1000, leaked))
+    for f in open_files:
+        f.close()
+
+    open_files.clear()
+    times, cache = run_cache(kits, seq, budget)
+    in_use = sum(1 for f in open_files if not f.closed)
+    print("KitCache: mean %6.2f ms  max %6.2f ms per turn, %d hits %d misses, %d kB cached, %d files open" %
+          (sum(times) / len(times) * 1000, max(times) * 1000, cache.hits, cache.misses,
+           cache.nbytes // 1024, in_use))
+    cache.deinit()
+    leaked = sum(1 for f in open_files if not f.closed)
+    print("after deinit: %d files left open" % leaked)
+    failed = leaked
+
+    # heap too fragmented for every other sample's buffer
+    alloc_samples = drum_kitcache._alloc_samples
+    allocs = [0]
+    def failing_alloc(num):
+        allocs[0] += 1
+        if allocs[0] % 2:
+            raise MemoryError("memory allocation failed")
+        return alloc_samples(num)
+    drum_kitcache._alloc_samples = failing_alloc
+    drum_kitcache.print = lambda *args: None  # not "no RAM for it" for each
+    open_files.clear()
+    try:
+        times, cache = run_cache(kits, seq, budget)
+        waves = cache.get(kits['kit_names'][0])
+    finally:
+        drum_kitcache._alloc_samples = alloc_samples
+        del drum_kitcache.print
+    streamed = sum(1 for w in waves if isinstance(w, audio_shim.WaveFile))
+    missing = waves.count(None)
+    nbytes = cache.nbytes
+    cache.deinit()
+    leaked = sum(1 for f in open_files if not f.closed)
+    print("no RAM for every other sample: %d of %d pads streamed, %d kB cached, %d files left open" %
+          (streamed, num_pads, nbytes // 1024, leaked))
+    if leaked or not streamed or missing:
+        print("FAIL: samples that couldn't be allocated weren't streamed, or files left open")
+        failed += 1
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+# bench_latency.py -- pad-to-sound latency & audio underruns for each mixer buffer size
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs the drum machine (../drum_machine/code.py) on the emu/ host emulator
+# with a few loop profiles: just playing, the step grid view (more display
+# refreshes), switching kits (sample loads), saving patterns, and saving on
+# slow flash.  Each run records the app's stalls (times the emulated
+# background tasks, so audio mixing, couldn't run) once it's playing
+# (startup's don't matter, it's silent) and when pad presses got played.
+# Then a model of audiomixer's double buffering, the same as the emu's
+# audiomixer, estimates for each of drum_latency.BUFFER_SIZES how many
+# underruns those stalls would cause, and pad press to sound times (a
+# voice.play() is heard from the start of the buffer after the one
+# playing).
+#
+# The runs use the smallest buffer, and the model is checked against the
+# emulated mixer's own underruns.  Exits non-zero if they disagree, if
+# drum_latency.AudioLatency in the app missed an underrun, or if the
+# buffer size it picks would still underrun.
+#
+# Usage:
+#   python3 bench_latency.py [seconds]
+#
+
+import os, sys, random, shutil, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_latency import BUFFER_SIZES
+
+import emu
+from check_emu import watch_pads, pad_plays
+from check_midi_clock import stats
+
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine')
+run_size = BUFFER_SIZES[0]  # buffer the app runs with, so there's something to underrun
+pad_keys = (1, 4, 7)  # keys of pads 4, 5, 6, nothing in the demo pattern on them
+stall_min_us = 1000  # shorter gaps in background tasks aren't kept
+play_ms = 500  # PLAY pressed, the app's startup is long done
+
+
+def enc_hold_tap(sim, t_ms, key):
+    """Hold the encoder switch & tap key, e.g. MUTE for the grid view, RECORD to save."""
+    sim.encoder_switch(t_ms, True)
+    sim.tap(t_ms + 600, key)
+    sim.encoder_switch(t_ms + 700, False)
+
+
+def script(sim, profile, seconds, seed=1):
+    """Input for a loop profile. Returns pad press times, ms."""
+    rand = random.Random(seed)
+    sim.tap(play_ms, 2)  # PLAY
+    if profile == 'grid':
+        enc_hold_tap(sim, 600, 8)  # MUTE
+    elif profile == 'kits':
+        sim.encoder_switch(600, True)  # encoder to kit mode
+        sim.encoder_switch(650, False)
+        for t in range(1500, int(seconds * 1000) - 1000, 700):
+            sim.turn(t, 1)
+    elif profile in ('save', 'slowflash'):
+        sim.tap(600, 5)  # RECORD, so pad presses change the pattern
+        for t in range(2000, int(seconds * 1000) - 1500, 1500):
+            enc_hold_tap(sim, t, 5)
+    presses = []
+    t = 1000
+    while t < seconds * 1000 - 700:
+        sim.tap(t, rand.choice(pad_keys), 30)
+        presses.append(t)
+        t += rand.randint(150, 400)
+    sim.tap(int(seconds * 1000) - 300, 2)  # STOP, the app tunes its buffer size
+    return presses
+
+
+def run(profile, seconds):
+    """Returns (sim, presses in ms, stalls as (start us, length us))."""
+    costs = {'file.flush': 20000} if profile == 'slowflash' else None  # a slow flash erase
+    sim = emu.Sim(seconds=seconds, costs=costs, quiet=True)
+    presses = script(sim, profile, seconds)
+    stalls = []
+    last = [0]
+    def watch(now_us):  # runs whenever background tasks could, as the mixer's does
+        if now_us - last[0] >= stall_min_us and last[0] >= play_ms * 1000:
+            stalls.append((last[0], now_us - last[0]))
+        last[0] = now_us
+    sim.background.append(watch)
+    tmpdir = tempfile.mkdtemp(prefix='emu_')
+    root = os.path.join(tmpdir, 'CIRCUITPY')
+    try:
+        shutil.copytree(app_dir, root, ignore=shutil.ignore_patterns('__pycache__', '*.pyc'))
+        with open(os.path.join(root, 'audio_buffer.txt'), 'w') as fp:
+            fp.write(str(run_size))
+        watch_pads(sim)
+        emu.run(app_dir, sim, root=root)
+    finally:
+        shutil.rmtree(tmpdir)
+    return sim, presses, stalls
+
+
+def model(t0_us, buffer_us, stalls, plays):
+    """Underruns, and when each play time is heard, with buffers of buffer_us
+    starting at t0_us: outside stalls, buffer k+1 is mixed as buffer k starts."""
+    underruns = 0
+    for start, us in stalls:
+        mixed = (start - t0_us) // buffer_us + 1  # last buffer mixed before the stall
+        if (start + us - t0_us) // buffer_us > mixed:
+            underruns += 1
+    heard = [t0_us + ((t - t0_us) // buffer_us + 2) * buffer_us for t in plays]
+    return underruns, heard
+
+
+def press_plays(sim, presses):
+    """(press us, voice play us) of each pad press."""
+    evs = pad_plays(sim)
+    out = []
+    for p in presses:
+        t_us = p * 1000
+        play = next((t for t, v in evs if t >= t_us and v in (4, 5, 6)), None)
+        if play is not None:
+            out.append((t_us, play))
+    return out
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    failed = 0
+    print("%-9s %6s %6s %8s %7s %7s %7s" % ("profile", "buffer", "ms", "underrun", "mean", "p99", "max"))
+    for profile in ('play', 'grid', 'kits', 'save', 'slowflash'):
+        sim, presses, stalls = run(profile, seconds)
+        if sim.error:
+            print("FAIL: drum machine raised an error")
+            sys.exit(1)
+        mixer = sim.mixer
+        mixer_underruns = [t for t, _ in mixer.underruns if t >= play_ms * 1000]
+        latency = sim.globals['latency']
+        plays = press_plays(sim, presses)
+        for size in BUFFER_SIZES:
+            buffer_us = latency.buffer_us(size)
+            underruns, heard = model(mixer._t0, buffer_us, stalls, [t for _, t in plays])
+            mean, _, _, hi, p99 = stats([h - p for (p, _), h in zip(plays, heard)])
+            print("%-9s %6d %6.1f %8d %7.1f %7.1f %7.1f%s" % (
+                profile, size, buffer_us / 1000, underruns, mean / 1000, p99 / 1000, hi / 1000,
+                "  <- best" if size == latency.best_size() else ""))
+            if size == run_size:
+                real = [mixer.heard_us(t) for _, t in plays]
+                if underruns != len(mixer_underruns) or heard != real:
+                    print("FAIL: model says %d underruns, emu mixer had %d%s" % (
+                        underruns, len(mixer_underruns), "" if heard == real else ", and heard times differ"))
+                    failed += 1
+            if size == latency.best_size() and underruns:
+                print("FAIL: AudioLatency's best size underruns")
+                failed += 1
+        input_mean, _, _, input_max, _ = stats([t - p for p, t in plays])
+        print("%-9s %d stalls over %d us, longest %d us; press to play() mean %d max %d us;"
+              " app counted %d stalls, %d underruns" % (
+                  profile, len(stalls), stall_min_us, max(us for _, us in stalls), input_mean, input_max,
+                  latency.stalls, latency.underruns))
+        if latency.underruns < len(mixer_underruns):
+            print("FAIL: AudioLatency missed underruns")
+            failed += 1
+        print()
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+# bench_leds.py -- host-side benchmark of drum machine LED rendering
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs a stripped-down drum machine main loop for a few seconds with the
+# original list-comprehension LED code and with drum_leds.DrumLeds, and
+# reports main loop iterations per second and time spent in LED code.  NeoPixel show() is modeled as
+# a busy-wait of the time it takes to clock out 12 pixels (~360 us).
+#
+# Usage:
+#   python3 bench_leds.py [seconds]
+#
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_leds import DrumLeds
+
+num_pads = 8
+keynum_to_padnum = (0, 4, -1, 1, 5, -1, 2, 6, -1, 3, 7, -1)
+key_PLAY, key_RECORD, key_MUTE, key_TAP_TEMPO = 2, 5, 8, 11
+show_us = 12 * 24 * 1.25  # 800 kHz NeoPixel data
+
+
+class FakeNeoPixel:
+    """Enough of adafruit_pixelbuf.PixelBuf for the drum machine"""
+    def __init__(self, n):
+        self.buf = bytearray(n * 3)
+        self.show_count = 0
+
+    def __len__(self):
+        return len(self.buf) // 3
+
+    def _set(self, i, v):
+        if isinstance(v, int):
+            v = ((v >> 16) & 0xff, (v >> 8) & 0xff, v & 0xff)
+        self.buf[i*3:i*3+3] = bytes(int(c) for c in v)
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            for j, vv in zip(range(*i.indices(len(self))), v):
+                self._set(j, vv)
+        else:
+            self._set(i, v)
+
+    def __getitem__(self, i):
+        return tuple(self.buf[i*3:i*3+3])
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def show(self):
+        self.show_count += 1
+        end = time.perf_counter() + show_us / 1e6
+        while time.perf_counter() < end:
+            pass
+
+
+def colorwheel(pos):
+    pos = pos & 0xff
+    if pos < 85:
+        return ((255 - pos * 3) << 16) | ((pos * 3) << 8)
+    if pos < 170:
+        pos -= 85
+        return ((255 - pos * 3) << 8) | (pos * 3)
+    pos -= 170
+    return ((pos * 3) << 16) | (255 - pos * 3)
+
+
+def run(use_engine, seconds, playing):
+    leds = FakeNeoPixel(12)
+    drum_leds = DrumLeds(leds, keynum_to_padnum, num_pads)
+    pads_lit = [0] * num_pads
+    iterations = 0
+    led_time = 0
+    start = time.perf_counter()
+    last_led = start
+    while (now := time.perf_counter()) - start < seconds:
+        iterations += 1
+        if playing:  # light pads like a 120 bpm 16th pattern would
+            step = int((now - start) * 8)
+            for i in range(num_pads):
+                pads_lit[i] = (step + i) % 4 == 0
+        if now - last_led < 0.010:
+            continue
+        last_led = now
+        t0 = time.perf_counter()
+        if use_engine:
+            drum_leds.set_key(key_PLAY, 0x00FF00 if playing else 0x114400)
+            drum_leds.set_key(key_RECORD, 0x440011)
+            drum_leds.set_key(key_MUTE, 0x001144)
+            for i in range(num_pads):
+                if pads_lit[i]:
+                    drum_leds.set_pad(i, colorwheel(int(now * 20)))
+            drum_leds.fade()
+            drum_leds.show()
+        else:
+            leds[key_PLAY] = 0x00FF00 if playing else 0x114400
+            leds[key_RECORD] = 0x440011
+            leds[key_MUTE] = 0x001144
+            for i in range(num_pads):
+                if pads_lit[i]:
+                    leds[keynum_to_padnum.index(i)] = colorwheel(int(now * 20))
+            leds[:] = [[max(i - 10, 5) for i in l] for l in leds]
+            leds.show()
+        led_time += time.perf_counter() - t0
+    return iterations / seconds, leds.show_count / seconds, led_time * 1000 / seconds
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 2.0
+    print("%-8s %-9s %12s %10s %14s" % ("state", "renderer", "loops/sec", "shows/sec", "led ms/sec"))
+    for playing in (False, True):
+        for name, use_engine in (("orig", False), ("DrumLeds", True)):
+            loops, shows, led_ms = run(use_engine, seconds, playing)
+            print("%-8s %-9s %12.0f %10.1f %14.2f" %
+                  ("playing" if playing else "idle", name, loops, shows, led_ms))
+
+
+if __name__ == '__main__':
+    main()
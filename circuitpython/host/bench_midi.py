@@ -0,0 +1,197 @@
+# bench_midi.py -- host-side throughput benchmark for todbot_smolishmidi
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Feeds a MIDI byte stream through the original smolishmidi MidiIn.receive()
+# (a byte per read, a new Message per message, and a print() per byte, sent
+# to /dev/null here), through MidiIn.receive() (one message per call, now a
+# wrapper over receive_all()) and through MidiIn.receive_all() (bulk
+# ring-buffer parse) and reports messages/sec.  The original can't put a
+# message split across reads back together, those show up as its errors.
+# Then a busy multi-channel stream (a whole song, drums on channel 10) through
+# receive_all(), as is and with the drum machine's filters: channel 10 only
+# and the General MIDI note map (drum_notes.py), so the app gets a few
+# messages instead of all of them.
+#
+# Usage:
+#   python3 bench_midi.py                 # synthetic clock + notes + CC stream
+#   python3 bench_midi.py capture.bin     # raw MIDI bytes, e.g. from "cat /dev/snd/midiC1D0"
+#
+
+import os, sys, time, random, contextlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+import todbot_smolishmidi as smolmidi
+from drum_notes import note_table
+
+
+class StreamPort:
+    """Looks enough like busio.UART to feed MidiIn from a bytes object.
+    Bytes "arrive" in chunks of chunk_min..chunk_max bytes per readinto()."""
+    def __init__(self, data, chunk_min=1, chunk_max=16, seed=1234):
+        self.data = data
+        self.pos = 0
+        self.rand = random.Random(seed)
+        self.chunk_min, self.chunk_max = chunk_min, chunk_max
+        self.avail = 0
+
+    @property
+    def in_waiting(self):
+        if self.avail == 0:
+            self.avail = min(self.rand.randint(self.chunk_min, self.chunk_max), len(self.data) - self.pos)
+        return self.avail
+
+    def readinto(self, buf):
+        n = min(len(buf), self.in_waiting)
+        if n == 0:
+            return None
+        buf[0:n] = self.data[self.pos:self.pos+n]
+        self.pos += n
+        self.avail -= n
+        return n
+
+    def done(self):
+        return self.pos >= len(self.data)
+
+
+class OrigMessage:
+    def __init__(self):
+        self.type = None
+        self.channel = None
+        self.data = None
+
+
+class OrigMidiIn:
+    """MidiIn.receive() as it was before receive_all(), to compare against."""
+    _LEN_1_MESSAGES = set([smolmidi.PROGRAM_CHANGE, smolmidi.CHANNEL_PRESSURE,
+                           smolmidi.SONG_SELECT, smolmidi.BUS_SELECT])
+    _LEN_2_MESSAGES = set([smolmidi.NOTE_OFF, smolmidi.NOTE_ON, smolmidi.AFTERTOUCH,
+                           smolmidi.CC, smolmidi.PITCH_BEND, smolmidi.SONG_POSITION])
+
+    def __init__(self, port, enable_running_status=False):
+        self._port = port
+        self._read_buf = bytearray(1)
+        self._running_status_enabled = enable_running_status
+        self._running_status = None
+        self._outstanding_sysex = False
+        self._error_count = 0
+        self.filtered = 0
+
+    @property
+    def error_count(self):
+        return self._error_count
+
+    def receive(self):
+        result = self._port.readinto(self._read_buf)
+        if not result:
+            return None
+        print("smol result:", result)
+        message = OrigMessage()
+        data_bytes = bytearray(2)
+        status_byte = self._read_buf[0]
+        is_status = status_byte & 0x80
+        if not is_status:
+            if self._running_status_enabled and self._running_status:
+                status_byte = self._running_status
+            else:
+                self._error_count += 1
+                return None
+        if smolmidi.NOTE_OFF <= status_byte <= smolmidi.PITCH_BEND + 0x0F:
+            self._running_status = status_byte
+            message.type = status_byte & 0xF0
+            message.channel = status_byte & 0x0F
+        else:
+            message.type = status_byte
+        if message.type in self._LEN_2_MESSAGES:
+            data_bytes = bytearray(2)
+            self._port.readinto(data_bytes)
+            message.data = data_bytes
+        elif message.type in self._LEN_1_MESSAGES:
+            data_bytes = bytearray(1)
+            self._port.readinto(data_bytes)
+            message.data = data_bytes
+        if message.type == smolmidi.SYSEX:
+            self._outstanding_sysex = True
+        for b in data_bytes:
+            if b & 0x80:
+                self._error_count += 1
+                return None
+        return message
+
+
+def synth_stream(seconds=60, bpm=120, seed=42, busy=False):
+    """Make a dense stream like a DAW sends: 24ppqn clock, 16th note hits, CC sweeps.
+    If busy, also notes & CCs of 8 other instruments on channels 1-8, and
+    drum notes the drum machine hasn't got pads for."""
+    rand = random.Random(seed)
+    out = bytearray()
+    ticks = int(seconds * bpm / 60 * 24)
+    for t in range(ticks):
+        out.append(smolmidi.CLOCK)
+        if t % 6 == 0:  # 16th note
+            for _ in range(rand.randint(1, 3)):
+                note = rand.choice((36, 38, 42, 46, 39, 45, 51, 49))
+                out += bytes((smolmidi.NOTE_ON | 9, note, rand.randint(1, 127)))
+                out += bytes((smolmidi.NOTE_OFF | 9, note, 0))
+            if busy:
+                for chan in range(8):
+                    note = rand.randint(36, 96)
+                    out += bytes((smolmidi.NOTE_ON | chan, note, rand.randint(1, 127)))
+                    out += bytes((smolmidi.NOTE_OFF | chan, note, 0))
+                    out += bytes((smolmidi.CC | chan, 1, rand.randrange(128)))
+                note = rand.choice((54, 56, 69, 70, 75, 82))  # tambourine, cowbell, cabasa, ...
+                out += bytes((smolmidi.NOTE_ON | 9, note, 100, smolmidi.NOTE_OFF | 9, note, 0))
+        if t % 2 == 0:
+            out += bytes((smolmidi.CC | 0, 74, (t // 2) & 0x7F))
+    return bytes(out)
+
+
+def bench(data, use_bulk, channel_mask=0xFFFF, note_filter=None, orig=False):
+    port = StreamPort(data)
+    if orig:
+        midi_in = OrigMidiIn(port)
+    else:
+        midi_in = smolmidi.MidiIn(port, channel_mask=channel_mask, note_filter=note_filter)
+    count = 0
+    start = time.perf_counter()
+    if use_bulk:
+        while not port.done():
+            count += midi_in.receive_all()
+        count += midi_in.receive_all()
+    else:
+        while not port.done():
+            if midi_in.receive() is not None:
+                count += 1
+        while midi_in.receive() is not None:
+            count += 1
+    return count, time.perf_counter() - start, midi_in.error_count, midi_in.filtered
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as fp:
+            data = fp.read()
+        print("stream:", sys.argv[1], len(data), "bytes")
+    else:
+        data = synth_stream()
+        print("stream: synthetic 60 sec @ 120 bpm,", len(data), "bytes")
+
+    with open(os.devnull, 'w') as null:
+        with contextlib.redirect_stdout(null):  # its print() per byte
+            orig = bench(data, False, orig=True)
+    for name, (count, secs, errs, _) in (("orig receive()", orig),
+                                        ("receive()", bench(data, False)),
+                                        ("receive_all()", bench(data, True))):
+        print("%-14s %7d msgs %8.3f s %10.0f msgs/s %6d errors" %
+              (name, count, secs, count / secs, errs))
+
+    data = synth_stream(busy=True)
+    print("stream: synthetic busy 60 sec @ 120 bpm, 9 channels,", len(data), "bytes")
+    gm = note_table('gm', 8)
+    for name, mask, notes in (("all", 0xFFFF, None), ("ch 10 + gm", 1 << 9, gm)):
+        count, secs, errs, filtered = bench(data, True, mask, notes)
+        print("%-14s %7d msgs %8.3f s %10.0f bytes/s %6d filtered" %
+              (name, count, secs, len(data) / secs, filtered))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+# bench_sched.py -- host-side step timing jitter & drift benchmark
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs a simulated drum machine main loop on a virtual clock, where each
+# loop iteration takes a random amount of time (MIDI parsing, key handling)
+# and the LED refresh every 10 ms takes a few milliseconds more.
+# Compares the old ticks_ms() polling scheduler ("make up half the
+# lateness" on integer step_millis) against drum_sched.StepScheduler.
+#
+# Reports, for each tempo, the mean and max timing error of steps against
+# the ideal grid and the drift (error of the last step) over N steps.
+# Then the same for swung grids (drum_sched.Groove), with a tempo change
+# halfway, and checks that StepScheduler.nearest_step() quantizes hits
+# played near swung steps onto those steps, exiting non-zero if not.
+#
+# Usage:
+#   python3 bench_sched.py [num_steps] [seed]
+#
+
+import os, sys, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_sched import StepScheduler, VirtualClock, Groove
+
+steps_per_beat = 4
+led_period_us = 10000
+
+
+class LoopProfile:
+    """Random per-iteration loop costs, in microseconds"""
+    def __init__(self, seed, loop_min=300, loop_max=900, led_cost=3000, stall_chance=0.002, stall_cost=15000):
+        self.rand = random.Random(seed)
+        self.loop_min, self.loop_max = loop_min, loop_max
+        self.led_cost = led_cost
+        self.stall_chance, self.stall_cost = stall_chance, stall_cost
+
+    def loop_cost(self):
+        c = self.rand.randint(self.loop_min, self.loop_max)
+        if self.rand.random() < self.stall_chance:  # e.g. display update
+            c += self.stall_cost
+        return c
+
+
+def run_old(bpm, num_steps, profile):
+    # the original code.py scheduler, on a millisecond clock
+    clock = VirtualClock()
+    step_millis = int(60 / bpm * 1000 / steps_per_beat)
+    last_step_millis = 0
+    last_led = 0
+    fired = []
+    first = True
+    while len(fired) < num_steps:
+        now_us = clock.now_us()
+        now = now_us // 1000
+        cost = profile.loop_cost()
+        if now_us - last_led > led_period_us:
+            last_led = now_us
+            cost += profile.led_cost
+        diff = now - last_step_millis
+        if first or diff >= step_millis:
+            first = False
+            late_millis = diff - step_millis
+            last_step_millis = now - (late_millis // 2)
+            fired.append(now_us)
+        clock.advance(cost)
+    return fired
+
+
+def run_new(bpm, num_steps, profile, swing=None):
+    clock = VirtualClock()
+    sched = StepScheduler(clock, bpm=bpm, steps_per_beat=steps_per_beat)
+    sched.start()
+    if swing:
+        groove = Groove()
+        groove.build(sched.step_us(), swing)
+        sched.set_offsets(groove.step_offsets)
+    last_led = 0
+    fired = []
+    while len(fired) < num_steps:
+        now_us = clock.now_us()
+        cost = profile.loop_cost()
+        # LED refresh deferred if a step is due within lookahead, as in code.py
+        if now_us - last_led > led_period_us and sched.time_to_next(now_us) > sched.lookahead_us:
+            last_led = now_us
+            cost += profile.led_cost
+        sched.ahead(now_us)
+        step = sched.poll(now_us)
+        if step >= 0:
+            while len(fired) < step:  # skipped steps count as fired very late
+                fired.append(None)
+            # swung runs record error vs the step's (swung) due time
+            fired.append(now_us - sched.step_time(step) if swing else now_us)
+            if swing and step == num_steps // 2:  # tempo change, as update_step_millis()
+                sched.set_bpm(bpm * 5 // 4)
+                groove.build(sched.step_us(), swing)
+                sched.set_offsets(groove.step_offsets)
+        clock.advance(cost)
+    return fired[:num_steps]
+
+
+def swing_stats(errs):
+    abs_errs = [abs(e) for e in errs if e is not None]
+    return sum(abs_errs) / len(abs_errs), max(abs_errs), errs.count(None)
+
+
+def check_quantize(bpm, swing, seed, hits=2000):
+    """Hits up to 40% of the shorter swung gap away from a step should quantize to it."""
+    rand = random.Random(seed)
+    sched = StepScheduler(VirtualClock(), bpm=bpm, steps_per_beat=steps_per_beat)
+    sched.start(1000000)
+    groove = Groove()
+    groove.build(sched.step_us(), swing)
+    sched.set_offsets(groove.step_offsets)
+    gap = min(sched.step_time(1) - sched.step_time(0), sched.step_time(2) - sched.step_time(1))
+    wrong = 0
+    for _ in range(hits):
+        step = rand.randrange(1, 1000)
+        t = sched.step_time(step) + rand.randint(-gap * 4 // 10, gap * 4 // 10)
+        if sched.nearest_step(t) != step:
+            wrong += 1
+    return wrong
+
+
+def stats(fired, bpm):
+    # errors relative to the ideal grid starting at the first step
+    t0 = fired[0]
+    period = 60e6 / (bpm * steps_per_beat)
+    errs = []
+    missed = 0
+    for k, t in enumerate(fired):
+        if t is None:
+            missed += 1
+            continue
+        errs.append(t - (t0 + k * period))
+    abs_errs = [abs(e) for e in errs]
+    return (sum(abs_errs) / len(abs_errs), max(abs_errs), errs[-1], missed)
+
+
+def main():
+    num_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    print("%d steps per tempo, errors in ms vs ideal grid" % num_steps)
+    print("%4s  %-6s %9s %9s %10s %6s" % ("bpm", "sched", "mean_err", "max_err", "drift", "missed"))
+    for bpm in (60, 90, 120, 150, 180, 240, 300):
+        for name, runner in (("old", run_old), ("new", run_new)):
+            fired = runner(bpm, num_steps, LoopProfile(seed))
+            mean_err, max_err, drift, missed = stats(fired, bpm)
+            print("%4d  %-6s %9.3f %9.3f %10.1f %6d" %
+                  (bpm, name, mean_err / 1000, max_err / 1000, drift / 1000, missed))
+
+    print("swung, tempo x1.25 halfway, errors in ms vs swung grid")
+    print("%4s  %-6s %9s %9s %6s %9s" % ("bpm", "swing", "mean_err", "max_err", "missed", "quantize"))
+    failed = 0
+    for bpm in (90, 120, 180):
+        for swing in (54, 58, 66, 75):
+            errs = run_new(bpm, num_steps, LoopProfile(seed), swing=swing)
+            mean_err, max_err, missed = swing_stats(errs)
+            wrong = check_quantize(bpm, swing, seed)
+            failed += wrong
+            print("%4d  %-6d %9.3f %9.3f %6d %9s" % (bpm, swing, mean_err / 1000, max_err / 1000, missed,
+                                                    "%d wrong" % wrong if wrong else "ok"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+# bounce.py -- render drum machine patterns with drum kits to WAV files, offline
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Mixes like the drum machine's audiomixer.Mixer(voice_count=12, sample_rate=22050,
+# bits_per_sample=16, samples_signed=True) does on the device:
+#  - each pad has voices_per_pad round-robin voices (drum_voices.VoiceAlloc),
+#    so a hit rings until its sample ends or that many more hits of the pad
+#    restart its voice, or a pad in its choke group (the kit's, or
+#    code.py's default, hi-hats) plays.  The pool is big enough that patterns
+#    don't steal voices, so that isn't modelled.
+#  - voice level comes from the step's velocity byte through the same
+#    drum_pattstore.level_tables() table code.py uses, and is a Q15
+#    multiply, (sample * int(level * 32768)) >> 15
+#  - voices are added in order with 16-bit saturation after each one
+#  - voice.play() only takes effect at the start of the next mixer buffer,
+#    so hits land on buffer_size boundaries.  code.py picks its buffer_size
+#    from measured stalls and saves it in /audio_buffer.txt (see
+#    drum_latency.py), so give the device's with --buffer-file, or it's
+#    drum_latency.AudioLatency's default (2048 bytes = 1024 samples).
+#    Use --buffer-size 0 for sample-exact hit times
+# Step times come from drum_sched.StepScheduler, with the pattern's swing
+# and per-pad nudges from drum_sched.Groove, same as code.py.
+# Mixing is done a whole voice at a time with NumPy, and pattern x kit
+# combinations are rendered in parallel with multiprocessing.
+#
+# Patterns are the demo patterns in drum_patterns.py, or a saved pattern
+# bank (.bin, see drum_bank.py), or older saved patterns (.json).
+# With --check DIR, renders are compared with WAVs already in DIR (e.g.
+# from a previous run) instead of written, as a regression test of the groove.
+#
+# Usage:
+#   python3 bounce.py OUT_DIR [--patterns demo|FILE.bin|FILE.json] [--pattern NAME ...]
+#                     [--kits DIR] [--kit NAME ...] [--bpm 120] [--loops 2]
+#                     [--buffer-size 2048 | --buffer-file CIRCUITPY/audio_buffer.txt] [--check] [--jobs N]
+#
+# Requires numpy.
+#
+
+import os, sys, json, wave, argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_patterns import patterns_demo
+from drum_pattstore import Pattern, level_tables
+from drum_bank import PatternBank
+from drum_sched import StepScheduler, VirtualClock, Groove
+from drum_latency import AudioLatency
+import drum_kitindex
+
+num_pads = 8
+sample_rate = 22050
+voices_per_pad = 2  # as code.py
+default_choke = (0, 0, 1, 1, 0, 0, 0, 0)
+default_kit_root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine', 'drumkits')
+
+
+def load_patterns(source):
+    """List of Patterns from 'demo', a pattern bank .bin or saved patterns .json"""
+    if source == 'demo':  # as make_sequence_from_demo_pattern() in code.py
+        return [Pattern.from_strs(p['name'], p['base'], num_steps=p['len']) for p in patterns_demo]
+    if source.endswith('.json'):
+        with open(source) as fp:
+            return [Pattern.from_strs(p['name'], p['seq']) for p in json.load(fp)]
+    bank = PatternBank(source, num_pads=num_pads)
+    if not bank.open():
+        raise ValueError("can't read pattern bank " + source)
+    return bank.load_all()
+
+
+def read_samples(path):
+    with wave.open(path, 'rb') as w:
+        if (w.getframerate(), w.getnchannels(), w.getsampwidth()) != (sample_rate, 1, 2):
+            raise ValueError("%s: not %d Hz mono 16-bit" % (path, sample_rate))
+        return np.frombuffer(w.readframes(w.getnframes()), dtype='<i2').astype(np.int32)
+
+
+def hit_times(patt, bpm, steps_per_beat, loops, buffer_samples):
+    """Sample number each pad starts playing at on each step, (steps+1) x pads,
+    like code.py's sequencer on the Mixer, and the order they're played in
+    (exact time in us, with the pad number after the point, as a float)."""
+    sched = StepScheduler(VirtualClock(), bpm=bpm, steps_per_beat=steps_per_beat)
+    groove = Groove(patt.num_steps, num_pads)
+    groove.build(sched.step_us(), patt.swing, patt.nudge)
+    sched.set_offsets(groove.step_offsets)
+    sched.start(groove.lead_us)  # so early nudged pads on step 0 aren't before the start
+    n = patt.num_steps * loops
+    t = np.array([sched.step_time(i) for i in range(n + 1)], dtype=np.int64)
+    t_us = t[:, None] + np.array(groove.pad_delays, dtype=np.int64)
+    order = t_us + np.arange(num_pads) / num_pads  # pads of a step are played 0 first
+    t = t_us * sample_rate // 1000000
+    if buffer_samples:  # play() is heard from the start of the next buffer mixed
+        t = -(-t // buffer_samples) * buffer_samples
+    return t, order
+
+
+# velocity byte -> Q15 voice level, as the Mixer stores voice.level
+q15_levels = np.array([int(v * 32768) for v in level_tables()], dtype=np.int64)
+
+def render(patt, samples, bpm=120, steps_per_beat=4, loops=2, buffer_samples=2048, choke=None):
+    """Mix one pattern with one kit's samples (list of int32 arrays), returns int16 array.
+    choke is the kit's choke group of each pad (None for the default)."""
+    choke = choke or default_choke
+    n = patt.num_steps * loops
+    times, order = hit_times(patt, bpm, steps_per_beat, loops, buffer_samples)
+    hits = np.frombuffer(bytes(patt.hits) * loops, dtype=np.uint8)
+    step_levels = q15_levels[np.frombuffer(bytes(patt.vels) * loops, dtype=np.uint8)]
+    length = times[n].max() + max(len(s) for s in samples)  # let the last hits ring out
+    mix = np.zeros(length, dtype=np.int32)
+    on = [(hits >> p) & 1 == 1 for p in range(num_pads)]
+    for p in range(num_pads):
+        onsets = times[:n, p][on[p]]
+        if len(onsets) == 0:
+            continue
+        sample = samples[p]
+        voice = np.zeros(length, dtype=np.int64)
+        # each hit plays until its sample ends, its round-robin voice is restarted...
+        ends = np.minimum(np.append(onsets[voices_per_pad:], [length] * voices_per_pad)[:len(onsets)],
+                          onsets + len(sample))
+        # ...or a pad in its choke group plays after it
+        chokers = [q for q in range(num_pads) if q != p and choke[p] and choke[q] == choke[p]]
+        if chokers:
+            cut_order = np.concatenate([order[:n, q][on[q]] for q in chokers])
+            cut_times = np.concatenate([times[:n, q][on[q]] for q in chokers])
+            k = np.argsort(cut_order)
+            i = np.searchsorted(cut_order[k], order[:n, p][on[p]], side='right')  # next to play after
+            ends = np.minimum(ends, np.append(cut_times[k], length)[i])
+        for start, end, level in zip(onsets, ends, step_levels[on[p]]):
+            if end > start:  # choked the moment it started, never heard
+                voice[start:end] = (sample[:end - start] * level) >> 15
+        mix = np.clip(mix + voice, -32768, 32767)
+    return mix.astype('<i2')
+
+
+def write_wav(path, data):
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(data.tobytes())
+
+
+def read_wav(path):
+    with wave.open(path, 'rb') as w:
+        return np.frombuffer(w.readframes(w.getnframes()), dtype='<i2')
+
+
+_kit_samples = {}  # per worker process, kit name -> samples
+
+def bounce(job):
+    """Render one pattern x kit, write or compare its WAV. Runs in a worker process."""
+    patt, kit_name, paths, choke, out_path, opts = job
+    if kit_name not in _kit_samples:
+        _kit_samples[kit_name] = [read_samples(p) for p in paths[:num_pads]]
+    data = render(patt, _kit_samples[kit_name], opts['bpm'], opts['steps_per_beat'],
+                  opts['loops'], opts['buffer_samples'], choke)
+    if not opts['check']:
+        write_wav(out_path, data)
+        return out_path, len(data), None
+    if not os.path.exists(out_path):
+        return out_path, len(data), "missing"
+    golden = read_wav(out_path)
+    if len(golden) != len(data):
+        return out_path, len(data), "length %d, was %d" % (len(data), len(golden))
+    diff = np.nonzero(golden != data)[0]
+    if len(diff):
+        return out_path, len(data), "%d samples differ, first at %.4f s" % (len(diff), diff[0] / sample_rate)
+    return out_path, len(data), None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Render drum machine patterns with kits to WAVs")
+    ap.add_argument('out_dir')
+    ap.add_argument('--patterns', default='demo', help="'demo', a pattern bank .bin or saved .json")
+    ap.add_argument('--pattern', action='append', help="only this pattern (can repeat)")
+    ap.add_argument('--kits', default=default_kit_root, help="drumkits directory")
+    ap.add_argument('--kit', action='append', help="only this kit (can repeat)")
+    ap.add_argument('--bpm', type=int, default=120)
+    ap.add_argument('--steps-per-beat', type=int, default=4)
+    ap.add_argument('--loops', type=int, default=2, help="times through each pattern")
+    ap.add_argument('--buffer-size', type=int, default=None,
+                    help="Mixer buffer_size in bytes, 0 for exact hit times"
+                         " (default: --buffer-file's, else code.py's default)")
+    ap.add_argument('--buffer-file', default=None,
+                    help="the device's audio_buffer.txt, the buffer_size code.py tuned & saved")
+    ap.add_argument('--check', action='store_true', help="compare with WAVs in OUT_DIR instead of writing")
+    ap.add_argument('--jobs', type=int, default=None, help="worker processes (default: all CPUs)")
+    args = ap.parse_args()
+
+    patterns = load_patterns(args.patterns)
+    if args.pattern:
+        patterns = [p for p in patterns if p.name in args.pattern]
+    index = drum_kitindex.build_index(args.kits, num_pads, rate=sample_rate, channels=1, bits=16)
+    for kname, problem, _, _, _ in index['rejected']:
+        print("skipping kit %s: %s" % (kname, problem))
+    kits = drum_kitindex.kits_from_index(index, args.kits)
+    kit_names = [k for k in kits['kit_names'] if not args.kit or k in args.kit]
+    if not patterns or not kit_names:
+        print("nothing to render")
+        sys.exit(1)
+
+    buffer_size = args.buffer_size
+    if buffer_size is None:  # as code.py starts its Mixer
+        latency = AudioLatency(VirtualClock(), sample_rate=sample_rate)
+        buffer_size = latency.load(args.buffer_file) if args.buffer_file else latency.buffer_size
+    opts = {'bpm': args.bpm, 'steps_per_beat': args.steps_per_beat, 'loops': args.loops,
+            'buffer_samples': buffer_size // 2, 'check': args.check}
+    os.makedirs(args.out_dir, exist_ok=True)
+    jobs = [(p, k, kits[k], kits['kit_chokes'][k], os.path.join(args.out_dir, "%s_%s.wav" % (p.name, k)), opts)
+            for p in patterns for k in kit_names]
+    failed = 0
+    with Pool(args.jobs) as pool:
+        for path, nsamples, problem in pool.imap(bounce, jobs):
+            if problem:
+                failed += 1
+                print("%-40s %s" % (os.path.basename(path), problem))
+    print("%d renders %s, %d %s" % (len(jobs), "checked" if args.check else "written",
+                                     failed, "differ" if args.check else "failed"))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
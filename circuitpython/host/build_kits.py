@@ -0,0 +1,185 @@
+# build_kits.py -- batch convert sample libraries into drum machine kits
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Instead of running "sox sound.mp3 -b 16 -c 1 -r 22050 sound.wav" by hand
+# for every sample, this converts whole directories of WAVs at once:
+#  - mixes down to mono and resamples to the mixer's rate
+#  - trims leading & trailing silence (with a short fade out)
+#  - peak-normalizes
+#  - writes 16-bit "NNname.wav" files in the layout find_kits() expects
+#  - optionally reports kits bigger than a RAM budget
+# Samples are processed in parallel with multiprocessing.
+#
+# Smaller samples load faster and fit in the drum_kitcache RAM budget
+# (bigger ones are streamed from flash).  The drum machine plays every kit
+# at one format, its audiomixer.Mixer's, 16-bit mono at code.py's rate, and
+# drum_kitindex rejects kits that aren't, so there's no 8-bit or half rate
+# to shrink a kit with: trim or shorten its samples instead.
+#
+# Input is WAV only (any rate, channels, 8/16/24/32-bit PCM); convert mp3s first.
+# SRC_DIR is either one kit (a dir of WAVs, played on pads in sorted order)
+# or a library of kits (a dir of dirs of WAVs).
+#
+# Usage:
+#   python3 build_kits.py SRC_DIR OUT_DIR [--rate 22050] [--budget-kb 96]
+#   then copy OUT_DIR/kit* to CIRCUITPY/drumkits/
+#
+# Requires numpy.
+#
+
+import os, re, wave, argparse
+from multiprocessing import Pool
+
+import numpy as np
+
+num_pads = 8
+
+
+def read_wav(path):
+    """Returns (float32 mono samples in -1..1, sample rate)"""
+    with wave.open(path, 'rb') as w:
+        rate = w.getframerate()
+        chans = w.getnchannels()
+        width = w.getsampwidth()
+        raw = w.readframes(w.getnframes())
+    if width == 1:  # 8-bit WAVs are unsigned
+        x = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif width == 2:
+        x = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768
+    elif width == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        v = np.where(v & 0x800000, v - 0x1000000, v)
+        x = v.astype(np.float32) / 8388608
+    elif width == 4:
+        x = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648
+    else:
+        raise ValueError("%d-byte samples not supported" % width)
+    x = x.reshape(-1, chans).mean(axis=1)
+    return x, rate
+
+
+def write_wav(path, x, rate):
+    x = np.clip(x, -1.0, 1.0)
+    data = np.round(x * 32767).astype('<i2').tobytes()
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(data)
+
+
+def resample(x, rate_in, rate_out):
+    """Band-limited resample via FFT (fine for short one-shot samples)"""
+    if rate_in == rate_out or len(x) == 0:
+        return x
+    n_out = max(1, int(round(len(x) * rate_out / rate_in)))
+    X = np.fft.rfft(x)
+    n_bins = n_out // 2 + 1
+    if n_bins <= len(X):
+        Y = X[:n_bins]
+    else:
+        Y = np.zeros(n_bins, dtype=X.dtype)
+        Y[:len(X)] = X
+    return (np.fft.irfft(Y, n_out) * (n_out / len(x))).astype(np.float32)
+
+
+def trim_silence(x, rate, threshold_db, fade_ms=5, preroll_ms=1):
+    """Trim below-threshold audio at start & end, fade out the new end"""
+    thresh = 10 ** (threshold_db / 20) * (np.max(np.abs(x)) or 1.0)
+    loud = np.nonzero(np.abs(x) > thresh)[0]
+    if len(loud) == 0:
+        return x[:1]
+    start = max(0, loud[0] - int(rate * preroll_ms / 1000))
+    end = loud[-1] + 1
+    y = x[start:end].copy()
+    nfade = min(len(y), int(rate * fade_ms / 1000))
+    if nfade > 1:
+        y[-nfade:] *= np.linspace(1.0, 0.0, nfade, dtype=np.float32)
+    return y
+
+
+def normalize(x, peak_db):
+    peak = np.max(np.abs(x))
+    if peak == 0:
+        return x
+    return x * (10 ** (peak_db / 20) / peak)
+
+
+def process_sample(job):
+    """One sample: read, mono, resample, trim, normalize. Runs in a worker process."""
+    src, rate, threshold_db, peak_db = job
+    x, src_rate = read_wav(src)
+    x = resample(x, src_rate, rate)
+    x = trim_silence(x, rate, threshold_db)
+    x = normalize(x, peak_db)
+    return src, x
+
+
+def clean_name(path, keep='', strip_number=True):
+    name = os.path.splitext(os.path.basename(path))[0].lower()
+    if strip_number:
+        name = re.sub(r'^[0-9]+[_ -]*', '', name)  # drop any existing number prefix
+    return re.sub(r'[^a-z0-9' + keep + ']+', '', name)[:20] or "sample"
+
+
+def find_kit_dirs(src_dir):
+    """Returns list of (kit name, [wav paths])"""
+    def wavs(d):
+        return sorted(os.path.join(d, f) for f in os.listdir(d)
+                      if f.lower().endswith('.wav') and not f.startswith('.'))
+    subdirs = sorted(d for d in os.listdir(src_dir) if os.path.isdir(os.path.join(src_dir, d)))
+    kits = [(d, wavs(os.path.join(src_dir, d))) for d in subdirs]
+    kits = [(n, w) for n, w in kits if w]
+    if not kits:
+        kits = [(os.path.basename(os.path.abspath(src_dir)), wavs(src_dir))]
+    return kits
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build drum machine kits from sample directories")
+    ap.add_argument('src_dir')
+    ap.add_argument('out_dir')
+    ap.add_argument('--rate', type=int, default=22050, help="mixer sample rate (default 22050)")
+    ap.add_argument('--threshold-db', type=float, default=-50, help="silence threshold below peak")
+    ap.add_argument('--peak-db', type=float, default=-0.5, help="normalize peaks to this")
+    ap.add_argument('--budget-kb', type=int, default=0,
+                    help="report kits whose samples are bigger than this")
+    ap.add_argument('--jobs', type=int, default=None, help="worker processes (default: all CPUs)")
+    args = ap.parse_args()
+
+    kits = find_kit_dirs(args.src_dir)
+    jobs = [(src, args.rate, args.threshold_db, args.peak_db)
+            for _, wavs in kits for src in wavs[:num_pads]]
+    with Pool(args.jobs) as pool:
+        results = dict(pool.map(process_sample, jobs))
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for i, (kname, wavs) in enumerate(kits):
+        wavs = wavs[:num_pads]
+        if len(wavs) < num_pads:
+            print("skipping %s: only %d samples, need %d" % (kname, len(wavs), num_pads))
+            continue
+        kit_name = clean_name(kname, keep='_', strip_number=False)
+        if not kit_name.startswith("kit"):
+            kit_name = "kit%d_%s" % (i, kit_name)
+        samples = [results[w] for w in wavs]
+        kit_dir = os.path.join(args.out_dir, kit_name)
+        os.makedirs(kit_dir, exist_ok=True)
+        total = 0
+        for n, (src, x) in enumerate(zip(wavs, samples)):
+            out = os.path.join(kit_dir, "%02d%s.wav" % (n, clean_name(src)))
+            write_wav(out, x, args.rate)
+            total += os.path.getsize(out)
+        print("%-20s %2d samples %7d bytes  %d Hz 16-bit" % (kit_name, len(wavs), total, args.rate))
+        size = sum(len(x) * 2 for x in samples)
+        if args.budget_kb and size > args.budget_kb * 1024:
+            print("  %d kB of samples, over the %d kB budget: some will be streamed from flash" % (
+                size // 1024, args.budget_kb))
+    if args.rate != 22050:
+        print("NOTE: set the audiomixer.Mixer's sample_rate and find_kits()' rate in code.py to %d"
+              " for these kits" % args.rate)
+
+
+if __name__ == '__main__':
+    main()
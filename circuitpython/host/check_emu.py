@@ -0,0 +1,184 @@
+# check_emu.py -- regression checks of drum machine step timing, run on the host emulator
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs the unmodified ../drum_machine/code.py on the emu/ host emulator,
+# presses PLAY, and checks that:
+#  - every sequencer hit lands within late_us of its step time, no steps missed
+#  - a MIDI note-on through the MacroPadSynthPlug UART plays its pad quickly
+#  - the LEDs and display were updated (what was last refreshed onto the
+#    OLED, not just the labels), and the display was never being
+#    refreshed when a step was due
+#  - two runs with the same script give exactly the same voice events
+#  - with main loop profiling turned on (from the serial console) steps
+#    still aren't late, and the profiler saw every stage of the loop
+#  - in the step grid view, with a hit recorded, the grid shows the
+#    pattern and playhead, and steps still aren't late
+# Exits non-zero if any check fails.
+#
+# Usage:
+#   python3 check_emu.py [seconds]
+#
+
+import os, sys
+
+import emu
+
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine')
+late_us = 2000  # a step later than this is "late"
+midi_us = 3000  # most time from end of a MIDI note-on to its pad playing
+play_ms = 500  # when PLAY is pressed
+note_ms = 3333  # when a MIDI note-on arrives, between steps
+pad_ms = 2000  # when pad 7 is hit (and recorded) in the grid view run
+
+
+def run(seconds, profile=False, grid=False):
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    if profile:
+        sim.serial(100, 'p')
+    if grid:  # hold encoder & press MUTE for grid view, then record a hit on pad 7
+        sim.encoder_switch(100, True)
+        sim.tap(700, 8)
+        sim.encoder_switch(800, False)
+        sim.tap(1500, 5)  # RECORD
+        sim.tap(pad_ms, 10)
+    sim.tap(play_ms, 2)  # PLAY
+    sim.midi(note_ms, b'\x90\x2d\x7f')  # note 45 (GM low tom) -> pad 5
+    watch_pads(sim)
+    emu.run(app_dir, sim)
+    return sim
+
+
+def watch_pads(sim):
+    """The drum machine plays a pad on whichever mixer voice its
+    drum_voices.VoiceAlloc picks, so note the pad of each mixer event as the
+    app runs, in sim.pads (the voice number for apps without one)."""
+    sim.pads = []
+    def watch(now_us):
+        if sim.mixers:
+            voices = sim.globals.get('voices')
+            events = sim.mixer.events
+            while len(sim.pads) < len(events):
+                v = events[len(sim.pads)][1]
+                sim.pads.append(voices.pad_of(v) if voices else v)
+    sim.background.append(watch)
+
+
+def pad_plays(sim):
+    """(t_us, pad) of each voice play() in a run with watch_pads()."""
+    return [(t, sim.pads[i]) for i, (t, _, kind, _) in enumerate(sim.mixer.events) if kind == 'play']
+
+
+def step_spread(sim):
+    """(sequencer hits, worst lateness, first step's lateness) of a run"""
+    step_us = sim.globals['sched'].step_us()
+    plays = pad_plays(sim)
+    seq_plays = [(t, v) for t, v in plays if not (note_ms * 1000 <= t < note_ms * 1000 + step_us)
+                 and not (v == 7 and pad_ms * 1000 <= t < pad_ms * 1000 + midi_us)]  # pad hit live
+    # offsets from the step grid, relative to the earliest hit. The first step
+    # after PLAY is left out, it's due the moment PLAY is pressed so it's
+    # always as late as the rest of that loop (including a display refresh)
+    first = seq_plays[0][0]
+    offsets = [(t - first + step_us // 2) % step_us - step_us // 2 for t, _ in seq_plays if t > first]
+    return len(seq_plays), max(offsets) - min(offsets), first - play_ms * 1000
+
+
+def refresh_clashes(sim):
+    """Display refreshes that were going on when a step was due."""
+    sched = sim.globals['sched']
+    refresh_us = sim.costs['display.refresh']
+    t0 = sched.clock._t0 // 1000  # MonotonicClock counts from when it was made
+    steps = [t0 + sched.step_time(s) for s in range(sched.step)]  # since PLAY restarted the scheduler
+    return [r for r in sim.display.refresh_times if any(r <= t < r + refresh_us for t in steps)]
+
+
+def make_demo(seq):
+    """The demo pattern seq started as."""
+    sys.path.insert(0, app_dir)
+    from drum_patterns import patterns_demo
+    from drum_pattstore import Pattern
+    p = [p for p in patterns_demo if p['name'] == seq.name][0]
+    return Pattern.from_strs(p['name'], p['base'], num_steps=p['len'])
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    failed = 0
+    sim = run(seconds)
+    if sim.error:
+        print("FAIL: drum machine raised an error")
+        sys.exit(1)
+
+    sched = sim.globals['sched']
+    hits, worst, first = step_spread(sim)
+    print("%d sequencer hits in %.1f s, worst lateness %d us, %d steps missed"
+          " (first step %d us after PLAY)" % (hits, seconds, worst, sched.missed, first))
+    if worst > late_us or sched.missed:
+        print("FAIL: late or missed steps")
+        failed += 1
+
+    plays = pad_plays(sim)
+    note_end_us = note_ms * 1000 + 3 * 320  # 3 bytes at 31250 baud
+    midi_plays = [t for t, v in plays if v == 5 and t >= note_end_us]
+    if not midi_plays or midi_plays[0] - note_end_us > midi_us:
+        print("FAIL: MIDI note-on didn't play pad 5 within %d us" % midi_us)
+        failed += 1
+    else:
+        print("MIDI note-on to pad playing: %d us" % (midi_plays[0] - note_end_us))
+
+    if len(sim.leds.frames) < 10 or 'play' not in ' '.join(sim.display.shown):
+        print("FAIL: LEDs or display not updated")
+        failed += 1
+    clashes = refresh_clashes(sim)
+    print("display: %d refreshes, %d while a step was due" % (len(sim.display.refresh_times), len(clashes)))
+    if clashes:
+        print("FAIL: display refreshed across a step at %s" % ["%.3f" % (r / 1e6) for r in clashes])
+        failed += 1
+
+    again = run(seconds)
+    if [e[:3] for e in again.mixer.events] != [e[:3] for e in sim.mixer.events] or again.pads != sim.pads:
+        print("FAIL: runs aren't deterministic")
+        failed += 1
+
+    profiled = run(seconds, profile=True)
+    prof = profiled.globals['prof']
+    hits, worst, _ = step_spread(profiled)
+    print("profiling on: %d loops/s, longest loop %d us, worst lateness %d us, %d steps missed" % (
+        prof.loop_rate, prof.stage_max[len(prof.stage_names)], worst, profiled.globals['sched'].missed))
+    if worst > late_us or profiled.globals['sched'].missed:
+        print("FAIL: late or missed steps with profiling on")
+        failed += 1
+    if not all(prof.stage_hist[r * prof.num_bins:(r + 1) * prof.num_bins].count(0) < prof.num_bins
+               for r in range(len(prof.stage_names) + 1)) or not prof.steps:
+        print("FAIL: profiler didn't see every stage")
+        failed += 1
+    if '/s ' not in ' '.join(profiled.display.shown):
+        print("FAIL: profiler summary not on display")
+        failed += 1
+
+    grid = run(seconds, grid=True)
+    hits, worst, _ = step_spread(grid)
+    seq = grid.globals['sequence']
+    bitmap = grid.display.root_group[2][0].bitmap  # gridscreen's grid_group's TileGrid
+    playhead = (grid.globals['seq_pos'] - 1) % seq.num_steps
+    wrong = [s for s in range(seq.num_steps)
+             if any(bitmap[p * 2, s] != seq.get(p, s) for p in range(8))
+             or bitmap[16, s] != (s == playhead)]
+    clashes = refresh_clashes(grid)
+    print("grid view: worst lateness %d us, %d steps missed, %d refreshes, %d while a step was due,"
+          " %d wrong rows" % (worst, grid.globals['sched'].missed, len(grid.display.refresh_times),
+                              len(clashes), len(wrong)))
+    if worst > late_us or grid.globals['sched'].missed or clashes:
+        print("FAIL: late or missed steps in grid view")
+        failed += 1
+    if wrong or seq.hits == make_demo(seq).hits:
+        print("FAIL: grid doesn't show the recorded pattern at steps %s" % wrong)
+        failed += 1
+
+    print(sim.summary())
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
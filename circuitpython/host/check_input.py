@@ -0,0 +1,137 @@
+# check_input.py -- checks of the drum machine's input event queue, on the host emulator
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs the unmodified ../drum_machine/code.py on the emu/ host emulator,
+# recording, and presses three pads together while the main loop is
+# stalled loading a drum kit (turning to a kit that isn't cached, on slow
+# flash), and
+# checks that (see drum_input.py):
+#  - all three are handled in the same loop, not one per loop
+#  - they're recorded on the step nearest when they were pressed, not the
+#    step nearest when the stalled loop got around to them
+#  - MIDI note-ons arriving together on the UART and USB both play, the
+#    UART one (slower to arrive) at most one loop after the USB one
+#  - a note-on & off of a note with no pad in the General MIDI note map are
+#    dropped by the UART's parser, never getting to the app
+# all again with the sequencer's clock started past 2^31 us (36 minutes
+# up), more than a 32 bit 'l' array holds on the RP2040.
+# Exits non-zero if any check fails.
+#
+# Usage:
+#   python3 check_input.py
+#
+
+import os, sys, shutil, tempfile
+
+import emu
+from check_emu import watch_pads
+
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine')
+turn_ms = 1000  # turn to a kit that isn't cached, the loop stalls loading it...
+slow_open_us = 10000  # ...from slow flash, longer than half a step
+press_ms = 1050  # pads pressed during that
+pad_keys = (1, 4, 7)  # keys of pads 4, 5, 6, nothing in the demo pattern on them
+note_ms = 2333  # MIDI note-ons on both ports, between steps
+unmapped_ms = 2600  # note 56 (GM cowbell), no pad has it
+uptime_us = 1 << 31  # sequencer clock time at startup, for the second run
+
+
+def run(seconds=3, uptime_us=0):
+    sim = emu.Sim(seconds=seconds, costs={'file.open': slow_open_us}, quiet=True)
+    sim.tap(500, 2)  # PLAY
+    sim.encoder_switch(600, True)  # encoder to kit mode
+    sim.encoder_switch(650, False)
+    sim.tap(700, 5)  # RECORD
+    sim.turn(turn_ms, 2)  # kit 2, only kit 1 is prefetched
+    for k in pad_keys:
+        sim.tap(press_ms, k, 30)
+    sim.midi(note_ms, b'\x90\x26\x7f')  # note 38 (GM snare) -> pad 1, on the UART
+    sim.midi(note_ms, b'\x90\x2e\x7f', port='usb')  # note 46 (GM open hi-hat) -> pad 3
+    sim.midi(unmapped_ms, b'\x99\x38\x7f')
+    sim.midi(unmapped_ms + 30, b'\x89\x38\x00')
+    # which loop each voice play is in: the encoder is read once a loop
+    loops = []
+    def count_loops(now_us):
+        if sim.mixers and len(sim.mixer.events) > len(loops):
+            loops.extend([sim.calls.get('encoder.position', 0)] * (len(sim.mixer.events) - len(loops)))
+    sim.background.append(count_loops)
+    watch_pads(sim)
+    if not uptime_us:
+        emu.run(app_dir, sim)
+        return sim, loops
+    tmpdir = tempfile.mkdtemp(prefix='emu_')
+    root = os.path.join(tmpdir, 'CIRCUITPY')
+    try:
+        shutil.copytree(app_dir, root, ignore=shutil.ignore_patterns('__pycache__', '*.pyc'))
+        path = os.path.join(root, 'drum_sched.py')
+        with open(path) as fp:
+            code = fp.read()
+        with open(path, 'w') as fp:  # MonotonicClock starts uptime_us in
+            fp.write(code.replace("self._t0 = time.monotonic_ns()",
+                                  "self._t0 = time.monotonic_ns() - %d" % (uptime_us * 1000), 1))
+        emu.run(app_dir, sim, root=root)
+    finally:
+        shutil.rmtree(tmpdir)
+    return sim, loops
+
+
+def main():
+    failed = 0
+    for uptime in (0, uptime_us):
+        if uptime:
+            print("sequencer clock started at %d us:" % uptime)
+        failed += check(*run(uptime_us=uptime))
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+def check(sim, loops):
+    """Returns the number of checks run() fails."""
+    failed = 0
+    if sim.error:
+        print("FAIL: drum machine raised an error")
+        return 1
+    g = sim.globals
+    sched, seq = g['sched'], g['sequence']
+    t0_us = sched.clock._t0 // 1000  # sim time of sched time 0
+    plays = [(t, sim.pads[i], loops[i]) for i, (t, _, kind, _) in enumerate(sim.mixer.events) if kind == 'play']
+
+    pad_plays = [(t, loop) for t, v, loop in plays if v in (4, 5, 6) and t >= press_ms * 1000][:3]
+    handled_us = pad_plays[0][0] - press_ms * 1000 if pad_plays else 0
+    num_loops = len(set(loop for _, loop in pad_plays))
+    pressed_step = sched.nearest_step(press_ms * 1000 - t0_us) % seq.num_steps
+    handled_step = sched.nearest_step(pad_plays[0][0] - t0_us) % seq.num_steps if pad_plays else -1
+    recorded = [s for s in range(seq.num_steps) if any(seq.get(p, s) for p in (4, 5, 6))]
+    print("pads pressed in a %d ms stall: played in %d loop(s), recorded at steps %s,"
+          " pressed at step %d, handled nearest step %d" % (
+              handled_us // 1000, num_loops, recorded, pressed_step, handled_step))
+    if len(pad_plays) < 3 or num_loops != 1:
+        print("FAIL: pads pressed together weren't handled in the same loop")
+        failed += 1
+    if recorded != [pressed_step] or not all(seq.get(p, pressed_step) for p in (4, 5, 6)):
+        print("FAIL: pads not recorded on the step they were pressed at")
+        failed += 1
+    if handled_step == pressed_step:
+        print("FAIL: loop didn't stall long enough to check recording times")
+        failed += 1
+
+    # the UART note takes 3 bytes at 31250 baud to come in, USB is all there at once
+    note_loops = dict((v, loop) for t, v, loop in plays if v in (1, 3) and t >= note_ms * 1000)
+    apart = note_loops[1] - note_loops[3] if len(note_loops) == 2 else -1
+    print("MIDI notes on UART & USB together: pads %s played, UART one %d loop(s) after USB" % (
+        sorted(note_loops), apart))
+    if not 0 <= apart <= 1:
+        print("FAIL: UART & USB notes not both played promptly")
+        failed += 1
+
+    filtered = g['midi_uart_in'].filtered
+    print("MIDI note with no pad: %d message(s) dropped by the parser" % filtered)
+    if filtered != 2:
+        print("FAIL: unmapped note-on & off not filtered")
+        failed += 1
+    return failed
+
+
+if __name__ == '__main__':
+    main()
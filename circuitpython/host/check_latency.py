@@ -0,0 +1,188 @@
+# check_latency.py -- pad press & MIDI note-on to sound times, on the host emulator
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs ../drum_machine/code.py on the emu/ host emulator with profiling on
+# (so its drum_prof.LatencyMeters are measuring too), presses pads and
+# sends MIDI note-ons on the UART at random times, while just playing, in
+# the step grid view and while switching kits.  From the emulator's log
+# it times each press (or the note-on's last byte coming in) to its
+# voice.play() and to the sound starting (the emulated mixer's buffers),
+# and compares with what the app measured itself.  The app can only time
+# MIDI from when it read the port, so its MIDI times are a bit shorter.
+#
+# Then the same for ../remixer/code.py, with its measure_latency turned
+# on in the emulator's copy, where a key or note-on fades its voice up.
+#
+# Exits non-zero if the p99 time to play() is over max_p99_us for the run
+# (remixer: remix_max_p99_us), or the apps' own meters missed events or
+# disagree with the emulator.  Run it before & after changing a main loop.
+#
+# Usage:
+#   python3 check_latency.py [seconds]
+#
+
+import os, sys, random, shutil, tempfile
+
+import emu
+from check_emu import watch_pads
+from check_midi_clock import stats
+
+host_dir = os.path.dirname(os.path.abspath(__file__))
+drum_dir = os.path.join(host_dir, '..', 'drum_machine')
+remix_dir = os.path.join(host_dir, '..', 'remixer')
+max_p99_us = {'play': 5000, 'grid': 5000, 'kits': 8000}  # drum machine, to play(), loading a kit stalls
+remix_max_p99_us = 60000  # remixer fades voices every 50 ms
+agree_us = 1000  # app's mean vs emulator's, keypad timestamps are whole ms
+pad_keys = (1, 4, 7)  # keys of pads 4, 5, 6, nothing in the demo pattern on them
+pad_notes = (39, 45, 51)  # General MIDI notes of pads 4, 5, 6: clap, tom, ride
+midi_bytes_us = 3 * 320  # a note-on's 3 bytes at 31250 baud
+
+
+def inputs(sim, seconds, seed, keys, notes, hold_ms=30, gap_ms=(60, 160)):
+    """Random key taps & note-ons from 1 s on, never together.
+    Returns [(t_us, 'key'|'midi', voice)]."""
+    rand = random.Random(seed)
+    events = []
+    t = 1000
+    while t < seconds * 1000 - 300:
+        i = rand.randrange(len(keys))
+        if rand.random() < 0.5:
+            sim.tap(t, keys[i][0], hold_ms)
+            events.append((t * 1000, 'key', keys[i][1]))
+        else:
+            note = notes[i]
+            sim.midi(t, bytes((0x90, note[0], 0x7f)))
+            sim.midi(t + hold_ms, bytes((0x80, note[0], 0)))
+            events.append((t * 1000 + midi_bytes_us, 'midi', note[1]))
+        t += rand.randint(*gap_ms)
+    return events
+
+
+def sound_times(sim, events, fades=False):
+    """(event t_us, kind, t_us of its voice's next play() (or level going up, if fades), when that's heard)"""
+    if fades:
+        log, levels = [], {}
+        for t, v, k, arg in sim.mixer.events:
+            if k == 'level':
+                if arg > levels.get(v, 0):
+                    log.append((t, v))
+                levels[v] = arg
+    else:  # drum machine, voice is the pad
+        log = [(t, sim.pads[i]) for i, (t, _, k, _) in enumerate(sim.mixer.events) if k == 'play']
+    out = []
+    for t_us, src, voice in events:
+        t = next((t for t, v in log if t >= t_us and v == voice), None)
+        if t is not None:
+            out.append((t_us, src, t, sim.mixer.heard_us(t)))
+    return out
+
+
+def report(app, profile, src, times, app_meter=None, limit_us=0):
+    """Print a line of stats, returns 1 if it fails a check."""
+    failed = 0
+    to_play = [t - t_us for t_us, s, t, _ in times if s == src]
+    to_sound = [h - t_us for t_us, s, _, h in times if s == src and h is not None]
+    if not to_play:
+        print("FAIL: %s %s: no %s events played" % (app, profile, src))
+        return 1
+    mean, _, lo, hi, p99 = stats(to_play)
+    smean, _, _, _, sp99 = stats(to_sound)
+    line = "%-7s %-6s %-4s %5d %7d %7d %7d %7d %8d %7d" % (
+        app, profile, src, len(to_play), lo, mean, p99, hi, smean, sp99)
+    if app_meter:
+        count, app_mean, app_p99 = app_meter
+        line += " %6d %7d %7d" % (count, app_mean, app_p99)
+    print(line)
+    if p99 > limit_us:
+        print("FAIL: %s %s p99 over %d us" % (app, profile, limit_us))
+        failed += 1
+    if app_meter and app_meter[0] != len(to_play):
+        print("FAIL: app measured %d, emulator saw %d" % (app_meter[0], len(to_play)))
+        failed += 1
+    if app_meter and src == 'key' and abs(app_meter[1] - mean) > agree_us:
+        print("FAIL: app's mean is off by more than %d us" % agree_us)
+        failed += 1
+    return failed
+
+
+def run_drum(profile, seconds, seed=1):
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    sim.serial(100, 'p')  # profiling on
+    sim.tap(500, 2)  # PLAY
+    if profile == 'grid':  # hold encoder & press MUTE
+        sim.encoder_switch(600, True)
+        sim.tap(1200, 8)
+        sim.encoder_switch(1300, False)
+    elif profile == 'kits':
+        sim.encoder_switch(600, True)  # encoder to kit mode
+        sim.encoder_switch(650, False)
+        for t in range(1500, int(seconds * 1000) - 500, 700):
+            sim.turn(t + 33, 1)
+    keys = [(k, 4 + i) for i, k in enumerate(pad_keys)]
+    notes = [(n, 4 + i) for i, n in enumerate(pad_notes)]
+    events = inputs(sim, seconds, seed, keys, notes)
+    watch_pads(sim)
+    emu.run(drum_dir, sim)
+    return sim, events
+
+
+def run_remix(seconds, seed=1):
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    keys = [(k, k) for k in range(12)]
+    notes = [(60 + k, k) for k in range(12)]  # note % 12 is the key
+    events = inputs(sim, seconds, seed, keys, notes, hold_ms=120, gap_ms=(150, 300))
+    tmpdir = tempfile.mkdtemp(prefix='emu_')
+    root = os.path.join(tmpdir, 'CIRCUITPY')
+    try:
+        shutil.copytree(remix_dir, root, ignore=shutil.ignore_patterns('__pycache__', '*.pyc'))
+        path = os.path.join(root, 'code.py')
+        with open(path) as fp:
+            code = fp.read()
+        with open(path, 'w') as fp:
+            fp.write(code.replace("measure_latency = False", "measure_latency = True", 1))
+        emu.run(remix_dir, sim, root=root)
+    finally:
+        shutil.rmtree(tmpdir)
+    return sim, events
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 8
+    failed = 0
+    print("%-7s %-6s %-4s %5s %7s %7s %7s %7s %8s %7s %6s %7s %7s" % (
+        "app", "run", "in", "count", "min", "mean", "p99", "max", "snd mean", "snd p99",
+        "app n", "mean", "p99"))
+    print("%-7s %-6s %-4s %5s %31s %16s %22s" % ("", "", "", "", "to play() us", "to sound us", "app measured us"))
+    for profile in ('play', 'grid', 'kits'):
+        sim, events = run_drum(profile, seconds)
+        if sim.error:
+            print("FAIL: drum machine raised an error")
+            sys.exit(1)
+        times = sound_times(sim, events)
+        g = sim.globals
+        for src, meter in (('key', g['pad_lat']), ('midi', g['midi_lat'])):
+            failed += report('drum', profile, src, times,
+                             (meter.count, meter.mean(), meter.percentile(99)), max_p99_us[profile])
+
+    sim, events = run_remix(seconds)
+    if sim.error:
+        print("FAIL: remixer raised an error")
+        sys.exit(1)
+    times = sound_times(sim, events, fades=True)
+    for src in ('key', 'midi'):
+        failed += report('remixer', 'fades', src, times, limit_us=remix_max_p99_us)
+    lat = sim.globals['lat_stats']  # count, total, min, max ms
+    app_mean = lat[1] * 1000 // lat[0] if lat[0] else 0
+    mean = stats([t - t_us for t_us, _, t, _ in times])[0]
+    print("remixer measured %d, mean %d us" % (lat[0], app_mean))
+    if lat[0] != len(times) or abs(app_mean - mean) > 2 * agree_us:
+        print("FAIL: remixer measured %d, emulator saw %d, mean %d us" % (lat[0], len(times), mean))
+        failed += 1
+
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
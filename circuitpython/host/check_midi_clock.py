@@ -0,0 +1,218 @@
+# check_midi_clock.py -- host-side check of following external MIDI clock
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Feeds a 24 PPQN MIDI clock, with arrival jitter and main-loop polling,
+# to drum_clock.MidiClockFollower driving drum_sched.StepScheduler on a
+# virtual clock, and reports the phase error of every step (when the step
+# was scheduled ("due") and fired ("pll") minus when the sending clock's
+# step really was).  Firing can't be closer than the main loop time, the
+# schedule should be much closer.  Compares with firing steps straight
+# off raw tick arrivals ("raw").  Scenarios: steady tempos,
+# a tempo ramp, and a Song Position Pointer seek.
+#
+# Then runs the unmodified drum machine code.py on the emu/ host emulator
+# with a 300 BPM clock stream into the MIDI jack, and checks that the
+# sequencer's hits stay locked to it with no late or missed steps.  And
+# with PLAY pressed on its own tempo, then a clock with no START (as a DAW
+# sends while it's stopped), that it keeps playing and locks to the clock.
+#
+# Exits non-zero if any check fails.
+#
+# Usage:
+#   python3 check_midi_clock.py
+#
+
+import os, sys, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_sched import StepScheduler, VirtualClock
+from drum_clock import MidiClockFollower
+
+import emu
+
+steps_per_beat = 4
+tps = 24 // steps_per_beat  # clock ticks per step
+jitter_us = 1500  # tick arrival jitter (UART/USB buffering)
+loop_us = (300, 1500)  # main loop iteration time
+max_due_us = 1500  # spread of scheduled step times allowed once locked
+max_fire_us = loop_us[1] + 1000  # spread of fired steps, can't beat loop time
+app_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine')
+
+
+def stats(errs):
+    errs = sorted(errs)
+    n = len(errs)
+    mean = sum(errs) / n
+    sd = (sum((e - mean) ** 2 for e in errs) / n) ** 0.5
+    return mean, sd, errs[0], errs[-1], errs[int(n * 0.99) - 1] if n > 1 else errs[0]
+
+
+def clock_times(bpm_at, seconds):
+    """True times of clock ticks for tempo function bpm_at(t_us)."""
+    t, times = 1000000.0, []
+    while t < seconds * 1000000:
+        times.append(int(t))
+        t += 60000000 / (bpm_at(t) * 24)
+    return times
+
+
+def run(bpm_at, seconds, seed=1, seek=None):
+    """Returns (PLL step errors, PLL scheduled step errors, raw step errors, missed
+    steps) after locking.
+    seek=(tick index, song position) sends STOP, SPP & CONTINUE instead of that tick."""
+    rand = random.Random(seed)
+    ticks = clock_times(bpm_at, seconds)
+    arrivals = [t + rand.randint(0, jitter_us) for t in ticks]
+    clock = VirtualClock()
+    sched = StepScheduler(clock, bpm=120, steps_per_beat=steps_per_beat)
+    follower = MidiClockFollower(steps_per_beat)
+    follower.start()
+    playing = False
+    true_step_us = {}  # absolute step -> true time of its first tick
+    after_seek = {}  # same, for ticks after the seek
+    for i, t in enumerate(ticks):
+        if seek and i >= seek[0]:
+            pos_i, steps = seek[1] * 6 + (i - seek[0]), after_seek
+        else:
+            pos_i, steps = i, true_step_us
+        if pos_i % tps == 0:
+            steps[pos_i // tps] = t
+    pll_errs, due_errs, raw_errs = [], [], []
+    i = 0
+    while i < len(ticks):
+        clock.advance(rand.randint(*loop_us))
+        now = clock.now_us()
+        while i < len(ticks) and arrivals[i] <= now:
+            if seek and i == seek[0]:
+                follower.stop()
+                follower.song_position(seek[1])
+                follower.cont()
+                playing = False
+                true_step_us = after_seek
+            if follower.tick(now):
+                step, due, _, _ = follower.timing()
+                sched.start(due, step)
+                playing = True
+            if follower.locked:
+                sched.follow(*follower.timing())
+            pos = follower.next_tick - 1
+            if pos % tps == 0 and follower.count > 48:  # raw: step fires as its tick is seen
+                raw_errs.append(now - true_step_us[pos // tps])
+            i += 1
+        step = sched.poll(now)
+        if step >= 0 and playing and follower.count > 48 and step in true_step_us:
+            pll_errs.append(now - true_step_us[step])
+            due_errs.append(sched.step_time(step) - true_step_us[step])
+    return pll_errs, due_errs, raw_errs, sched.missed
+
+
+def check_scenarios():
+    failed = 0
+    scenarios = [
+        ("120 bpm", lambda t: 120, 30, None),
+        ("300 bpm", lambda t: 300, 30, None),
+        ("60 bpm", lambda t: 60, 40, None),
+        ("ramp 120-140", lambda t: 120 + 20 * min(t / 20e6, 1), 40, None),
+        ("120 bpm, SPP seek", lambda t: 120, 30, (1000, 64)),
+    ]
+    print("%-18s %-4s %7s %7s %7s %7s %7s  (phase error us, after lock)" % (
+        "scenario", "", "mean", "jitter", "min", "max", "p99"))
+    for name, bpm_at, seconds, seek in scenarios:
+        pll, due, raw, missed = run(bpm_at, seconds, seek=seek)
+        for kind, errs in (("due", due), ("pll", pll), ("raw", raw)):
+            print("%-18s %-4s %7d %7d %7d %7d %7d" % ((name, kind) + tuple(int(v) for v in stats(errs))))
+        due_spread = stats(due)[3] - stats(due)[2]
+        mean, sd, lo, hi, p99 = stats(pll)
+        if due_spread > max_due_us or hi - lo > max_fire_us or missed:
+            print("FAIL: %s: phase error spread %d us scheduled, %d us fired, %d missed" % (
+                name, due_spread, hi - lo, missed))
+            failed += 1
+        if stats(due)[1] * 2 >= stats(raw)[1]:
+            print("FAIL: %s: not much less jitter than raw ticks" % name)
+            failed += 1
+    return failed
+
+
+def check_emu(bpm=300, seconds=5):
+    """Drum machine code.py following a clock stream on the emulator."""
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    tick_us = 60000000 / (bpm * 24)
+    start_ms = 500
+    sim.midi(start_ms - 1, b'\xfa')  # START
+    t = start_ms * 1000
+    ticks = []
+    while t < seconds * 1000000:
+        sim.midi(t / 1000, b'\xf8')
+        ticks.append(t + 320)  # arrived when its byte is all in
+        t += tick_us
+    emu.run(app_dir, sim)
+    if sim.error:
+        print("FAIL: drum machine raised an error")
+        return 1
+    sched = sim.globals['sched']
+    plays = sorted(set(t for t, v, kind, _ in sim.mixer.events if kind == 'play'))
+    # each hit's error from the true time of its step's tick, after a beat to lock
+    errs = []
+    for t in plays:
+        k = round((t - ticks[0]) / (tick_us * tps))
+        if k >= 8:
+            errs.append(t - ticks[k * tps])
+    mean, sd, lo, hi, p99 = stats(errs)
+    print("emu code.py, %d bpm clock: %d hits, phase error mean %d jitter %d min %d max %d us,"
+          " %d missed, bpm shown %s" % (bpm, len(errs), mean, sd, lo, hi, sched.missed,
+                                         sim.globals['bpm']))
+    if hi - lo > max_fire_us or sched.missed or sim.globals['bpm'] != bpm:
+        print("FAIL: code.py not locked to clock")
+        return 1
+    return 0
+
+
+def check_emu_join(bpm=100, seconds=12, play_ms=500, clock_ms=6000):
+    """code.py playing on its own tempo when a clock comes in without a START."""
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    sim.tap(play_ms, 2)  # PLAY
+    tick_us = 60000000 / (bpm * 24)
+    t = clock_ms * 1000
+    ticks = []
+    while t < seconds * 1000000:
+        sim.midi(t / 1000, b'\xf8')
+        ticks.append(t + 320)
+        t += tick_us
+    emu.run(app_dir, sim)
+    if sim.error:
+        print("FAIL: drum machine raised an error")
+        return 1
+    sched = sim.globals['sched']
+    plays = sorted(set(t for t, v, kind, _ in sim.mixer.events if kind == 'play'))
+    # each hit's error from its nearest tick, after a couple of beats to lock: the
+    # steps are renumbered onto the clock's ticks, so any tick, but always the same
+    # one of each step's
+    errs, phases = [], set()
+    for t in plays:
+        if t >= clock_ms * 1000 + 2 * 24 * tick_us:
+            k = round((t - ticks[0]) / tick_us)
+            errs.append(t - ticks[k])
+            phases.add(k % tps)
+    last = plays[-1] if plays else 0
+    mean, sd, lo, hi, p99 = stats(errs) if errs else (0, 0, 0, 0, 0)
+    print("emu code.py, PLAY then %d bpm clock without START: %d hits after lock, last at %.2f s,"
+          " phase error mean %d jitter %d min %d max %d us, %d tick phases, %d missed, bpm shown %s" % (
+              bpm, len(errs), last / 1e6, mean, sd, lo, hi, len(phases), sched.missed, sim.globals['bpm']))
+    if (not errs or last < (seconds - 1) * 1000000 or hi - lo > max_fire_us or len(phases) != 1
+            or sched.missed or sim.globals['bpm'] != bpm):
+        print("FAIL: code.py didn't keep playing locked to a clock that came in while playing")
+        return 1
+    return 0
+
+
+def main():
+    failed = check_scenarios()
+    failed += check_emu()
+    failed += check_emu_join()
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
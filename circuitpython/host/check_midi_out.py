@@ -0,0 +1,303 @@
+# check_midi_out.py -- checks of the drum machine's MIDI out: step notes, clock, thru & the transmit ring
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# First drum_midiout.MidiOut on its own, on a virtual clock, with a USB
+# port and a UART port that drains at 31250 baud:
+#  - a step of all 8 pads goes to USB in one write, and to the UART a FIFO
+#    at a time, never more than the FIFO has room for, in order
+#  - a full ring drops messages (counted) instead of waiting
+#  - clock ticks go out 24 a beat, on the scheduler's grid, through a tempo change
+#  - soft thru sends messages on as they came in, not sysex
+# Then ../drum_machine/code.py on the emu/ host emulator, with MIDI out on
+# both USB & the UART (so the built-in speaker for audio), clock & thru on:
+#  - every sequencer hit's General MIDI note goes out within max_late_us of
+#    the pad playing, each step's notes in one write, ended at the next step
+#  - no notes are left on after STOP
+#  - the clock has START & STOP around it, and each tick goes out within
+#    max_clock_us of its time on the step grid (after it, it's polled)
+#  - a note-on into the MIDI jack comes back out on USB & the UART
+# And code_async.py's sequence going out USB too.
+# Exits non-zero if any check fails.
+#
+# Usage:
+#   python3 check_midi_out.py [seconds]
+#
+
+import os, sys, shutil, tempfile
+
+host_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(host_dir, '..', 'drum_machine')
+sys.path.insert(0, app_dir)
+from drum_sched import StepScheduler, VirtualClock
+from drum_midiout import MidiOut
+from drum_notes import GM_NOTES
+
+import emu
+from check_emu import watch_pads, pad_plays
+from check_midi_clock import stats
+
+uart_byte_us = 320  # 31250 baud
+uart_fifo = 32
+max_late_us = 1500  # pad play() to its note-on going out (before, or after)
+max_clock_us = 3500  # clock ticks after their time on the step grid: a main loop, with an LED update
+play_ms, thru_ms = 500, 3333
+thru_note = b'\x90\x2d\x7f'  # GM low tom, into the MIDI jack
+
+
+class StubPort:
+    """Records writes, and whether one was more than a FIFO draining at byte_us had room for."""
+    def __init__(self, clock, fifo=64, byte_us=0):
+        self.clock = clock
+        self.fifo = fifo
+        self.byte_us = byte_us
+        self.writes = []  # (t_us, bytes)
+        self.overfilled = 0
+        self._done_us = 0  # when what's in the FIFO has all gone out
+
+    def write(self, buf):
+        now = self.clock.now_us()
+        if self.byte_us:
+            in_fifo = max(self._done_us - now, 0) // self.byte_us
+            if in_fifo + len(buf) > self.fifo:
+                self.overfilled += 1
+            self._done_us = max(self._done_us, now) + len(buf) * self.byte_us
+        self.writes.append((now, bytes(buf)))
+        return len(buf)
+
+    def data(self):
+        return b''.join(b for _, b in self.writes)
+
+
+class StubMessage:
+    def __init__(self, mtype, channel=None, data=b''):
+        self.type = mtype
+        self.channel = channel
+        self.data = bytearray(data) + bytearray(2)
+
+
+def make_out(clock):
+    sched = StepScheduler(clock, bpm=120, steps_per_beat=4)
+    sched.start()
+    out = MidiOut(sched, 8, channel=10)
+    usb = StubPort(clock)
+    uart = StubPort(clock, uart_fifo, uart_byte_us)
+    out.add_port(usb)
+    out.add_port(uart, fifo=uart_fifo, byte_us=uart_byte_us)
+    out.set_notes([n[0] for n in GM_NOTES])
+    return sched, out, usb, uart
+
+
+def check_ring():
+    failed = 0
+    clock = VirtualClock()
+    sched, out, usb, uart = make_out(clock)
+    mute = [0] * 8
+    for step in range(2):  # all pads on, then their note-offs & on again
+        out.prepare(step, 0xff, 100, mute)
+        out.step(step, 0xff, 100, mute)
+        for _ in range(30):
+            clock.advance(1000)
+            out.poll()
+    want = bytes(b for n in GM_NOTES for b in (0x99, n[0], 100))
+    want += bytes(b for n in GM_NOTES for b in (0x99, n[0], 0)) + want
+    print("ring: 2 steps of 8 pads, usb %d write(s), uart %d writes, %d overfilled, %d bytes queued" % (
+        len(usb.writes), len(uart.writes), uart.overfilled, out.count))
+    if usb.data() != want or len(usb.writes) != 2:
+        print("FAIL: USB didn't get the steps' notes in as few writes")
+        failed += 1
+    if uart.data() != want or uart.overfilled or out.count:
+        print("FAIL: UART didn't get the same bytes, a FIFO at a time")
+        failed += 1
+
+    clock = VirtualClock()
+    sched, out, usb, uart = make_out(clock)
+    puts = sum(out.put(3, 0x99, 36, 100) for _ in range(200))  # nothing flushed
+    print("ring full: %d of 200 note-ons queued, %d dropped" % (puts, out.dropped))
+    if puts + out.dropped != 200 or out.count >= out.size or not out.dropped:
+        print("FAIL: full ring didn't drop & count")
+        failed += 1
+    return failed
+
+
+def check_clock():
+    failed = 0
+    clock = VirtualClock(1000)
+    sched, out, usb, uart = make_out(clock)
+    sched.start()
+    out.start(0, clock=True)
+    for _ in range(4000):  # 2 s at 120 BPM, then 2 s at 150
+        if clock.now_us() == 2001000:
+            sched.poll(clock.now_us())  # tempo changes from the next step
+            sched.set_bpm(150)
+        clock.advance(1000 if clock.now_us() % 3 else 1001)
+        while sched.poll(clock.now_us()) >= 0:
+            pass
+        out.poll()
+    out.stop()
+    ticks = [t for t, b in usb.writes for c in b if c == 0xF8]
+    first = [t - 1000 for t in ticks if t <= 2001000]
+    second = [t for t in ticks if t > 2001000]
+    errs = [t - k * 62500 // 3 for k, t in enumerate(first)]  # 120 BPM: 20833.3 us a clock
+    late = stats(errs)
+    print("clock: %d ticks at 120 BPM, %d at 150 BPM, late by %d-%d us, %s ... %s" % (
+        len(first), len(second), late[2], late[3], usb.data()[:1].hex(), usb.data()[-1:].hex()))
+    if len(first) != 96 or not 90 <= len(second) <= 105 or late[2] < 0 or late[3] > 1001:
+        print("FAIL: clock not 24 a beat on the step grid")
+        failed += 1
+    if usb.data()[:1] != b'\xfa' or usb.data()[-1:] != b'\xfc':
+        print("FAIL: clock not started & stopped")
+        failed += 1
+    return failed
+
+
+def check_thru():
+    clock = VirtualClock()
+    sched, out, usb, uart = make_out(clock)
+    msgs = [StubMessage(0x90, 2, b'\x24\x40'), StubMessage(0xC0, 0, b'\x05'), StubMessage(0xF8),
+            StubMessage(0xF2, None, b'\x10\x00'), StubMessage(0xF0), StubMessage(0xB0, 15, b'\x07\x7f')]
+    for m in msgs:
+        out.put_message(m)
+    out.flush()
+    want = bytes((0x92, 0x24, 0x40, 0xC0, 0x05, 0xF8, 0xF2, 0x10, 0x00, 0xBF, 0x07, 0x7f))
+    print("thru: %s" % usb.data().hex())
+    if usb.data() != want:
+        print("FAIL: thru didn't send messages on as they came, without sysex")
+        return 1
+    return 0
+
+
+def run(main, seconds, edits):
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    sim.tap(play_ms, 2)  # PLAY
+    sim.midi(thru_ms, thru_note)
+    sim.tap(int(seconds * 1000) - 300, 2)  # STOP
+    watch_pads(sim)
+    tmpdir = tempfile.mkdtemp(prefix='emu_')
+    root = os.path.join(tmpdir, 'CIRCUITPY')
+    try:
+        shutil.copytree(app_dir, root, ignore=shutil.ignore_patterns('__pycache__', '*.pyc'))
+        path = os.path.join(root, main)
+        with open(path) as fp:
+            code = fp.read()
+        for old, new in edits:
+            code = code.replace(old, new, 1)
+        with open(path, 'w') as fp:
+            fp.write(code)
+        emu.run(app_dir, sim, root=root, main=main)
+    finally:
+        shutil.rmtree(tmpdir)
+    return sim
+
+
+def note_events(sim, port):
+    """[(t_us, write number, note, vel)] of channel 10 note-ons sent out port, and the
+    times of thru note-ons (the thru note, on channel 1)."""
+    notes, thru = [], []
+    for i, (t, name, data) in enumerate(w for w in sim.midi_out if w[1] == port):
+        k = 0
+        while k < len(data):
+            b = data[k]
+            if b == 0x99:
+                notes.append((t, i, data[k + 1], data[k + 2]))
+            elif bytes(data[k:k + 3]) == thru_note:
+                thru.append(t)
+            k += 3 if b < 0xF0 or b == 0xF2 else 1
+    return notes, thru
+
+
+def check_emu_notes(sim, port, name):
+    failed = 0
+    notes, thru = note_events(sim, port)
+    thru_end_us = thru_ms * 1000 + 3 * uart_byte_us
+    plays = [(t, pad) for t, pad in pad_plays(sim)
+             if not (pad == 5 and thru_end_us <= t < thru_end_us + 5000)]  # the thru note played
+    ons = [(t, w, n) for t, w, n, v in notes if v]
+    offs = [(t, w, n) for t, w, n, v in notes if not v]
+    late, steps = [], {}
+    for t, pad in plays:
+        n = GM_NOTES[pad][0]
+        sent = min(((st, w) for st, w, nn in ons if nn == n), key=lambda sw: abs(sw[0] - t), default=None)
+        if sent is None:
+            continue
+        late.append(sent[0] - t)
+        steps.setdefault(t // 10000, set()).add(sent[1])
+    held = {}
+    for t, w, n, v in notes:
+        held[n] = held.get(n, 0) + (1 if v else -1)
+    stuck = [n for n, k in held.items() if k > 0]
+    split = [s for s in steps.values() if len(s) > 1]
+    mean, _, lo, hi, _ = stats(late) if late else (0, 0, 0, 0, 0)
+    print("%s %s: %d hits, %d note-ons, %d note-offs, play to note-on %d to %d us (mean %d), %d steps split,"
+          " %d stuck, thru %s" % (name, port, len(plays), len(ons), len(offs), lo, hi, mean, len(split),
+                                  len(stuck), "sent" if thru else "not sent"))
+    if len(late) != len(plays) or len(ons) != len(plays) or max(-lo, hi) > max_late_us:
+        print("FAIL: hits not all sent, or late")
+        failed += 1
+    if split:
+        print("FAIL: a step's notes took more than one write")
+        failed += 1
+    if stuck or len(offs) != len(ons):
+        print("FAIL: notes left on")
+        failed += 1
+    return failed, thru
+
+
+def check_emu_clock(sim):
+    data = [(t, c) for t, name, b in sim.midi_out if name == 'usb' for c in b if c >= 0xF8]
+    starts = [t for t, c in data if c == 0xFA]
+    stops = [t for t, c in data if c == 0xFC]
+    ticks = [t for t, c in data if c == 0xF8]
+    sched = sim.globals['sched']
+    t0 = sched.clock._t0 // 1000  # MonotonicClock counts from when it was made
+    # how late each tick went out, the first is left out: it's due the moment PLAY is pressed
+    late = [t - t0 - sched.tick_time(k, 6) for k, t in enumerate(ticks)][1:]
+    mean, _, lo, hi, p99 = stats(late)
+    expect = (stops[0] - starts[0]) / (sched.step_us() / 6) if starts and stops else 0
+    print("emu clock: START at %d ms, %d ticks (%d expected), late by %d-%d us (mean %d), STOP at %d ms" % (
+        starts[0] // 1000 if starts else -1, len(ticks), expect, lo, hi, mean, stops[0] // 1000 if stops else -1))
+    if len(starts) != 1 or len(stops) != 1 or abs(len(ticks) - expect) > 1 or lo < 0 or hi > max_clock_us:
+        print("FAIL: clock out not started, stopped, or on the grid")
+        return 1
+    return 0
+
+
+def check_emu_run(seconds):
+    failed = 0
+    sim = run('code.py', seconds, (("use_macrosynthplug = True", "use_macrosynthplug = False"),
+                                   ("midi_out_uart = False", "midi_out_uart = True"),
+                                   ("midi_out_clock = False", "midi_out_clock = True"),
+                                   ("midi_thru = False", "midi_thru = True")))
+    if sim.error:
+        print("FAIL: drum machine raised an error")
+        return 1
+    for port in ('usb', 'uart'):
+        f, thru = check_emu_notes(sim, port, 'emu')
+        failed += f
+        if not thru:
+            print("FAIL: thru note not sent out %s" % port)
+            failed += 1
+    usb = b''.join(b for _, name, b in sim.midi_out if name == 'usb')
+    uart = b''.join(b for _, name, b in sim.midi_out if name == 'uart')
+    if usb != uart:
+        print("FAIL: USB & UART were sent different bytes")
+        failed += 1
+    failed += check_emu_clock(sim)
+
+    sim = run('code_async.py', seconds, ())
+    if sim.error:
+        print("FAIL: async drum machine raised an error")
+        return failed + 1
+    f, _ = check_emu_notes(sim, 'usb', 'async')
+    return failed + f
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 6
+    failed = check_ring() + check_clock() + check_thru() + check_emu_run(seconds)
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
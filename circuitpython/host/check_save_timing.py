@@ -0,0 +1,84 @@
+# check_save_timing.py -- host-side check that saving patterns doesn't make steps late
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs the drum machine's step scheduler on a virtual clock while saving a
+# pattern bank, once with a blocking save (as the drum machine used to do)
+# and once with the chunked save_steps() as code.py now does it.
+# Every flash record write is modeled as taking record_us of loop time.
+# Counts steps that fired late (more than late_us) or were skipped.
+# Exits non-zero if the chunked save makes any step late.
+#
+# Usage:
+#   python3 check_save_timing.py [num_patterns] [record_us]
+#
+
+import os, sys, random, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+from drum_sched import StepScheduler, VirtualClock
+from drum_pattstore import Pattern
+from drum_bank import PatternBank
+
+late_us = 2000  # a step later than this is "late"
+loop_us = (200, 900)  # random main loop iteration time
+save_guard_us = 8000  # as in code.py
+
+
+def run(bpm, num_patterns, record_us, chunked, seed=1):
+    rand = random.Random(seed)
+    tmpdir = tempfile.mkdtemp()
+    bank = PatternBank(os.path.join(tmpdir, "saved_patterns.bin"))
+    patterns = [Pattern("p%d" % i, hits=bytes(rand.randrange(256) for _ in range(32)))
+                for i in range(num_patterns)]
+    clock = VirtualClock()
+    sched = StepScheduler(clock, bpm=bpm, steps_per_beat=4)
+    sched.start()
+    save_at_us = 1000000
+    save_job = None
+    saved = False
+    late = 0
+    steps = 0
+    while clock.now_us() < save_at_us + 30000000 and not (saved and steps > 200):
+        cost = rand.randint(*loop_us)
+        sched.ahead()
+        if sched.poll() >= 0:
+            steps += 1
+            if sched.late_us > late_us:
+                late += 1
+        if not saved and save_job is None and clock.now_us() >= save_at_us:
+            if chunked:
+                save_job = bank.save_steps(patterns)
+            else:
+                bank.save(patterns)  # blocks for the whole save
+                cost += bank.write_count * record_us
+                saved = True
+        # as save_patterns_work() in code.py
+        while save_job and sched.time_to_next() - cost > save_guard_us:
+            try:
+                next(save_job)
+                cost += record_us
+            except StopIteration:
+                save_job = None
+                saved = True
+        clock.advance(cost)
+    return steps, late, sched.missed, bank.num_records
+
+
+def main():
+    num_patterns = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    record_us = int(sys.argv[2]) if len(sys.argv) > 2 else 4000
+    print("saving %d patterns, %d us per record write" % (num_patterns, record_us))
+    print("%4s  %-8s %6s %6s %7s %8s" % ("bpm", "save", "steps", "late", "missed", "records"))
+    failed = False
+    for bpm in (60, 120, 200, 300):
+        for name, chunked in (("blocking", False), ("chunked", True)):
+            steps, late, missed, records = run(bpm, num_patterns, record_us, chunked)
+            print("%4d  %-8s %6d %6d %7d %8d" % (bpm, name, steps, late, missed, records))
+            if chunked and (late or missed or records != num_patterns):
+                failed = True
+    print("chunked save:", "FAILED, late steps" if failed else "ok, no late steps")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+# check_voices.py -- checks of the drum machine's voice allocator, choke groups & round-robin
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# First drum_voices.VoiceAlloc on its own, with stand-in mixer voices:
+#  - a pad's hits take turns on its round-robin voices
+#  - playing a pad stops the voices of the other pads in its choke group,
+#    and those are the first voices reused
+#  - with the pool full, the least recently played voice is stolen
+#  - play() runs the same number of lines however big the pool, whether it
+#    finds a free voice or steals one (choking adds a few per voice stopped)
+# Then the unmodified ../drum_machine/code.py on the emu/ host emulator,
+# stopped, so only the pads pressed play:
+#  - closed hi-hat cuts off open hi-hat (the default choke group)
+#  - a fast roll on a pad alternates its two voices, each hit rings until
+#    the one two hits later
+#  - with a kit.json with no choke groups in the kit, open hi-hat rings on
+# Exits non-zero if any check fails.
+#
+# Usage:
+#   python3 check_voices.py
+#
+
+import os, sys, shutil, tempfile, json
+
+host_dir = os.path.dirname(os.path.abspath(__file__))
+app_dir = os.path.join(host_dir, '..', 'drum_machine')
+sys.path.insert(0, app_dir)
+from drum_voices import VoiceAlloc
+
+import emu
+from check_emu import watch_pads
+
+num_pads = 8
+hats = (0, 0, 1, 1, 0, 0, 0, 0)  # code.py's default_choke
+hat_open_ms, hat_closed_ms = 1000, 1100  # taps, keys 9 & 6
+roll_ms = (1500, 1540, 1580)  # taps of pad 6, key 7
+
+
+class StubVoice:
+    def __init__(self):
+        self.stops = 0
+
+    def stop(self):
+        self.stops += 1
+
+
+def count_lines(func, *args):
+    """Lines of drum_voices.py func runs."""
+    lines = [0]
+    def tracer(frame, event, arg):
+        if frame.f_code.co_filename.endswith('drum_voices.py'):
+            if event == 'line':
+                lines[0] += 1
+            return tracer
+        return None
+    sys.settrace(tracer)
+    try:
+        func(*args)
+    finally:
+        sys.settrace(None)
+    return lines[0]
+
+
+def check_alloc():
+    failed = 0
+    voices = [StubVoice() for _ in range(12)]
+    alloc = VoiceAlloc(voices, num_pads, per_pad=2)
+    alloc.set_chokes(hats)
+
+    roll = [alloc.play(5) for _ in range(3)]
+    print("round-robin: pad 5 hit 3 times on voices %s" % roll)
+    if roll[0] == roll[1] or roll[2] != roll[0]:
+        print("FAIL: pad's hits don't take turns on two voices")
+        failed += 1
+
+    v_open = alloc.play(3)
+    stops = voices[v_open].stops
+    v_closed = alloc.play(2)
+    print("choke: open hat on voice %d, stopped by closed hat %d time(s), closed hat on voice %d" % (
+        v_open, voices[v_open].stops - stops, v_closed))
+    if voices[v_open].stops != stops + 1 or v_closed != v_open:
+        print("FAIL: closed hat didn't choke open hat, or its voice wasn't reused first")
+        failed += 1
+
+    alloc.stop_all()
+    alloc.set_chokes(None)
+    order = [alloc.play(p) for p in range(num_pads)] + [alloc.play(p) for p in range(4)]  # pool full
+    steals = alloc.steals
+    stolen = alloc.play(4)  # pad 4's second voice: the least recently played, pad 0's first
+    print("stealing: pool of %d full, pad 4 stole voice %d (pad 0's first), %d steals" % (
+        len(voices), stolen, alloc.steals))
+    if steals or stolen != order[0] or alloc.steals != 1 or alloc.pad_of(stolen) != 4:
+        print("FAIL: didn't steal the least recently played voice")
+        failed += 1
+    if alloc.play(0) == stolen:  # pad 0 forgot it, takes its other voice or a new one
+        print("FAIL: pad 0 still plays the voice stolen from it")
+        failed += 1
+
+    costs = []
+    for pool in (12, 48):
+        alloc = VoiceAlloc([StubVoice() for _ in range(pool)], num_pads, per_pad=2)
+        alloc.set_chokes(hats)
+        fresh = count_lines(alloc.play, 4)
+        for i in range(pool * 2):  # fill the pool, so the next play() steals
+            alloc.play(i % num_pads)
+        costs.append((fresh, count_lines(alloc.play, 4), count_lines(alloc.play, 3)))
+    print("play() lines, (free voice, stealing, choking) with pool 12: %s, pool 48: %s" % tuple(costs))
+    if costs[0][:2] != costs[1][:2] or max(costs[0] + costs[1]) > 60:
+        print("FAIL: play() cost depends on pool size")
+        failed += 1
+    return failed
+
+
+def run(kit_conf=None, seconds=2):
+    sim = emu.Sim(seconds=seconds, quiet=True)
+    sim.tap(hat_open_ms, 9)
+    sim.tap(hat_closed_ms, 6)
+    for t in roll_ms:
+        sim.tap(t, 7, 20)
+    watch_pads(sim)
+    tmpdir = tempfile.mkdtemp(prefix='emu_')
+    root = os.path.join(tmpdir, 'CIRCUITPY')
+    try:
+        shutil.copytree(app_dir, root, ignore=shutil.ignore_patterns('__pycache__', '*.pyc', 'kits_index.json'))
+        if kit_conf:
+            for kit in os.listdir(os.path.join(root, 'drumkits')):
+                with open(os.path.join(root, 'drumkits', kit, 'kit.json'), 'w') as fp:
+                    json.dump(kit_conf, fp)
+        emu.run(app_dir, sim, root=root)
+    finally:
+        shutil.rmtree(tmpdir)
+    return sim
+
+
+def voice_log(sim):
+    """[(t_us, voice, kind, pad)] of plays & stops."""
+    return [(t, v, kind, sim.pads[i]) for i, (t, v, kind, _) in enumerate(sim.mixer.events)
+            if kind in ('play', 'stop')]
+
+
+def open_hat_cut(sim):
+    """Voice open hat played on, and whether it was stopped when closed hat played."""
+    log = voice_log(sim)
+    v = next(v for t, v, kind, pad in log if kind == 'play' and pad == 3)
+    closed_us = next(t for t, _, kind, pad in log if kind == 'play' and pad == 2)
+    return v, any(kind == 'stop' and vv == v and t <= closed_us for t, vv, kind, _ in log
+                  if t >= hat_closed_ms * 1000)
+
+
+def check_emu_run():
+    failed = 0
+    sim = run()
+    if sim.error:
+        print("FAIL: drum machine raised an error")
+        return 1
+    v, cut = open_hat_cut(sim)
+    print("emu: open hat on voice %d, %s by closed hat" % (v, "cut off" if cut else "not cut off"))
+    if not cut:
+        print("FAIL: closed hat didn't choke open hat")
+        failed += 1
+
+    log = voice_log(sim)
+    roll = [v for t, v, kind, pad in log if kind == 'play' and pad == 6]
+    roll_stops = [v for t, v, kind, _ in log if kind == 'stop' and t >= roll_ms[0] * 1000 and v in roll]
+    print("emu: roll of 3 on pad 6 played on voices %s, %d stopped" % (roll, len(roll_stops)))
+    if len(roll) != 3 or roll[0] == roll[1] or roll[2] != roll[0] or roll_stops:
+        print("FAIL: roll didn't take turns on two voices")
+        failed += 1
+
+    sim = run(kit_conf={'choke': [0] * num_pads})
+    if sim.error:
+        print("FAIL: drum machine raised an error with a kit.json")
+        return failed + 1
+    v, cut = open_hat_cut(sim)
+    print("emu, kit.json with no choke groups: open hat %s" % ("cut off" if cut else "rings on"))
+    if cut:
+        print("FAIL: kit.json choke groups not used")
+        failed += 1
+    return failed
+
+
+def main():
+    failed = check_alloc() + check_emu_run()
+    if failed:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
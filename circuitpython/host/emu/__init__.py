@@ -0,0 +1,23 @@
+# emu -- headless host emulator for the MacroPadSynthPlug CircuitPython apps
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs an unmodified code.py on a computer, with stand-ins for board, busio,
+# keypad, rotaryio, neopixel, audiomixer, audiocore, audiopwmio, displayio,
+# usb_midi, asyncio and friends (see emu/fake/).  Time is virtual: it only
+# moves when the app touches the fake hardware or reads the clock, by the costs
+# in emu.sim.COSTS_US, so a run is deterministic and runs faster than
+# real time.  Key presses, encoder turns and MIDI bytes come from a script,
+# and LED frames, mixer voice events, display text and MIDI out are
+# captured on the Sim for inspection.
+#
+# Usage:
+#   import emu
+#   sim = emu.Sim(seconds=10)
+#   sim.key(500, 2, True); sim.key(550, 2, False)   # press PLAY at 0.5 s
+#   emu.run("../drum_machine", sim)
+#   print(sim.mixer.events[:10], len(sim.leds.frames))
+#
+# or from the command line with host/run_emu.py
+#
+
+from .sim import Sim, SimExit, COSTS_US, run, current, load_script
@@ -0,0 +1,38 @@
+# adafruit_display_text -- emu stand-in for the adafruit_display_text library
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Labels only keep their text & position, setting text costs 'label.text'
+# of main loop time since the real bitmap_label redraws its whole bitmap.
+
+from emu import sim as _sim
+import displayio
+
+class LabelBase:
+    def __init__(self, font=None, *, text="", color=0xFFFFFF, x=0, y=0, scale=1,
+                 anchor_point=None, anchored_position=None, **kwargs):
+        self.font = font
+        self.color = color
+        self.x = x
+        self.y = y
+        self.scale = scale
+        self.hidden = False
+        self.anchor_point = anchor_point
+        self.anchored_position = anchored_position
+        self._text = text
+
+    @property
+    def text(self):
+        return self._text
+
+    @text.setter
+    def text(self, new_text):
+        _sim.current().charge('label.text')
+        self._text = str(new_text)
+        displayio._changed()
+
+    @property
+    def bounding_box(self):
+        return (0, -6, 6 * len(self._text), 12)
+
+    def __repr__(self):
+        return "<Label %r at %d,%d>" % (self._text, self.x, self.y)
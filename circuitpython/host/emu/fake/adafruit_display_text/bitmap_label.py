@@ -0,0 +1,7 @@
+# bitmap_label.py -- emu stand-in for adafruit_display_text.bitmap_label
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from adafruit_display_text import LabelBase
+
+class Label(LabelBase):
+    pass
@@ -0,0 +1,7 @@
+# label.py -- emu stand-in for adafruit_display_text.label
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from adafruit_display_text import LabelBase
+
+class Label(LabelBase):
+    pass
@@ -0,0 +1,60 @@
+# adafruit_midi -- emu stand-in for the adafruit_midi library
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Only decodes NoteOn & NoteOff (what the apps use), other messages are skipped.
+
+from adafruit_midi.midi_message import MIDIMessage
+from adafruit_midi.note_on import NoteOn
+from adafruit_midi.note_off import NoteOff
+
+class MIDI:
+    def __init__(self, midi_in=None, midi_out=None, *, in_channel=None, out_channel=0,
+                 in_buf_size=30, debug=False):
+        self._midi_in = midi_in
+        self._midi_out = midi_out
+        self.in_channel = in_channel
+        self.out_channel = out_channel
+        self._in_buf_size = in_buf_size
+        self._in_buf = bytearray()
+        self._running_status = 0
+
+    def receive(self):
+        data = self._midi_in.read(self._in_buf_size)
+        if data:
+            self._in_buf.extend(data)
+        buf = self._in_buf
+        while buf:
+            status = buf[0]
+            if status >= 0xF8:  # realtime, skip
+                del buf[0]
+                continue
+            if status < 0x80:
+                if not self._running_status:  # data byte without status
+                    del buf[0]
+                    continue
+                status, start = self._running_status, 0
+            else:
+                start = 1
+            if status >= 0xF0:
+                self._running_status = 0
+                del buf[0]
+                continue
+            need = 1 if (status & 0xF0) in (0xC0, 0xD0) else 2
+            if len(buf) < start + need:
+                return None  # wait for rest of message
+            args = bytes(buf[start:start + need])
+            del buf[:start + need]
+            self._running_status = status
+            kind, channel = status & 0xF0, status & 0x0F
+            if self.in_channel is not None and channel != self.in_channel:
+                continue
+            if kind == 0x90:
+                return NoteOn(args[0], args[1], channel=channel)
+            if kind == 0x80:
+                return NoteOff(args[0], args[1], channel=channel)
+        return None
+
+    def send(self, msg, channel=None):
+        msgs = msg if isinstance(msg, (list, tuple)) else (msg,)
+        for m in msgs:
+            self._midi_out.write(m.to_bytes(self.out_channel if channel is None else channel))
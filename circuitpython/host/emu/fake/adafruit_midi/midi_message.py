@@ -0,0 +1,16 @@
+# midi_message.py -- emu stand-in for adafruit_midi.midi_message
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+class MIDIMessage:
+    _STATUS = 0
+
+    def __init__(self, *, channel=None):
+        self.channel = channel
+
+    def __bytes__(self):
+        return self.to_bytes(self.channel or 0)
+
+class MIDIUnknownEvent(MIDIMessage):
+    def __init__(self, status):
+        super().__init__()
+        self.status = status
@@ -0,0 +1,18 @@
+# note_off.py -- emu stand-in for adafruit_midi.note_off
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from adafruit_midi.midi_message import MIDIMessage
+
+class NoteOff(MIDIMessage):
+    _STATUS = 0x80
+
+    def __init__(self, note, velocity=0, *, channel=None):
+        super().__init__(channel=channel)
+        self.note = note
+        self.velocity = velocity
+
+    def to_bytes(self, channel):
+        return bytes((self._STATUS | (channel & 0x0F), self.note, self.velocity))
+
+    def __repr__(self):
+        return "NoteOff(note=%d, velocity=%d, channel=%r)" % (self.note, self.velocity, self.channel)
@@ -0,0 +1,178 @@
+# asyncio.py -- emu stand-in for CircuitPython's asyncio, on the Sim's virtual clock
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Works like CircuitPython's asyncio (MicroPython's uasyncio): a task runs
+# until it awaits, sleeping tasks wake in order of wake time, which is in
+# whole ticks_ms() milliseconds, and sleep(0) lets the other runnable
+# tasks go first.  Nothing preempts a running task.  When no task is
+# runnable the clock jumps to the next wake time.  Each task switch costs
+# 'asyncio.switch', the real one is Python code too.
+#
+# Just enough of it for the apps: run(), create_task(), gather(), sleep(),
+# sleep_ms(), Task.cancel() and Event.
+
+import heapq
+from emu import sim as _sim
+
+
+class CancelledError(BaseException):
+    pass
+
+
+class _Sleep:
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __await__(self):
+        yield self
+
+
+def sleep_ms(t):
+    return _Sleep(max(0, int(t)))
+
+
+def sleep(t):
+    return _Sleep(max(0, int(t * 1000)))
+
+
+class Task:
+    def __init__(self, coro):
+        self.coro = coro
+        self.done = False
+        self.result = None
+        self.waiting = []  # tasks awaiting this one
+        self._entry = None  # its entry in the run queue, if queued
+        self._throw = None  # exception to raise in it when it next runs
+
+    def __await__(self):
+        if not self.done:
+            yield self
+        return self.result
+
+    def cancel(self):
+        if self.done:
+            return False
+        if self is _loop.cur:
+            raise RuntimeError("can't cancel self")
+        self._throw = CancelledError()
+        _loop.push(self, _loop.sim.now_us)  # wakes now, from wherever it was waiting
+        return True
+
+
+class Event:
+    def __init__(self):
+        self.state = False
+        self._waiting = []
+
+    def is_set(self):
+        return self.state
+
+    def set(self):
+        self.state = True
+        for task in self._waiting:
+            _loop.push(task, _loop.sim.now_us)
+        self._waiting = []
+
+    def clear(self):
+        self.state = False
+
+    async def wait(self):
+        if not self.state:
+            await _Wait(self)
+        return True
+
+
+class _Wait:
+    def __init__(self, event):
+        self.event = event
+
+    def __await__(self):
+        yield self
+
+
+class _Loop:
+    def __init__(self):
+        self.sim = _sim.current()
+        self.queue = []  # heap of [wake_us, seq, task]
+        self.seq = 0
+        self.cur = None
+
+    def push(self, task, wake_us):
+        if task._entry:
+            task._entry[2] = None  # no longer valid
+        entry = [wake_us, self.seq, task]
+        self.seq += 1
+        task._entry = entry
+        heapq.heappush(self.queue, entry)
+
+    def run_until(self, main):
+        sim = self.sim
+        while not main.done:
+            if not self.queue:
+                raise RuntimeError("all tasks are waiting, nothing will wake them")
+            wake_us, _, task = heapq.heappop(self.queue)
+            if task is None:
+                continue
+            task._entry = None
+            if wake_us > sim.now_us:
+                sim.advance(wake_us - sim.now_us)
+            sim.charge('asyncio.switch')
+            self.cur = task
+            try:
+                if task._throw:
+                    exc, task._throw = task._throw, None
+                    waiting_on = task.coro.throw(exc)
+                else:
+                    waiting_on = task.coro.send(None)
+            except StopIteration as stop:
+                self.finish(task, stop.value)
+                continue
+            except CancelledError:
+                self.finish(task, None)
+                continue
+            finally:
+                self.cur = None
+            if isinstance(waiting_on, _Sleep):
+                # wakes on a whole tick, like ticks_add(ticks_ms(), ms)
+                self.push(task, (sim.now_us // 1000 + waiting_on.ms) * 1000 if waiting_on.ms else sim.now_us)
+            elif isinstance(waiting_on, Task):
+                waiting_on.waiting.append(task)
+            elif isinstance(waiting_on, _Wait):
+                waiting_on.event._waiting.append(task)
+            else:
+                raise RuntimeError("task awaited %r, not an asyncio awaitable" % (waiting_on,))
+        return main.result
+
+    def finish(self, task, result):
+        task.done = True
+        task.result = result
+        for t in task.waiting:
+            self.push(t, self.sim.now_us)
+        task.waiting = []
+
+
+_loop = None
+
+
+def create_task(coro):
+    task = Task(coro)
+    _loop.push(task, _loop.sim.now_us)
+    return task
+
+
+async def gather(*aws):
+    tasks = [aw if isinstance(aw, Task) else create_task(aw) for aw in aws]
+    results = []
+    for task in tasks:
+        results.append(await task)
+    return results
+
+
+def run(coro):
+    global _loop
+    _loop = _Loop()
+    return _loop.run_until(create_task(coro))
+
+
+def get_event_loop():
+    return _loop
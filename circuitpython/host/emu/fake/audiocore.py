@@ -0,0 +1,18 @@
+# audiocore.py -- emu stand-in for CircuitPython's audiocore
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+# The same RawSample / WaveFile as host/audio_shim.py, which emu.run() puts on sys.path.
+
+import audio_shim
+from audio_shim import RawSample
+from emu import sim as _sim
+
+class WaveFile(audio_shim.WaveFile):
+    """The real one reads the file a buffer at a time as it's mixed, in the
+    background, so reading it all up front isn't charged to the app."""
+    def __init__(self, file, buffer=None):
+        costs = _sim.current().costs
+        read_kb, costs['file.read_kb'] = costs['file.read_kb'], 0
+        try:
+            super().__init__(file, buffer)
+        finally:
+            costs['file.read_kb'] = read_kb
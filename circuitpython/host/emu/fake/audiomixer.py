@@ -0,0 +1,159 @@
+# audiomixer.py -- emu stand-in for CircuitPython's audiomixer, logs voice events
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Every play(), stop() and level change is kept in Mixer.events as
+# (t_us, voice number, 'play'|'stop'|'level', (sample, loop)|None|level),
+# and render() mixes the samples from that log into the audio the mixer
+# would have played.
+#
+# Buffers are double-buffered like the real one: buffer k plays from
+# t0 + k * buffer_us, and is mixed by the first background task run
+# after buffer k-1 starts playing.  If that run comes after buffer k was
+# due to start (the app was in a blocking call that long), it's an
+# underrun, kept in Mixer.underruns, and mixing picks up with the buffer
+# after the one playing then.  Mixer.fills has (t_us, start_us) of each
+# buffer mixed, and heard_us() is when a play() at some time is heard.
+
+import array, bisect, wave
+from emu import sim as _sim
+
+def _sample_data(sample):
+    return sample.samples if hasattr(sample, 'samples') else sample.buffer
+
+class MixerVoice:
+    def __init__(self, mixer, num):
+        self._mixer = mixer
+        self._num = num
+        self._level = 1.0
+        self._sample = None
+        self._loop = False
+        self._start_us = 0
+
+    def play(self, sample, *, loop=False):
+        sim = self._mixer._sim
+        sim.charge('voice.play')
+        self._sample, self._loop, self._start_us = sample, loop, sim.now_us
+        self._mixer.events.append((sim.now_us, self._num, 'play', (sample, loop)))
+
+    def stop(self):
+        sim = self._mixer._sim
+        sim.charge('voice.stop')
+        if self._sample is not None:
+            self._mixer.events.append((sim.now_us, self._num, 'stop', None))
+        self._sample = None
+
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self, value):
+        sim = self._mixer._sim
+        sim.charge('voice.level')
+        value = min(max(float(value), 0.0), 1.0)
+        if value != self._level:
+            self._mixer.events.append((sim.now_us, self._num, 'level', value))
+        self._level = value
+
+    @property
+    def playing(self):
+        if self._sample is None:
+            return False
+        if self._loop:
+            return True
+        s = self._sample
+        dur_us = len(_sample_data(s)) // s.channel_count * 1000000 // s.sample_rate
+        return self._mixer._sim.now_us - self._start_us < dur_us
+
+class Mixer:
+    def __init__(self, voice_count=2, buffer_size=1024, channel_count=2, bits_per_sample=16,
+                 samples_signed=True, sample_rate=8000):
+        self.voice_count = voice_count
+        self.buffer_size = buffer_size
+        self.channel_count = channel_count
+        self.bits_per_sample = bits_per_sample
+        self.samples_signed = samples_signed
+        self.sample_rate = sample_rate
+        self.events = []  # (t_us, voice, kind, arg)
+        self._sim = _sim.current()
+        self._sim.mixers.append(self)
+        self.voice = tuple(MixerVoice(self, i) for i in range(voice_count))
+        self.buffer_us = buffer_size // (bits_per_sample // 8 * channel_count) * 1000000 // sample_rate
+        self.fills = []  # (t_us mixed, t_us it starts playing)
+        self.underruns = []  # (t_us noticed, buffers lost)
+        self._t0 = self._sim.now_us
+        self._mixed = 0  # last buffer mixed, buffer 0 is silence
+        self._sim.background.append(self._background)
+
+    def _background(self, now_us):
+        playing = (now_us - self._t0) // self.buffer_us
+        if playing < self._mixed:
+            return
+        if playing > self._mixed:  # wasn't mixed before it was due
+            self.underruns.append((now_us, playing - self._mixed))
+        self._mixed = playing + 1
+        self.fills.append((now_us, self._t0 + self._mixed * self.buffer_us))
+
+    def heard_us(self, t_us):
+        """When something played at t_us starts being heard, None if not yet mixed.
+        A fill at t_us was before the play(), background tasks run as it's charged."""
+        i = bisect.bisect_right(self.fills, (t_us, float('inf')))
+        return self.fills[i][1] if i < len(self.fills) else None
+
+    def play(self, sample, *, voice=0, loop=False):
+        self.voice[voice].play(sample, loop=loop)
+
+    def stop_voice(self, voice=0):
+        self.voice[voice].stop()
+
+    @property
+    def playing(self):
+        return any(v.playing for v in self.voice)
+
+    def deinit(self):
+        if self._background in self._sim.background:
+            self._sim.background.remove(self._background)
+
+    def render(self, end_us=None):
+        """Mono signed 16-bit mix of everything played, up to end_us (default: now)."""
+        rate = self.sample_rate
+        end_us = self._sim.now_us if end_us is None else end_us
+        n = end_us * rate // 1000000
+        mix = [0.0] * n
+        for v in range(self.voice_count):
+            evs = [(t * rate // 1000000, kind, arg) for t, vn, kind, arg in self.events if vn == v]
+            evs.append((n, 'end', None))
+            data, pos, loop, level, i = None, 0, False, 1.0, 0
+            for t, kind, arg in evs:
+                t = min(t, n)
+                while data is not None and i < t:  # play current sample up to this event
+                    if pos >= len(data):
+                        if not loop:
+                            data = None
+                            break
+                        pos = 0
+                    k = min(t - i, len(data) - pos)
+                    for j in range(k):
+                        mix[i + j] += data[pos + j] * level
+                    i += k
+                    pos += k
+                i = t
+                if kind == 'play':
+                    sample, loop = arg
+                    data, pos = _sample_data(sample), 0
+                    if sample.sample_rate != rate:
+                        self._sim.warn("sample at %d Hz on %d Hz mixer" % (sample.sample_rate, rate))
+                elif kind == 'stop':
+                    data = None
+                elif kind == 'level':
+                    level = arg
+        return array.array('h', (min(max(int(s), -32768), 32767) for s in mix))
+
+    def write_wav(self, path, end_us=None):
+        samples = self.render(end_us)
+        with wave.open(path, 'wb') as w:
+            w.setnchannels(1)
+            w.setsampwidth(2)
+            w.setframerate(self.sample_rate)
+            w.writeframes(samples.tobytes())
+        return len(samples)
@@ -0,0 +1,30 @@
+# audiopwmio.py -- emu stand-in for CircuitPython's audiopwmio
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+class PWMAudioOut:
+    def __init__(self, left_channel, *, right_channel=None, quiescent_value=0x8000):
+        self.pin = left_channel
+        self.sample = None
+        self.loop = False
+        self.paused = False
+
+    def play(self, sample, *, loop=False):
+        self.sample = sample
+        self.loop = loop
+        self.paused = False
+
+    def stop(self):
+        self.sample = None
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+
+    @property
+    def playing(self):
+        return self.sample is not None
+
+    def deinit(self):
+        self.sample = None
@@ -0,0 +1,24 @@
+# board.py -- emu stand-in for the MacroPad RP2040's board module
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+import displayio
+
+class Pin:
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return "board." + self.name
+
+_PINS = ("KEY1 KEY2 KEY3 KEY4 KEY5 KEY6 KEY7 KEY8 KEY9 KEY10 KEY11 KEY12 "
+         "ENCODER_A ENCODER_B ENCODER_SWITCH NEOPIXEL SPEAKER SPEAKER_ENABLE "
+         "SDA SCL TX RX BUTTON LED "
+         "OLED_CS OLED_DC OLED_RESET SCK MOSI MISO").split()
+
+for _name in _PINS:
+    globals()[_name] = Pin(_name)
+del _name
+
+board_id = "adafruit_macropad_rp2040"
+
+DISPLAY = displayio.Display(128, 64)
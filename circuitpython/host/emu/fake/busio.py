@@ -0,0 +1,106 @@
+# busio.py -- emu stand-in for CircuitPython's busio.UART
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Bytes from the Sim's script arrive one every 320 us at 31250 baud from
+# when they were sent, even if the app was busy in a long call then, and
+# only as many as fit in the receive buffer are kept, as on the RP2040.
+# read() waits up to timeout for the bytes asked for, like the real one.
+
+from emu import sim as _sim
+
+class UART:
+    def __init__(self, tx=None, rx=None, *, baudrate=9600, bits=8, parity=None, stop=1,
+                 timeout=1, receiver_buffer_size=64, **kwargs):
+        self.tx = tx
+        self.rx = rx
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.receiver_buffer_size = receiver_buffer_size
+        self.overruns = 0  # bytes dropped because the buffer was full
+        self._rx = []  # (arrival time in us, byte)
+        self._byte_us = 10 * 1000000 // baudrate
+        self._sim = _sim.current()
+        self._sim.uarts.append(self)
+
+    def _receive(self, data):
+        t = max(self._sim.script_us, self._rx[-1][0] if self._rx else 0)
+        for b in data:
+            t += self._byte_us
+            self._rx.append((t, b))
+
+    def _take(self, nbytes):
+        now = self._sim.now_us
+        rx = self._rx
+        # bytes that arrived while the buffer was full were lost
+        n = 0
+        while n < len(rx) and rx[n][0] <= now:
+            n += 1
+        if n > self.receiver_buffer_size:
+            drop = n - self.receiver_buffer_size
+            self.overruns += drop
+            del rx[self.receiver_buffer_size:n]
+            n = self.receiver_buffer_size
+        n = min(n, nbytes)
+        data = bytes(b for _, b in rx[:n])
+        del rx[:n]
+        return data
+
+    def _read(self, nbytes):
+        sim = self._sim
+        sim.charge('uart.read')
+        data = self._take(nbytes)
+        if len(data) < nbytes and self.timeout:
+            # wait for more, until the timeout or the last byte that arrives in time
+            deadline = sim.now_us + int(self.timeout * 1000000)
+            need = nbytes - len(data)
+            if len(self._rx) >= need and self._rx[need - 1][0] <= deadline:
+                wait = self._rx[need - 1][0] - sim.now_us
+            else:
+                wait = deadline - sim.now_us
+            sim.advance(max(wait, 0))
+            data += self._take(need)
+        if data:
+            sim.charge('uart.byte', len(data))
+        return data
+
+    def read(self, nbytes=None):
+        data = self._read(nbytes or self.receiver_buffer_size)
+        return data or None
+
+    def readinto(self, buf, nbytes=None):
+        data = self._read(min(nbytes or len(buf), len(buf)))
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def readline(self):
+        return self.read()
+
+    @property
+    def in_waiting(self):
+        now = self._sim.now_us
+        n = 0
+        for t, _ in self._rx:
+            if t > now:
+                break
+            n += 1
+        return min(n, self.receiver_buffer_size)
+
+    def reset_input_buffer(self):
+        self._take(len(self._rx))
+
+    def write(self, buf):
+        self._sim.charge('midi.write')
+        self._sim.midi_out.append((self._sim.now_us, 'uart', bytes(buf)))
+        return len(buf)
+
+    def deinit(self):
+        if self in self._sim.uarts:
+            self._sim.uarts.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
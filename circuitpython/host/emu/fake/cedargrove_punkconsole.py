@@ -0,0 +1,13 @@
+# cedargrove_punkconsole.py -- emu stand-in for the cedargrove_punkconsole library
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+# Makes no sound, just keeps the settings.
+
+class PunkConsole:
+    def __init__(self, pin, frequency=1, pulse_width_ms=0, mute=False):
+        self.pin = pin
+        self.frequency = frequency
+        self.pulse_width_ms = pulse_width_ms
+        self.mute = mute
+
+    def deinit(self):
+        pass
@@ -0,0 +1,230 @@
+# displayio.py -- emu stand-in for CircuitPython's displayio
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Nothing is drawn. Changes just mark the display dirty, and a dirty
+# display with auto_refresh on refreshes in the background at up to
+# 60 fps, taking 'display.refresh' of main loop time like the real one.
+
+from emu import sim as _sim
+
+def _changed():
+    display = _sim.current().display
+    if display:
+        display._dirty = True
+
+class Group:
+    def __init__(self, *, scale=1, x=0, y=0):
+        self.scale = scale
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self._items = []
+
+    def append(self, item):
+        self._items.append(item)
+        _changed()
+
+    def insert(self, index, item):
+        self._items.insert(index, item)
+        _changed()
+
+    def remove(self, item):
+        self._items.remove(item)
+        _changed()
+
+    def pop(self, i=-1):
+        _changed()
+        return self._items.pop(i)
+
+    def index(self, item):
+        return self._items.index(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __setitem__(self, i, item):
+        self._items[i] = item
+        _changed()
+
+    def __delitem__(self, i):
+        del self._items[i]
+        _changed()
+
+    def __iter__(self):
+        return iter(self._items)
+
+class Bitmap:
+    def __init__(self, width, height, value_count):
+        self.width = width
+        self.height = height
+        self.value_count = value_count
+        self._data = bytearray(width * height)
+
+    def _index(self, i):
+        if isinstance(i, tuple):
+            return i[1] * self.width + i[0]
+        return i
+
+    def __getitem__(self, i):
+        return self._data[self._index(i)]
+
+    def __setitem__(self, i, value):
+        self._data[self._index(i)] = value
+        _changed()
+
+    def fill(self, value):
+        for i in range(len(self._data)):
+            self._data[i] = value
+        _changed()
+
+    def blit(self, x, y, source_bitmap, *, x1=0, y1=0, x2=None, y2=None, skip_index=None):
+        x2 = source_bitmap.width if x2 is None else x2
+        y2 = source_bitmap.height if y2 is None else y2
+        for sy in range(y1, y2):
+            for sx in range(x1, x2):
+                v = source_bitmap[sx, sy]
+                dx, dy = x + sx - x1, y + sy - y1
+                if v != skip_index and 0 <= dx < self.width and 0 <= dy < self.height:
+                    self._data[dy * self.width + dx] = v
+        _changed()
+
+    def dirty(self, x1=0, y1=0, x2=-1, y2=-1):
+        _changed()
+
+class Palette:
+    def __init__(self, color_count, *, dither=False):
+        self._colors = [0] * color_count
+        self._transparent = set()
+
+    def __len__(self):
+        return len(self._colors)
+
+    def __getitem__(self, i):
+        return self._colors[i]
+
+    def __setitem__(self, i, color):
+        self._colors[i] = color
+        _changed()
+
+    def make_transparent(self, i):
+        self._transparent.add(i)
+
+    def make_opaque(self, i):
+        self._transparent.discard(i)
+
+    def is_transparent(self, i):
+        return i in self._transparent
+
+class TileGrid:
+    def __init__(self, bitmap, *, pixel_shader, width=1, height=1, tile_width=None,
+                 tile_height=None, default_tile=0, x=0, y=0):
+        self.bitmap = bitmap
+        self.pixel_shader = pixel_shader
+        self.width = width
+        self.height = height
+        self.tile_width = tile_width or bitmap.width
+        self.tile_height = tile_height or bitmap.height
+        self.x = x
+        self.y = y
+        self.hidden = False
+        self._tiles = [default_tile] * (width * height)
+
+    def __getitem__(self, i):
+        if isinstance(i, tuple):
+            i = i[1] * self.width + i[0]
+        return self._tiles[i]
+
+    def __setitem__(self, i, tile):
+        if isinstance(i, tuple):
+            i = i[1] * self.width + i[0]
+        self._tiles[i] = tile
+        _changed()
+
+class Display:
+    """board.DISPLAY, the MacroPad's 128x64 OLED."""
+    def __init__(self, width, height):
+        self._width = width
+        self._height = height
+        self.rotation = 0
+        self.root_group = None
+        self.auto_refresh = True
+        self.brightness = 1.0
+        self.refresh_count = 0
+        self.refresh_times = []  # t_us each refresh started
+        self.shown = []  # text_lines() as of the last refresh, what's on the OLED
+        self._dirty = False
+        self._last_refresh_us = -1000000
+        self._last_call_us = 0  # last manual refresh() call, refreshed or not
+        self._first_manual = True
+        self._sim = _sim.current()
+        self._sim.display = self
+        self._sim.background.append(self._background)
+
+    @property
+    def width(self):
+        return self._height if self.rotation % 180 else self._width
+
+    @property
+    def height(self):
+        return self._width if self.rotation % 180 else self._height
+
+    def show(self, group):  # CircuitPython 8 and earlier
+        self.root_group = group
+        self._dirty = True
+
+    def _refresh(self):
+        self.refresh_times.append(self._sim.now_us)
+        self._last_refresh_us = self._sim.now_us
+        self._dirty = False
+        self.refresh_count += 1
+        self.shown = self.text_lines()
+        self._sim.charge('display.refresh')
+
+    def _background(self, now_us):
+        if self.auto_refresh and self._dirty and now_us - self._last_refresh_us >= 1000000 // 60:
+            self._refresh()
+
+    def refresh(self, *, target_frames_per_second=60, minimum_frames_per_second=0):
+        """As the real one does with auto_refresh off and a target frame rate,
+        after the first call: returns False without refreshing if it's been
+        more than a frame since the last call, otherwise waits until a frame
+        after the last refresh first.  target_frames_per_second=None always
+        refreshes, at once."""
+        now_us = self._sim.now_us
+        if not self.auto_refresh and not self._first_manual and target_frames_per_second:
+            frame_ms = 1000 // target_frames_per_second
+            since_call_ms = now_us // 1000 - self._last_call_us // 1000
+            self._last_call_us = now_us
+            if since_call_ms > frame_ms:  # skip to catch up
+                return False
+            wait_ms = frame_ms - (now_us // 1000 - self._last_refresh_us // 1000) % frame_ms
+            self._sim.advance(max(self._last_call_us + wait_ms * 1000 - now_us, 0))
+        self._first_manual = False
+        self._refresh()
+        return True
+
+    def text_lines(self):
+        """Text of every label on screen, one line per y position."""
+        labels = []
+        def walk(group, x, y):
+            for item in group:
+                if isinstance(item, Group):
+                    if not item.hidden:
+                        walk(item, x + item.x, y + item.y)
+                elif hasattr(item, 'text') and not getattr(item, 'hidden', False):
+                    labels.append((y + item.y, x + item.x, item.text))
+        if self.root_group is not None:
+            walk(self.root_group, 0, 0)
+        lines = {}
+        for y, x, text in sorted(labels):
+            line = lines.setdefault(y, [])
+            col = x // 6  # 6 pixel wide font
+            pad = col - len(''.join(line))
+            line.append(' ' * max(pad, 0) + text)
+        return [''.join(lines[y]) for y in sorted(lines)]
+
+def release_displays():
+    pass
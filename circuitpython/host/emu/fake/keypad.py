@@ -0,0 +1,88 @@
+# keypad.py -- emu stand-in for CircuitPython's keypad, fed by the Sim's script
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from emu import sim as _sim
+
+class Event:
+    def __init__(self, key_number=0, pressed=True, timestamp=None):
+        self.key_number = key_number
+        self.pressed = pressed
+        self.timestamp = timestamp
+
+    @property
+    def released(self):
+        return not self.pressed
+
+    def __eq__(self, other):
+        return (isinstance(other, Event) and self.key_number == other.key_number
+                and self.pressed == other.pressed)
+
+    def __hash__(self):
+        return hash((self.key_number, self.pressed))
+
+    def __repr__(self):
+        return "<Event: key_number %d %s>" % (self.key_number,
+                                             "pressed" if self.pressed else "released")
+
+class EventQueue:
+    def __init__(self, max_events):
+        self._events = []
+        self._max = max_events
+        self.overflowed = False
+
+    def get(self):
+        _sim.current().charge('keys.get')
+        return self._events.pop(0) if self._events else None
+
+    def get_into(self, event):
+        _sim.current().charge('keys.get')
+        if not self._events:
+            return False
+        e = self._events.pop(0)
+        event.key_number, event.pressed, event.timestamp = e.key_number, e.pressed, e.timestamp
+        return True
+
+    def clear(self):
+        self._events.clear()
+        self.overflowed = False
+
+    def __len__(self):
+        return len(self._events)
+
+    def __bool__(self):
+        return bool(self._events)
+
+    def _put(self, event):
+        if len(self._events) >= self._max:
+            self.overflowed = True
+        else:
+            self._events.append(event)
+
+class Keys:
+    def __init__(self, pins, *, value_when_pressed, pull=True, interval=0.02, max_events=64):
+        self.pins = pins
+        self.pin_names = [p.name for p in pins]
+        self.key_count = len(pins)
+        self.events = EventQueue(max_events)
+        self._pressed = [False] * len(pins)
+        self._sim = _sim.current()
+        self._sim.keys.append(self)
+
+    def _event(self, key_number, pressed):
+        if self._pressed[key_number] == pressed:
+            return
+        self._pressed[key_number] = pressed
+        self.events._put(Event(key_number, pressed, self._sim.ticks_ms(self._sim.script_us)))
+
+    def reset(self):
+        self._pressed = [False] * self.key_count
+
+    def deinit(self):
+        if self in self._sim.keys:
+            self._sim.keys.remove(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.deinit()
@@ -0,0 +1,70 @@
+# neopixel.py -- emu stand-in for the neopixel library, keeps every shown frame
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from emu import sim as _sim
+
+RGB = "RGB"
+GRB = "GRB"
+RGBW = "RGBW"
+GRBW = "GRBW"
+
+class NeoPixel:
+    def __init__(self, pin, n, *, bpp=3, brightness=1.0, auto_write=True, pixel_order=None):
+        self.pin = pin
+        self.n = n
+        self.bpp = bpp
+        self.brightness = brightness
+        self.auto_write = auto_write
+        self.buf = bytearray(n * bpp)
+        self.show_count = 0
+        self.frames = []  # (t_us, bytes of pixel colors before brightness), when changed
+        self._sim = _sim.current()
+        self._sim.pixels.append(self)
+
+    def __len__(self):
+        return self.n
+
+    def _set(self, i, v):
+        if i < 0:
+            i += self.n
+        if isinstance(v, int):
+            v = ((v >> 16) & 0xff, (v >> 8) & 0xff, v & 0xff)
+        self.buf[i*3:i*3+3] = bytes(int(c) & 0xff for c in v[:3])
+
+    def __setitem__(self, i, v):
+        if isinstance(i, slice):
+            for j, vv in zip(range(*i.indices(self.n)), v):
+                self._set(j, vv)
+        else:
+            self._set(i, v)
+        if self.auto_write:
+            self.show()
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.n))]
+        if i < 0:
+            i += self.n
+        return tuple(self.buf[i*3:i*3+3])
+
+    def __iter__(self):
+        for i in range(self.n):
+            yield self[i]
+
+    def fill(self, color):
+        for i in range(self.n):
+            self._set(i, color)
+        if self.auto_write:
+            self.show()
+
+    def show(self):
+        sim = self._sim
+        self.show_count += 1
+        frame = bytes(self.buf)
+        if not self.frames or self.frames[-1][1] != frame:
+            self.frames.append((sim.now_us, frame))
+        sim.charge('neopixel.show')
+        sim.charge('neopixel.pixel', self.n)
+
+    def deinit(self):
+        pass
@@ -0,0 +1,17 @@
+# noise.py -- emu stand-in for the noise module, smooth 1-D value noise in -1..1
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+# Not the same numbers as on the device, just something that wanders smoothly.
+
+import math
+
+def _hash(i):
+    i = (i * 1103515245 + 12345) & 0x7fffffff
+    i = ((i >> 13) ^ i) * 1274126177 & 0x7fffffff
+    return (i & 0xffff) / 32767.5 - 1.0
+
+def noise(x, y=0, z=0):
+    x += y * 31.7 + z * 17.3
+    i = math.floor(x)
+    f = x - i
+    f = f * f * (3 - 2 * f)
+    return _hash(i) * (1 - f) + _hash(i + 1) * f
@@ -0,0 +1,27 @@
+# rotaryio.py -- emu stand-in for CircuitPython's rotaryio, turned by the Sim's script
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from emu import sim as _sim
+
+class IncrementalEncoder:
+    def __init__(self, pin_a, pin_b, divisor=4):
+        self.divisor = divisor
+        self._position = 0
+        self._sim = _sim.current()
+        self._sim.encoders.append(self)
+
+    @property
+    def position(self):
+        self._sim.charge('encoder.position')
+        return self._position
+
+    @position.setter
+    def position(self, value):
+        self._position = value
+
+    def _turn(self, delta):
+        self._position += delta
+
+    def deinit(self):
+        if self in self._sim.encoders:
+            self._sim.encoders.remove(self)
@@ -0,0 +1,8 @@
+# simpleio.py -- emu stand-in for the simpleio library (just map_range)
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+def map_range(x, in_min, in_max, out_min, out_max):
+    mapped = (x - in_min) * (out_max - out_min) / (in_max - in_min) + out_min
+    if out_min <= out_max:
+        return max(min(mapped, out_max), out_min)
+    return min(max(mapped, out_max), out_min)
@@ -0,0 +1,12 @@
+# storage.py -- emu stand-in for CircuitPython's storage
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+# CIRCUITPY in the emulator is a plain directory, always writable.
+
+def remount(mount_path, readonly=False, *, disable_concurrent_write_protection=False):
+    pass
+
+def disable_usb_drive():
+    pass
+
+def enable_usb_drive():
+    pass
@@ -0,0 +1,25 @@
+# supervisor.py -- emu stand-in for CircuitPython's supervisor
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from emu import sim as _sim
+
+def ticks_ms():
+    s = _sim.current()
+    s.charge('clock')
+    return s.ticks_ms()
+
+class _Runtime:
+    serial_connected = True
+    usb_connected = True
+
+    @property
+    def serial_bytes_available(self):
+        return len(_sim.current().serial_in)
+
+runtime = _Runtime()
+
+def reload():
+    raise _sim.SimExit()
+
+def set_next_code_file(filename, **kwargs):
+    pass
@@ -0,0 +1,9 @@
+# terminalio.py -- emu stand-in for CircuitPython's terminalio
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+class _Font:
+    """The built-in 6x12 font, only its size matters to the emulator."""
+    def get_bounding_box(self):
+        return (6, 12)
+
+FONT = _Font()
@@ -0,0 +1,42 @@
+# usb_midi.py -- emu stand-in for CircuitPython's usb_midi
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+
+from emu import sim as _sim
+
+class PortIn:
+    def __init__(self):
+        self._buf = bytearray()
+        self._sim = _sim.current()
+
+    def _receive(self, data):
+        self._buf.extend(data)
+
+    def read(self, nbytes=None):
+        self._sim.charge('usb_midi.read')
+        n = len(self._buf) if nbytes is None else min(nbytes, len(self._buf))
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    def readinto(self, buf, nbytes=None):
+        data = self.read(min(nbytes or len(buf), len(buf)))
+        buf[:len(data)] = data
+        return len(data)
+
+class PortOut:
+    def __init__(self):
+        self._sim = _sim.current()
+
+    def write(self, buf):
+        self._sim.charge('midi.write')
+        self._sim.midi_out.append((self._sim.now_us, 'usb', bytes(buf)))
+        return len(buf)
+
+ports = (PortIn(), PortOut())
+_sim.current().usb_midi_in = ports[0]
+
+def disable():
+    pass
+
+def enable():
+    pass
@@ -0,0 +1,525 @@
+# emu/sim.py -- virtual clock, scripted input & captured output for the host emulator
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# The app's code.py is run with exec(), with emu/fake/ first on sys.path
+# and "time", "os", "gc" and open() swapped for versions that use the
+# virtual clock and map "/" to a copy of the app directory (the
+# CIRCUITPY drive), and "array" for one with the RP2040's item sizes.
+# Each fake hardware call advances the clock by its cost in COSTS_US,
+# and so does each line of the app's own Python that runs (counted with
+# sys.settrace, so only files in CIRCUITPY, not the fakes).  These are
+# rough numbers for CircuitPython 8 on the RP2040,
+# tune them to match measurements on hardware.  With cpu_scale,
+# host CPU time between clock advances is added too (times cpu_scale,
+# CircuitPython on RP2040 is something like 50-100x slower than CPython
+# on a desktop), which is closer to real but not deterministic.
+#
+
+import os, sys, gc, builtins, heapq, shutil, tempfile, traceback, types
+import time as _time
+
+_FAKE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake')
+_HOST_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # for audio_shim
+_real_open = builtins.open
+
+# microseconds of RP2040 time used by each fake call, see module comment
+COSTS_US = {
+    'line': 8,               # a line of app Python, set to 0 to run faster without tracing
+    'clock': 2,              # time.monotonic(), ticks_ms(), etc
+    'keys.get': 15,          # keypad events.get()
+    'encoder.position': 5,
+    'uart.read': 25,         # busio.UART read()/readinto() call, plus...
+    'uart.byte': 1,          # ...per byte read
+    'usb_midi.read': 30,
+    'midi.write': 20,
+    'neopixel.show': 30,     # plus neopixel.pixel for each pixel
+    'neopixel.pixel': 30,    # 24 bits at 800 kHz
+    'voice.play': 40,
+    'voice.stop': 10,
+    'voice.level': 5,
+    'label.text': 400,       # bitmap_label redraws its bitmap
+    'display.refresh': 6000, # whole OLED over SPI, done in the background when auto_refresh
+    'file.open': 1500,
+    'file.read_kb': 300,     # per 1024 bytes
+    'file.write_kb': 1000,
+    'file.flush': 4000,      # flash sector erase & write, as check_save_timing.py
+    'os.stat': 300,
+    'os.listdir': 1000,
+    'os.rename': 5000,
+    'os.remove': 3000,
+    'asyncio.switch': 150,   # asyncio running a task once, its loop is Python too
+}
+
+_current = None
+
+def current():
+    """The Sim that is running, for the fake modules."""
+    if _current is None:
+        raise RuntimeError("emu fake module used outside emu.run()")
+    return _current
+
+
+class SimExit(BaseException):
+    """Raised from the clock when the run's time is up. A BaseException
+    so "except Exception:" in the app doesn't catch it."""
+
+
+class Sim:
+    def __init__(self, seconds=10, costs=None, cpu_scale=0, quiet=False):
+        self.end_us = int(seconds * 1000000)
+        self.now_us = 0
+        self.costs = dict(COSTS_US)
+        if costs:
+            self.costs.update(costs)
+        self.cpu_scale = cpu_scale
+        self.quiet = quiet  # don't echo the app's print()s
+        self.calls = {}  # cost name -> number of calls
+        self.charged = {}  # cost name -> total microseconds
+        self.background = []  # callables run as time moves, like CircuitPython background tasks
+        self._script = []  # heap of (t_us, seq, fn, args)
+        self.script_us = 0  # when the scripted input being run was due, it may run a charge later
+        self._seq = 0
+        self._in_background = False
+        self._real_last = 0
+        self._frac = 0.0
+        self.root = None  # CIRCUITPY directory
+        self.error = None  # traceback text if the app raised
+        self.globals = {}  # the app's globals, to look at its state after a run
+        self.real_s = 0  # wall clock time of the run
+        self.warnings = []
+        # devices, registered by the fake modules as the app makes them
+        self.keys = []  # keypad.Keys
+        self.encoders = []  # rotaryio.IncrementalEncoder
+        self.uarts = []  # busio.UART
+        self.pixels = []  # neopixel.NeoPixel
+        self.mixers = []  # audiomixer.Mixer
+        self.display = None  # board.DISPLAY
+        self.usb_midi_in = None  # usb_midi.ports[0]
+        self.serial_in = bytearray()  # typed on the serial console, not read yet
+        self.midi_out = []  # (t_us, port name, bytes) written to UART or USB MIDI
+
+    # the first of each, for convenience
+    @property
+    def leds(self):
+        return self.pixels[0] if self.pixels else None
+
+    @property
+    def mixer(self):
+        return self.mixers[0] if self.mixers else None
+
+    #
+    # virtual clock
+    #
+
+    def charge(self, name, count=1):
+        """Advance the clock by the cost of a fake call."""
+        us = self.costs[name] * count
+        if us != int(us):  # e.g. small file writes, charged once they add up to a microsecond
+            us += self._frac
+            self._frac = us - int(us)
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.charged[name] = self.charged.get(name, 0) + us
+        self.advance(us)
+
+    def advance(self, us):
+        if self.cpu_scale:
+            t = _time.perf_counter()
+            us += int((t - self._real_last) * 1000000 * self.cpu_scale)
+            self._real_last = t
+        self.now_us += int(us)
+        script = self._script
+        while script and script[0][0] <= self.now_us:
+            self.script_us, _, fn, args = heapq.heappop(script)
+            fn(*args)
+        if not self._in_background:
+            self._in_background = True
+            try:
+                for task in self.background:
+                    task(self.now_us)
+            finally:
+                self._in_background = False
+        if self.now_us >= self.end_us:
+            raise SimExit()
+
+    def ticks_ms(self, us=None):
+        return ((self.now_us if us is None else us) // 1000) & ((1 << 29) - 1)
+
+    #
+    # scripted input, times in milliseconds from start of run
+    #
+
+    def at(self, t_ms, fn, *args):
+        """Call fn(*args) once virtual time reaches t_ms."""
+        heapq.heappush(self._script, (int(t_ms * 1000), self._seq, fn, args))
+        self._seq += 1
+
+    def key(self, t_ms, keynum, pressed):
+        """Press or release MacroPad key 0-11 (board.KEY1-KEY12)."""
+        self.at(t_ms, self._pin_event, "KEY%d" % (keynum + 1), pressed)
+
+    def tap(self, t_ms, keynum, hold_ms=50):
+        self.key(t_ms, keynum, True)
+        self.key(t_ms + hold_ms, keynum, False)
+
+    def encoder_switch(self, t_ms, pressed):
+        self.at(t_ms, self._pin_event, "ENCODER_SWITCH", pressed)
+
+    def turn(self, t_ms, delta):
+        """Turn the encoder delta detents."""
+        self.at(t_ms, self._turn, delta)
+
+    def midi(self, t_ms, data, port='uart'):
+        """MIDI bytes into the MacroPadSynthPlug UART ('uart') or USB ('usb')."""
+        self.at(t_ms, self._midi, bytes(data), port)
+
+    def serial(self, t_ms, text):
+        """Type text on the serial console (sys.stdin)."""
+        self.at(t_ms, self.serial_in.extend, text.encode())
+
+    def warn(self, msg):
+        self.warnings.append((self.now_us, msg))
+        print("emu: %8.3f %s" % (self.now_us / 1e6, msg), file=sys.stderr)
+
+    def _pin_event(self, pin_name, pressed):
+        for keys in self.keys:
+            if pin_name in keys.pin_names:
+                keys._event(keys.pin_names.index(pin_name), pressed)
+                return
+        self.warn("no keypad.Keys for %s yet, event dropped" % pin_name)
+
+    def _turn(self, delta):
+        if not self.encoders:
+            self.warn("no rotaryio.IncrementalEncoder yet, turn dropped")
+        for enc in self.encoders:
+            enc._turn(delta)
+
+    def _midi(self, data, port):
+        if port == 'usb':
+            if self.usb_midi_in is None:
+                self.warn("usb_midi not imported yet, MIDI dropped")
+            else:
+                self.usb_midi_in._receive(data)
+            return
+        uarts = [u for u in self.uarts if u.rx is not None]
+        if not uarts:
+            self.warn("no busio.UART with rx yet, MIDI dropped")
+        for u in uarts:
+            u._receive(data)
+
+    #
+    # CIRCUITPY filesystem
+    #
+
+    def path(self, path):
+        """Map an absolute CircuitPython path into the CIRCUITPY directory."""
+        if (isinstance(path, str) and path.startswith('/') and self.root
+                and path != self.root and not path.startswith(self.root + '/')):
+            return self.root + path
+        return path
+
+    def open(self, file, mode='r', *args, **kwargs):
+        self.charge('file.open')
+        return _File(self, _real_open(self.path(file), mode, *args, **kwargs))
+
+    #
+    # results
+    #
+
+    def summary(self):
+        lines = ["virtual %.3f s in %.3f s real (%.1fx)" % (
+            self.now_us / 1e6, self.real_s, self.now_us / 1e6 / max(self.real_s, 1e-9))]
+        for name in sorted(self.charged, key=self.charged.get, reverse=True):
+            lines.append("  %-18s %8d calls %10.3f s" % (
+                name, self.calls[name], self.charged[name] / 1e6))
+        for p in self.pixels:
+            lines.append("neopixel: %d shows, %d distinct frames" % (p.show_count, len(p.frames)))
+        for m in self.mixers:
+            plays = sum(1 for e in m.events if e[2] == 'play')
+            lines.append("mixer: %d voice plays" % plays)
+        if self.display:
+            lines.append("display: %d refreshes" % self.display.refresh_count)
+            lines.extend("  | " + s for s in self.display.text_lines())
+        if self.midi_out:
+            lines.append("midi out: %d writes" % len(self.midi_out))
+        return "\n".join(lines)
+
+
+class _File:
+    """File object that charges flash time for reads & writes."""
+    def __init__(self, sim, fp):
+        self._sim = sim
+        self._fp = fp
+
+    def read(self, *args):
+        data = self._fp.read(*args)
+        self._sim.charge('file.read_kb', len(data) / 1024)
+        return data
+
+    def readinto(self, buf):
+        n = self._fp.readinto(buf)
+        self._sim.charge('file.read_kb', (n or 0) / 1024)
+        return n
+
+    def readline(self, *args):
+        data = self._fp.readline(*args)
+        self._sim.charge('file.read_kb', len(data) / 1024)
+        return data
+
+    def write(self, data):
+        self._sim.charge('file.write_kb', len(data) / 1024)
+        return self._fp.write(data)
+
+    def flush(self):
+        self._sim.charge('file.flush')
+        self._fp.flush()
+
+    def close(self):
+        if not self._fp.closed and self._fp.writable():
+            self.flush()
+        self._fp.close()
+
+    def __iter__(self):
+        return iter(self.readline, self._fp.read(0))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self._fp, name)
+
+
+class _Stdin:
+    """sys.stdin reading what was typed with Sim.serial(), waits for it like the REPL."""
+    def __init__(self, sim):
+        self._sim = sim
+
+    def read(self, n=1):
+        sim = self._sim
+        while len(sim.serial_in) < n:
+            sim.advance(1000)
+        data = sim.serial_in[:n]
+        del sim.serial_in[:n]
+        return data.decode()
+
+
+def _make_time(sim):
+    m = types.ModuleType('time')
+    m.__dict__.update({k: v for k, v in _time.__dict__.items() if not k.startswith('__')})
+    epoch = int(_time.time())
+
+    def monotonic():
+        sim.charge('clock')
+        return sim.now_us / 1000000
+
+    def monotonic_ns():
+        sim.charge('clock')
+        return sim.now_us * 1000
+
+    def sleep(seconds):
+        sim.charge('clock')
+        sim.advance(int(seconds * 1000000))
+
+    def time():
+        return epoch + sim.now_us // 1000000
+
+    m.monotonic, m.monotonic_ns, m.sleep, m.time = monotonic, monotonic_ns, sleep, time
+    return m
+
+
+def _make_os(sim):
+    m = types.ModuleType('os')
+    m.__dict__.update({k: v for k, v in os.__dict__.items() if not k.startswith('__')})
+
+    def listdir(path='.'):
+        sim.charge('os.listdir')
+        return os.listdir(sim.path(path))
+
+    def stat(path):
+        sim.charge('os.stat')
+        st = os.stat(sim.path(path))
+        return tuple(int(v) for v in st[:10])  # CircuitPython returns a plain tuple
+
+    def remove(path):
+        sim.charge('os.remove')
+        os.remove(sim.path(path))
+
+    def rename(old, new):
+        sim.charge('os.rename')
+        if os.path.exists(sim.path(new)):  # FAT can't rename over a file
+            raise OSError(17, "File exists")
+        os.rename(sim.path(old), sim.path(new))
+
+    def mkdir(path):
+        os.mkdir(sim.path(path))
+
+    def rmdir(path):
+        os.rmdir(sim.path(path))
+
+    def getcwd():
+        return '/' + os.path.relpath(os.getcwd(), sim.root).replace('.', '')
+
+    def sync():
+        pass
+
+    for f in (listdir, stat, remove, rename, mkdir, rmdir, getcwd, sync):
+        setattr(m, f.__name__, f)
+    return m
+
+
+def _make_gc(sim):
+    m = types.ModuleType('gc')
+    m.__dict__.update({k: v for k, v in gc.__dict__.items() if not k.startswith('__')})
+    m.mem_free = lambda: 120 * 1024  # no real heap to measure, about what a MacroPad has free
+    m.mem_alloc = lambda: 60 * 1024
+    return m
+
+def _make_array():
+    # CircuitPython's on the RP2040: 'l' & 'L' are 32 bits (as 'i' & 'I' are
+    # here, not CPython's 64), so a value that won't fit raises OverflowError
+    import array as _array
+    m = types.ModuleType('array')
+    sizes = {'l': 'i', 'L': 'I'}
+    def array(typecode, *args):
+        return _array.array(sizes.get(typecode, typecode), *args)
+    m.array = array
+    return m
+
+
+def _app_module_names(root):
+    names = set()
+    for d in (_FAKE_DIR, root, os.path.join(root, 'lib')):
+        if not os.path.isdir(d):
+            continue
+        for f in os.listdir(d):
+            if f.endswith('.py') or os.path.isdir(os.path.join(d, f)):
+                names.add(f[:-3] if f.endswith('.py') else f)
+    return names
+
+def _purge(names):
+    for mod in list(sys.modules):
+        if mod.split('.')[0] in names:
+            del sys.modules[mod]
+
+
+def run(app_dir, sim=None, root=None, main='code.py'):
+    """Run app_dir/code.py until sim's time is up, returns the Sim.
+    The app runs in a copy of app_dir, unless root is given to use as CIRCUITPY."""
+    global _current
+    sim = sim or Sim()
+    tmpdir = None
+    if root is None:
+        tmpdir = tempfile.mkdtemp(prefix='emu_')
+        root = os.path.join(tmpdir, 'CIRCUITPY')
+        shutil.copytree(app_dir, root, ignore=shutil.ignore_patterns('__pycache__', '*.pyc'))
+    sim.root = os.path.abspath(root)
+    names = _app_module_names(sim.root)
+    saved_path = sys.path[:]
+    saved_mods = {m: sys.modules[m] for m in ('time', 'os', 'gc', 'array') if m in sys.modules}
+    saved_cwd = os.getcwd()
+    saved_stdin = sys.stdin
+    before = set(sys.modules)
+    _purge(names)
+    _current = sim
+    real_start = sim._real_last = _time.perf_counter()
+    try:
+        sys.path[:0] = [_FAKE_DIR, sim.root, os.path.join(sim.root, 'lib'), _HOST_DIR]
+        sys.modules['time'] = _make_time(sim)
+        sys.modules['os'] = _make_os(sim)
+        sys.modules['gc'] = _make_gc(sim)
+        sys.modules['array'] = _make_array()
+        builtins.open = sim.open
+        sys.stdin = _Stdin(sim)
+        os.chdir(sim.root)
+        if sim.quiet:
+            builtins.print = _quiet_print
+        if sim.costs['line']:
+            sys.settrace(_line_tracer(sim))
+        path = os.path.join(sim.root, main)
+        sim.globals = {'__name__': '__main__', '__file__': path, '__builtins__': builtins}
+        try:
+            with _real_open(path) as fp:
+                code = compile(fp.read(), path, 'exec')
+            exec(code, sim.globals)
+        except SimExit:
+            pass
+        except Exception:  # app crashed, as the REPL would show it
+            sim.error = traceback.format_exc()
+            print(sim.error, file=sys.stderr, end='')
+    finally:
+        sys.settrace(None)
+        sim.real_s = _time.perf_counter() - real_start
+        builtins.open = _real_open
+        builtins.print = _real_print
+        sys.stdin = saved_stdin
+        os.chdir(saved_cwd)
+        sys.path[:] = saved_path
+        sys.modules.update(saved_mods)
+        for mod in set(sys.modules) - before:  # anything imported with the fakes in place
+            del sys.modules[mod]
+        _purge(names)
+        _current = None
+        if tmpdir:
+            shutil.rmtree(tmpdir)
+    return sim
+
+def _line_tracer(sim):
+    # charge 'line' for every line run in files on CIRCUITPY
+    root = sim.root + '/'
+    def trace_lines(frame, event, arg):
+        if event == 'line':
+            sim.charge('line')
+        return trace_lines
+    def trace_calls(frame, event, arg):
+        if frame.f_code.co_filename.startswith(root):
+            return trace_lines
+        return None
+    return trace_calls
+
+_real_print = builtins.print
+
+def _quiet_print(*args, **kwargs):
+    if kwargs.get('file') not in (None, sys.stdout):
+        _real_print(*args, **kwargs)
+
+
+def load_script(sim, path):
+    """Add input from a script file to sim. Each line is
+        TIME_MS ACTION ARGS...   # comment
+    with actions:
+        key N down|up       MacroPad key N (0-11)
+        tap N [HOLD_MS]     key N down, then up after HOLD_MS (50)
+        encsw down|up       encoder switch
+        turn DELTA          encoder
+        midi uart|usb HEX.. MIDI bytes, e.g. "midi uart 90 24 64"
+        serial TEXT         type TEXT on the serial console
+        end                 stop the run here
+    """
+    with _real_open(path) as fp:
+        for lineno, line in enumerate(fp, 1):
+            words = line.split('#')[0].split()
+            if not words:
+                continue
+            try:
+                t, action, args = float(words[0]), words[1], words[2:]
+                if action == 'key':
+                    sim.key(t, int(args[0]), args[1] == 'down')
+                elif action == 'tap':
+                    sim.tap(t, int(args[0]), float(args[1]) if len(args) > 1 else 50)
+                elif action == 'encsw':
+                    sim.encoder_switch(t, args[0] == 'down')
+                elif action == 'turn':
+                    sim.turn(t, int(args[0]))
+                elif action == 'midi':
+                    sim.midi(t, bytes(int(b, 16) for b in args[1:]), args[0])
+                elif action == 'serial':
+                    sim.serial(t, ' '.join(args))
+                elif action == 'end':
+                    sim.end_us = int(t * 1000)
+                else:
+                    raise ValueError("unknown action " + action)
+            except (IndexError, ValueError) as error:
+                raise ValueError("%s:%d: %s" % (path, lineno, error))
+    return sim
@@ -0,0 +1,174 @@
+# fuzz_midi.py -- host-side fuzz/property checks for the todbot_smolishmidi decoder
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Generates random MIDI streams (with and without running status, realtime
+# bytes injected mid-message, SysEx), splits them into random-sized reads,
+# and checks that MidiIn.receive_all() decodes exactly what was sent, and
+# with a random channel_mask & note_filter, exactly what those let through.
+# Also throws random garbage at it to make sure it never raises.
+#
+# Usage:
+#   python3 fuzz_midi.py [iterations] [seed]
+#
+
+import os, sys, random
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+import todbot_smolishmidi as smolmidi
+
+from bench_midi import StreamPort
+
+_CHANNEL_TYPES = ((smolmidi.NOTE_OFF, 2), (smolmidi.NOTE_ON, 2), (smolmidi.AFTERTOUCH, 2),
+                  (smolmidi.CC, 2), (smolmidi.PROGRAM_CHANGE, 1),
+                  (smolmidi.CHANNEL_PRESSURE, 1), (smolmidi.PITCH_BEND, 2))
+_COMMON_TYPES = ((smolmidi.SONG_POSITION, 2), (smolmidi.SONG_SELECT, 1), (smolmidi.TUNE_REQUEST, 0))
+_REALTIME = (smolmidi.CLOCK, smolmidi.START, smolmidi.CONTINUE, smolmidi.STOP,
+             smolmidi.ACTIVE_SENSING)
+
+
+def make_stream(rand, num_msgs, running_status, sysex_size):
+    """Returns (stream bytes, expected list of (type, channel, data, sysex))"""
+    stream = bytearray()
+    expected = []
+    last_status = 0
+    for _ in range(num_msgs):
+        r = rand.random()
+        if r < 0.7:
+            mtype, dlen = rand.choice(_CHANNEL_TYPES)
+            chan = rand.randrange(16)
+            data = bytes(rand.randrange(128) for _ in range(dlen))
+            status = mtype | chan
+            msg_bytes = (bytes() if running_status and status == last_status else bytes((status,))) + data
+            last_status = status
+            exp = (mtype, chan, data + bytes(2 - dlen), None)
+        elif r < 0.85:
+            mtype, dlen = rand.choice(_COMMON_TYPES)
+            data = bytes(rand.randrange(128) for _ in range(dlen))
+            msg_bytes = bytes((mtype,)) + data
+            last_status = 0  # system common cancels running status
+            exp = (mtype, None, data + bytes(2 - dlen), None)
+        elif r < 0.95:
+            msg_bytes = bytes((rand.choice(_REALTIME),))
+            exp = (msg_bytes[0], None, bytes(2), None)
+        else:
+            syx = bytes(rand.randrange(128) for _ in range(rand.randrange(sysex_size + 1)))
+            last_status = 0
+            if rand.random() < 0.5:
+                msg_bytes = bytes((smolmidi.SYSEX,)) + syx + bytes((smolmidi.SYSEX_END,))
+                exp = (smolmidi.SYSEX, None, bytes(2), syx)
+            else:  # sysex ended by the next status byte instead of SYSEX_END
+                msg_bytes = bytes((smolmidi.SYSEX,)) + syx + bytes((smolmidi.TUNE_REQUEST,))
+                exp = [(smolmidi.SYSEX, None, bytes(2), syx),
+                       (smolmidi.TUNE_REQUEST, None, bytes(2), None)]
+
+        # maybe inject a realtime byte in the middle of the message
+        if len(msg_bytes) > 1 and rand.random() < 0.2:
+            rt = rand.choice(_REALTIME)
+            pos = rand.randrange(1, len(msg_bytes))
+            msg_bytes = msg_bytes[:pos] + bytes((rt,)) + msg_bytes[pos:]
+            expected.append((rt, None, bytes(2), None))
+        stream += msg_bytes
+        if isinstance(exp, list):
+            expected.extend(exp)
+        else:
+            expected.append(exp)
+    return bytes(stream), expected
+
+
+def decode(stream, rand, running_status, sysex_size, channel_mask=0xFFFF, note_filter=None):
+    """Returns (list of (type, channel, data, sysex), the MidiIn)"""
+    port = StreamPort(stream, chunk_min=1, chunk_max=rand.randint(1, 40), seed=rand.random())
+    midi_in = smolmidi.MidiIn(port, enable_running_status=running_status,
+                              buffer_size=rand.choice((16, 64, 256)),
+                              max_messages=rand.randint(1, 16), sysex_size=sysex_size,
+                              channel_mask=channel_mask, note_filter=note_filter)
+    got = []
+    idle = 0
+    while idle < 3:
+        n = midi_in.receive_all()
+        idle = idle + 1 if (n == 0 and port.done()) else 0
+        for j in range(n):
+            m = midi_in.messages[j]
+            syx = None
+            if m.type == smolmidi.SYSEX:
+                assert j == n - 1, "sysex must be last message of receive_all()"
+                syx = bytes(midi_in.sysex[:midi_in.sysex_len])
+            got.append((m.type, m.channel, bytes(m.data), syx))
+    return got, midi_in
+
+
+def check_roundtrip(rand):
+    running_status = rand.random() < 0.5
+    sysex_size = 32
+    stream, expected = make_stream(rand, rand.randint(1, 200), running_status, sysex_size)
+    got, midi_in = decode(stream, rand, running_status, sysex_size)
+    errors = midi_in.error_count
+    if got != expected or errors:
+        print("MISMATCH running_status=%s errors=%d" % (running_status, errors))
+        print(" stream:  ", stream.hex())
+        for i, (g, e) in enumerate(zip(got, expected)):
+            if g != e:
+                print(" first diff at msg %d: got %r expected %r" % (i, g, e))
+                break
+        print(" got %d msgs, expected %d" % (len(got), len(expected)))
+        return False
+    return True
+
+
+def check_filtered(rand):
+    running_status = rand.random() < 0.5
+    channel_mask = rand.randrange(0x10000)
+    note_filter = bytearray(rand.choice((0, 0xFF)) for _ in range(128))
+    stream, expected = make_stream(rand, rand.randint(1, 200), running_status, 32)
+    def wanted(mtype, chan, data, _):
+        if chan is not None and not (channel_mask >> chan) & 1:
+            return False
+        return mtype not in (smolmidi.NOTE_ON, smolmidi.NOTE_OFF) or note_filter[data[0]] != 0xFF
+    kept = [e for e in expected if wanted(*e)]
+    got, midi_in = decode(stream, rand, running_status, 32, channel_mask, note_filter)
+    if got != kept or midi_in.filtered != len(expected) - len(kept) or midi_in.error_count:
+        print("FILTER MISMATCH running_status=%s channel_mask=%04x: got %d msgs, expected %d, %d filtered of %d" % (
+            running_status, channel_mask, len(got), len(kept), midi_in.filtered, len(expected) - len(kept)))
+        print(" stream:  ", stream.hex())
+        return False
+    return True
+
+
+def check_garbage(rand):
+    stream = bytes(rand.randrange(256) for _ in range(rand.randint(0, 300)))
+    got, _ = decode(stream, rand, rand.random() < 0.5, 8)
+    for mtype, chan, data, _ in got:  # whatever comes out must be well-formed
+        if data[0] & 0x80 or data[1] & 0x80 or not mtype & 0x80:
+            print("BAD MESSAGE from garbage:", stream.hex(), (mtype, chan, data))
+            return False
+    return True
+
+
+def check_running_status_savings():
+    # 16 CCs on one channel, as a knob sweep sends them
+    ccs = [(smolmidi.CC, 74, v) for v in range(0, 128, 8)]
+    plain = sum(3 for _ in ccs)
+    running = 3 + 2 * (len(ccs) - 1)
+    print("running status: %d bytes vs %d bytes (%d%% fewer)" %
+          (running, plain, 100 - running * 100 // plain))
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+    rand = random.Random(seed)
+    failures = 0
+    for i in range(iterations):
+        if not check_roundtrip(rand):
+            failures += 1
+        if not check_filtered(rand):
+            failures += 1
+        if not check_garbage(rand):
+            failures += 1
+    print("%d iterations, seed %d: %d failures" % (iterations, seed, failures))
+    check_running_status_savings()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+# make_kit_index.py -- build the drum kit index on a computer
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Writes kits_index.json into a drumkits directory, checking every WAV
+# header, so the drum machine doesn't have to scan kits at boot.
+# Point it at the drumkits dir on your CIRCUITPY drive after copying kits.
+#
+# Usage:
+#   python3 make_kit_index.py [/path/to/CIRCUITPY/drumkits]
+#
+
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine'))
+import drum_kitindex
+
+num_pads = 8
+
+def main():
+    kit_root = sys.argv[1] if len(sys.argv) > 1 else \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drum_machine', 'drumkits')
+    kit_root = kit_root.rstrip('/')
+    t = time.perf_counter()
+    index = drum_kitindex.build_index(kit_root, num_pads)
+    build_ms = (time.perf_counter() - t) * 1000
+    path = kit_root + "/" + drum_kitindex.INDEX_NAME
+    drum_kitindex.save_index(index, path)
+    index['root_mtime'] = os.stat(kit_root)[8]  # writing the index may change dir mtime
+    drum_kitindex.save_index(index, path)
+
+    for kit in index['kits']:
+        total = sum(s[1] for s in kit['samples'])
+        longest = max(s[2] for s in kit['samples'])
+        print("%-16s %2d samples %7d bytes, longest %5d ms" %
+              (kit['name'], len(kit['samples']), total, longest))
+    for kname, problem, _, _, _ in index['rejected']:
+        print("%-16s REJECTED: %s" % (kname, problem))
+
+    t = time.perf_counter()
+    current = drum_kitindex.index_is_current(drum_kitindex.load_index(path), kit_root, num_pads)
+    check_ms = (time.perf_counter() - t) * 1000
+    print("wrote %s (scan+check %.1f ms, boot-time check %.1f ms, current: %s)" %
+          (path, build_ms, check_ms, current))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# run_emu.py -- run a CircuitPython app's code.py on the host emulator
+# part of MacroPadSynthPlug project: https://github.com/todbot/macropadsynthplug
+#
+# Runs the unmodified code.py of an app directory (e.g. ../drum_machine)
+# with the emu/ stand-ins for the MacroPad hardware, on a virtual clock,
+# feeding it key presses, encoder turns and MIDI from a script (see
+# emu.load_script() for the format, and emu_scripts/ for examples).
+# Prints where the virtual time went, what's on the display at the end,
+# and can save the audio the mixer would have played and the LED frames.
+#
+# Usage:
+#   python3 run_emu.py APP_DIR [--main code.py] [--script FILE] [--seconds 10] [--quiet]
+#                      [--wav out.wav] [--leds out.txt] [--cpu-scale N]
+# e.g.
+#   python3 run_emu.py ../drum_machine --script emu_scripts/drum_play.txt --wav drums.wav
+#
+
+import sys, argparse
+
+import emu
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Run a CircuitPython app on the host emulator")
+    ap.add_argument('app_dir')
+    ap.add_argument('--main', default='code.py', help="file to run in APP_DIR (default code.py)")
+    ap.add_argument('--script', help="input script, see emu.load_script()")
+    ap.add_argument('--seconds', type=float, default=10, help="virtual seconds to run (default 10)")
+    ap.add_argument('--quiet', action='store_true', help="don't show the app's print()s")
+    ap.add_argument('--wav', help="save the mixer's output to this WAV file")
+    ap.add_argument('--leds', help="save LED frames to this file, one 't_ms RRGGBB ...' line per frame")
+    ap.add_argument('--cpu-scale', type=float, default=0,
+                    help="also count host CPU time times this (not deterministic)")
+    args = ap.parse_args()
+
+    sim = emu.Sim(seconds=args.seconds, cpu_scale=args.cpu_scale, quiet=args.quiet)
+    if args.script:
+        emu.load_script(sim, args.script)
+    emu.run(args.app_dir, sim, main=args.main)
+
+    print(sim.summary())
+    if args.wav and sim.mixer:
+        n = sim.mixer.write_wav(args.wav)
+        print("wrote %s, %.2f s" % (args.wav, n / sim.mixer.sample_rate))
+    if args.leds and sim.leds:
+        with open(args.leds, 'w') as fp:
+            for t, frame in sim.leds.frames:
+                fp.write("%9.3f %s\n" % (t / 1000, ' '.join(frame[i:i+3].hex() for i in range(0, len(frame), 3))))
+        print("wrote %s, %d frames" % (args.leds, len(sim.leds.frames)))
+    if sim.error:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,14 +3,18 @@
 #
 # Remix an existing sample using macropad
 #
+# Set measure_latency = True to time key presses & MIDI note-ons to their
+# voice starting to fade up, printed to the serial console every
+# latency_report_secs (min, mean, p99, max).
+#
 
-import time
+import time, array
 import board, busio, keypad, rotaryio, neopixel
 import displayio, terminalio
 import usb_midi
 import audiocore, audiomixer, audiopwmio
 from adafruit_display_text import bitmap_label as label
-#from adafruit_ticks import ticks_ms, ticks_diff, ticks_add
+from adafruit_ticks import ticks_ms, ticks_diff
 import adafruit_midi
 from adafruit_midi.note_on import NoteOn
 from adafruit_midi.note_off import NoteOff
@@ -52,14 +56,22 @@ keys = keypad.Keys(key_pins, value_when_pressed=False, pull=True)
 encoder = rotaryio.IncrementalEncoder(board.ENCODER_B, board.ENCODER_A)  # yes, reversed
 encoder_switch = keypad.Keys((board.ENCODER_SWITCH,), value_when_pressed=False, pull=True)
 
+# Mixer buffer bytes: a change is heard one to two buffers later (2048 is 46 ms at
+# 22050 Hz), smaller risks underruns.  Every voice here is a WaveFile read from flash
+# as it's mixed, so this stays bigger than the drum machine's (see drum_latency.py there)
+mixer_buffer_size = 2048
+
 num_voices = len(wav_files)
 audio = audiopwmio.PWMAudioOut(board.SDA) # macropadsynthplug!
 mixer = audiomixer.Mixer(voice_count=num_voices, sample_rate=22050, channel_count=1,
-                         bits_per_sample=16, samples_signed=True, buffer_size=2048)
+                         bits_per_sample=16, samples_signed=True, buffer_size=mixer_buffer_size)
 audio.play(mixer) # attach mixer to audio playback
 
 vol_max = 0.48
 
+measure_latency = False  # time key & MIDI note-on to sound, see top
+latency_report_secs = 10
+
 # display setup begin
 display = board.DISPLAY
 display.rotation = 90
@@ -92,9 +104,41 @@ for i in range(num_voices):
 keys_pressed = [False] * num_voices
 last_key_time = time.monotonic()
 
-def trigger_note(kind,note,vel):
+# key & MIDI note-on to sound times, in counters allocated up front
+# (like drum_machine/drum_prof.py's LatencyMeter, but in ms)
+press_millis = [None] * num_voices  # when each voice's key or note-on came, until it sounds
+lat_hist = array.array('L', [0] * 128)  # 1 ms bins, last is everything longer
+lat_stats = array.array('L', [0, 0, 0, 0])  # count, total, min, max ms
+last_lat_report = time.monotonic()
+
+def latency_add(ms):
+    if not lat_stats[0] or ms < lat_stats[2]:
+        lat_stats[2] = ms
+    lat_stats[3] = max(lat_stats[3], ms)
+    lat_stats[0] += 1
+    lat_stats[1] += ms
+    lat_hist[min(ms, len(lat_hist) - 1)] += 1
+
+def latency_report():
+    count, total, lo, hi = lat_stats
+    need, n, p99 = (count * 99 + 99) // 100, 0, hi
+    for i in range(len(lat_hist)):
+        n += lat_hist[i]
+        if n >= need:
+            p99 = min(i + 1, hi)
+            break
+    print("latency: %d notes, to sound min %d mean %d p99 %d max %d ms" % (
+        count, lo, total // count if count else 0, p99, hi))
+    for i in range(len(lat_hist)):
+        lat_hist[i] = 0
+    for i in range(len(lat_stats)):
+        lat_stats[i] = 0
+
+def trigger_note(kind,note,vel,t_millis=None):
     n = note % 12
     keys_pressed[n] = True if vel > 0 else False
+    if measure_latency:  # released before it sounded isn't counted
+        press_millis[n] = (ticks_ms() if t_millis is None else t_millis) if vel > 0 else None
     text_rcv_val.text = f"{kind} {note} {vel}"
 
 def midi_receive():
@@ -124,11 +168,18 @@ while True:
             if k: vinc = -vinc
             voice = mixer.voice[i]
             voice.level = min(max(voice.level + vinc, 0), vol_max) # constrain 0-vol_max
+            if k and press_millis[i] is not None:  # starting to fade up
+                latency_add(ticks_diff(ticks_ms(), press_millis[i]))
+                press_millis[i] = None
             leds[i] = (voice.level * 255, 0, voice.level * 255)
         #     print("%0.1f " % voice.level, end='')
         # print()
         leds.show()
 
+    if measure_latency and time.monotonic() - last_lat_report > latency_report_secs:
+        last_lat_report = time.monotonic()
+        latency_report()
+
     # Encoder turning
     encoder_val = encoder.position
     if encoder_val != encoder_val_last:
@@ -156,7 +207,7 @@ while True:
     print("key!",keynum, key.pressed)
 
     if key.pressed:
-        trigger_note('k', keynum, 127)
+        trigger_note('k', keynum, 127, key.timestamp)
 
     if key.released:
         trigger_note('k', keynum, 0)